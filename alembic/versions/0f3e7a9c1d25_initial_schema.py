@@ -0,0 +1,67 @@
+"""initial schema: users, chat_messages and soul_settings
+
+Revision ID: 0f3e7a9c1d25
+Revises:
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0f3e7a9c1d25'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # databases created by init_db() already have these tables; leave them as they are
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("username", sa.String(50)),
+            sa.Column("email", sa.String(254), nullable=False),
+            sa.Column("hashed_password", sa.String(255), nullable=False),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+    if "chat_messages" not in existing:
+        op.create_table(
+            "chat_messages",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("role", sa.String(20), nullable=False),
+            sa.Column("content", sa.Text(), nullable=False),
+            sa.Column("timestamp", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_chat_messages_id", "chat_messages", ["id"])
+        op.create_index("ix_chat_messages_user_id", "chat_messages", ["user_id"])
+        op.create_index("ix_chat_messages_timestamp", "chat_messages", ["timestamp"])
+    if "soul_settings" not in existing:
+        op.create_table(
+            "soul_settings",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, unique=True),
+            sa.Column("empathy_level", sa.Integer()),
+            sa.Column("tone", sa.String()),
+            sa.Column("reasoning_depth", sa.Integer()),
+            sa.Column("memory_aggressiveness", sa.Integer()),
+            sa.Column("boundaries", sa.String(500)),
+            sa.Column("creativity_level", sa.Integer()),
+        )
+        op.create_index("ix_soul_settings_id", "soul_settings", ["id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("soul_settings")
+    op.drop_table("chat_messages")
+    op.drop_table("users")
@@ -0,0 +1,47 @@
+"""composite (user_id, timestamp, id) index for keyset history paging
+
+Revision ID: 3c9e2f1a7b40
+Revises: 0f3e7a9c1d25
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9e2f1a7b40'
+down_revision: Union[str, Sequence[str], None] = '0f3e7a9c1d25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _indexes() -> set:
+    return {ix["name"] for ix in sa.inspect(op.get_bind()).get_indexes("chat_messages")}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    existing = _indexes()
+    if "ix_chat_messages_user_ts_id" not in existing:
+        op.create_index(
+            "ix_chat_messages_user_ts_id", "chat_messages", ["user_id", "timestamp", "id"]
+        )
+    # the composite index leads with user_id, so the single-column one is redundant
+    if "ix_chat_messages_user_id" in existing:
+        op.drop_index("ix_chat_messages_user_id", table_name="chat_messages")
+    if op.get_bind().dialect.name == "sqlite":
+        # CURRENT_TIMESTAMP rows have no fraction and would sort/compare inconsistently
+        # against rows written by the ORM, which stores microseconds
+        op.execute(
+            "UPDATE chat_messages SET timestamp = timestamp || '.000000' "
+            "WHERE length(timestamp) = 19"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index("ix_chat_messages_user_id", "chat_messages", ["user_id"])
+    op.drop_index("ix_chat_messages_user_ts_id", table_name="chat_messages")
@@ -0,0 +1,42 @@
+"""soul_settings.version for cached personality prompts; default settings for every user
+
+Revision ID: 5b7a0d93e1c6
+Revises: 8d41b6e0c2f5
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7a0d93e1c6'
+down_revision: Union[str, Sequence[str], None] = '8d41b6e0c2f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _columns() -> set:
+    return {col["name"] for col in sa.inspect(op.get_bind()).get_columns("soul_settings")}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if "version" not in _columns():
+        with op.batch_alter_table("soul_settings") as batch_op:
+            batch_op.add_column(sa.Column("version", sa.Integer(), nullable=False, server_default="1"))
+    # the chat path no longer creates settings rows; give older accounts the defaults now
+    op.execute(
+        "INSERT INTO soul_settings (user_id, tone, empathy_level, reasoning_depth,"
+        " creativity_level, memory_aggressiveness, boundaries, version)"
+        " SELECT id, 'gentle', 5, 7, 5, 5, 'Respectful and supportive', 1 FROM users"
+        " WHERE NOT EXISTS (SELECT 1 FROM soul_settings WHERE soul_settings.user_id = users.id)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("soul_settings") as batch_op:
+        batch_op.drop_column("version")
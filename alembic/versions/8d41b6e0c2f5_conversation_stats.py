@@ -0,0 +1,54 @@
+"""per-user conversation_stats table, backfilled from chat_messages
+
+Revision ID: 8d41b6e0c2f5
+Revises: 3c9e2f1a7b40
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41b6e0c2f5'
+down_revision: Union[str, Sequence[str], None] = '3c9e2f1a7b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if "conversation_stats" not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            "conversation_stats",
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("total_messages", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("user_messages", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("assistant_messages", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("content_bytes", sa.BigInteger(), nullable=False, server_default="0"),
+            sa.Column("first_message_at", sa.DateTime(timezone=True)),
+            sa.Column("last_message_at", sa.DateTime(timezone=True)),
+        )
+    # a table made by create_all() may be empty or only count recent messages; recompute it
+    op.execute("DELETE FROM conversation_stats")
+    nbytes = (
+        "octet_length(content)"
+        if op.get_bind().dialect.name == "postgresql"
+        else "length(CAST(content AS BLOB))"
+    )
+    op.execute(
+        "INSERT INTO conversation_stats (user_id, total_messages, user_messages, assistant_messages,"
+        " content_bytes, first_message_at, last_message_at)"
+        " SELECT user_id, count(*),"
+        " sum(CASE WHEN role = 'user' THEN 1 ELSE 0 END),"
+        " sum(CASE WHEN role = 'assistant' THEN 1 ELSE 0 END),"
+        f" coalesce(sum({nbytes}), 0), min(timestamp), max(timestamp)"
+        " FROM chat_messages GROUP BY user_id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("conversation_stats")
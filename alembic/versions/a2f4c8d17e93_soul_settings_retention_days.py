@@ -0,0 +1,35 @@
+"""soul_settings.retention_days for the history retention sweep
+
+Revision ID: a2f4c8d17e93
+Revises: 5b7a0d93e1c6
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a2f4c8d17e93'
+down_revision: Union[str, Sequence[str], None] = '5b7a0d93e1c6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _columns() -> set:
+    return {col["name"] for col in sa.inspect(op.get_bind()).get_columns("soul_settings")}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if "retention_days" not in _columns():
+        with op.batch_alter_table("soul_settings") as batch_op:
+            batch_op.add_column(sa.Column("retention_days", sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("soul_settings") as batch_op:
+        batch_op.drop_column("retention_days")
@@ -1,60 +1,78 @@
 from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-from app.database import get_db
-from app.models import User
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
+from app.models import SoulSettings, User
+from app.personality import DEFAULT_SOUL_SETTINGS
 from app.schemas import UserCreate, UserLogin, UserOutput
 from app import utilities
+from app.auth_dependency import Principal, get_current_user, principal_cache
+from app.password_pool import PASSWORD_POOL_RETRY_AFTER, PasswordPoolBusy, password_pool
 
 
 
 router = APIRouter(tags=["auth"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many login attempts in progress, try again shortly",
+        headers={"Retry-After": str(PASSWORD_POOL_RETRY_AFTER)},
+    )
 
 
 @router.post("/login")
-def login(request: UserLogin,db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == request.email).first()
-    if not user or not utilities.verify_password(request.password, user.hashed_password):
+async def login(request: UserLogin,db: AsyncSession = Depends(get_async_db)):
+    user = (await db.execute(select(User).where(User.email == request.email))).scalars().first()
+    if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Entry",headers={"WWW-Authenticate": "Bearer"})
+    try:
+        valid, new_hash = await password_pool.verify_and_update(request.password, user.hashed_password)
+    except PasswordPoolBusy:
+        raise _busy()
+    if not valid:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Entry",headers={"WWW-Authenticate": "Bearer"})
+
+    if new_hash:
+        # stored with an outdated cost factor; upgrade while we have the plaintext
+        user.hashed_password = new_hash
+        await db.commit()
 
-    access_token = utilities.create_access_token(data={"sub": user.email})
+    access_token = utilities.create_access_token(data={"sub": user.email, "uid": user.id})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/register", response_model = UserOutput,status_code=status.HTTP_201_CREATED)
-def register_user(user:UserCreate, db:Session = Depends(get_db)):
-    if db.query(User).filter(User.email == user.email).first():
+async def register_user(user:UserCreate, db:AsyncSession = Depends(get_async_db)):
+    if (await db.execute(select(User.id).where(User.email == user.email))).first():
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email does not work or already registered")
 
-    if hasattr(utilities, "hash_password"):
-        hashed_password = utilities.hash_password(user.password)
-    else:
-        hashed_password = pwd_context.hash(user.password)
-    
+    try:
+        hashed_password = await password_pool.hash_password(user.password)
+    except PasswordPoolBusy:
+        raise _busy()
+
     new_user=User(
         email=user.email,
         username=user.username,
         hashed_password=hashed_password,
     )
+    # created here so the chat path never has to
+    new_user.soul_settings = SoulSettings(**DEFAULT_SOUL_SETTINGS)
 
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 
+@router.get("/cache/stats")
+def auth_cache_stats(current_user: Principal = Depends(get_current_user)):
+    """Hit rate and size of this worker's token -> principal cache."""
+    return principal_cache.stats()
 
 
-
-
-
-
-       
-
-
-
-
-      
-
-
+@router.get("/pool/stats")
+def password_pool_stats(current_user: Principal = Depends(get_current_user)):
+    """In-flight and rejected hashing jobs in this worker's bcrypt pool."""
+    return password_pool.stats()
@@ -1,23 +1,138 @@
 from __future__ import annotations
 import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
 from fastapi import Depends, HTTPException, status
 from app.models import User
 from jose import jwt,JWTError
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.database import get_db
+from app.database import get_async_db
 
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+# Accept the token's `uid` claim without checking the user still exists. Saves the DB
+# lookup on a cache miss, at the cost of deleted users keeping access until token expiry.
+AUTH_TRUST_UID_CLAIM = os.getenv("AUTH_TRUST_UID_CLAIM", "0").lower() in {"1","true","yes","on"}
+
 security = HTTPBearer()
 
-def get_current_user(
+
+@dataclass(frozen=True)
+class Principal:
+    """Snapshot of the authenticated user; what route handlers receive as `current_user`."""
+    id: int
+    email: str
+    username: Optional[str] = None
+
+
+class PrincipalCache:
+    """
+    Token-hash -> Principal cache with a TTL (never past the token's own `exp`) and an LRU
+    size bound. Entries for a user are dropped when that user is updated or deleted through
+    the ORM in this process; other workers see the change once their entries expire.
+    """
+
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Principal, float]]" = OrderedDict()
+        self._by_user: Dict[int, Set[str]] = {}
+        self._counters = {"hits": 0, "misses": 0, "expired": 0, "invalidations": 0}
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Principal]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            principal, expires_at = entry
+            if expires_at <= now:
+                self._drop(key)
+                self._counters["expired"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return principal
+
+    def put(self, key: str, principal: Principal, token_exp: Optional[float] = None) -> None:
+        ttl = self.ttl
+        if token_exp is not None:
+            ttl = min(ttl, token_exp - time.time())
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (principal, time.monotonic() + ttl)
+            self._by_user.setdefault(principal.id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._by_user.get(entry[0].id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_user[entry[0].id]
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._drop(key)
+            self._counters["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "hit_rate": (self._counters["hits"] / lookups) if lookups else 0.0,
+            }
+
+
+principal_cache = PrincipalCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_principal(mapper, connection, target: User) -> None:
+    principal_cache.invalidate_user(target.id)
+
+
+async def get_current_user(
         credentials: HTTPAuthorizationCredentials = Depends(security),
-        db: Session = Depends(get_db)
-) -> User:
+        db: AsyncSession = Depends(get_async_db)
+) -> Principal:
     token = credentials.credentials
+    key = PrincipalCache.key(token)
+    principal = principal_cache.get(key)
+    if principal is not None:
+        return principal
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail = "Could not validate credentials",
@@ -32,25 +147,20 @@ def get_current_user(
 
     if sub is None:
         raise credentials_exception
-    user = db.query(User).filter(User.email == sub).first()
-    if user is None:
-        raise credentials_exception
-    
-    return user
-
-
-
-
-
-
-
-
-
-
-
-
-    
-                                        
-   
-    
 
+    uid = payload.get("uid")
+    if uid is not None and AUTH_TRUST_UID_CLAIM:
+        principal = Principal(id=int(uid), email=sub)
+    else:
+        if uid is not None:
+            user = await db.get(User, int(uid))
+            if user is not None and user.email != sub:
+                user = None
+        else:
+            user = (await db.execute(select(User).where(User.email == sub))).scalars().first()
+        if user is None:
+            raise credentials_exception
+        principal = Principal(id=user.id, email=user.email, username=user.username)
+
+    principal_cache.put(key, principal, payload.get("exp"))
+    return principal
@@ -1,15 +1,32 @@
 from __future__ import annotations
 import os
+import re
+import asyncio
+import time
 import logging
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 from langchain.chains import ConversationalRetrievalChain
-from app.models import ChatMessage, SoulSettings
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from app.models import ChatMessage, SoulSettings, User
 from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, AIMessage  
-from sqlalchemy.orm import Session
-from app.database import get_db
-from app.vector_store import load_vector_store
+from sqlalchemy import select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from app.database import AsyncSessionLocal
+from app.vector_store import (
+    open_user_store,
+    store_cache,
+    user_filter,
+    user_retriever,
+    user_store_location,
+)
+from app.clients import get_chat_model
+from app.context_packing import count_tokens, pack_documents, trim_history
+from app.metrics import PROMPT_TOKENS, RETRIEVED_DOCS, STAGE_SECONDS, TOKENS, TURN_SECONDS, TURNS, time_stage
+from app.personality import personality_cache, render_personality
 
 
 load_dotenv()
@@ -17,12 +34,28 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-MODEL_NAME = os.getenv("CHAT_OPEN_AI", "gpt-4o-mini")
-TEMPERATURE = float(os.getenv("CHAT_OPEN_AI_TEMPERATURE", "0.3"))
 RETRIEVER_K = int(os.getenv("RETRIEVER_MODEL_K", "6"))
+# fetched before near-duplicate removal; at most RETRIEVER_K chunks reach the prompt
+RETRIEVER_FETCH_K = int(os.getenv("RETRIEVER_FETCH_K", str(RETRIEVER_K * 2)))
 MAX_CHAT_HISTORY = int(os.getenv("MAX_CHAT_HISTORY", "6"))
-DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Run tags that tell the answer model's tokens apart from the condense step when streaming.
+ANSWER_TAG = "answer"
+CONDENSE_TAG = "condense"
+FALLBACK_ANSWER = "Sorry, something went wrong while generating a response."
+
+# condense: always rewrite follow-ups with an extra LLM call (ConversationalRetrievalChain default)
+# single:   never condense; retrieve on the question plus recent user turns
+# auto:     condense only when the follow-up looks like it depends on earlier turns
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "condense").lower()
+RETRIEVAL_QUERY_TURNS = int(os.getenv("RETRIEVAL_QUERY_TURNS", "2"))
+RETRIEVAL_QUERY_MAX_CHARS = int(os.getenv("RETRIEVAL_QUERY_MAX_CHARS", "800"))
+
+_REFERRING_WORDS = re.compile(
+    r"\b(it|its|that|this|those|these|they|them|their|he|him|his|she|her|there|then|"
+    r"same|again|above|earlier|before|previous|last one|the other)\b",
+    re.IGNORECASE,
+)
 
 
 CONDENSE_QUESTION_PROMPT = PromptTemplate(
@@ -48,155 +81,314 @@ QA_PROMPT = PromptTemplate(
 
 
 
-def user_chroma_dir(user_id: str) -> str:
-    path = os.path.join(DATA_DIR, user_id, "chroma_db")
-    os.makedirs(path, exist_ok=True)
-    return path
-
+# (rendered personality block, recent history oldest first)
+TurnContext = Tuple[str, List]
 
 
-def load_recent_chat_history(db: Session, user_id: int):
-    rows = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.user_id == user_id)
-        .order_by(ChatMessage.timestamp.desc())
+async def load_turn_context(db: AsyncSession, user_id: int) -> TurnContext:
+    """
+    The personality block and the last MAX_CHAT_HISTORY messages. One statement reads the
+    history with the settings version; the full settings row is only loaded when this
+    worker has not rendered that version yet.
+    """
+    started = time.perf_counter()
+    recent = (
+        select(ChatMessage.role, ChatMessage.content, ChatMessage.timestamp, ChatMessage.id)
+        .where(ChatMessage.user_id == user_id)
+        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
         .limit(MAX_CHAT_HISTORY)
-        .all()
+        .subquery()
     )
+    rows = (
+        await db.execute(
+            select(SoulSettings.version, recent.c.role, recent.c.content)
+            .select_from(User)
+            .outerjoin(SoulSettings, SoulSettings.user_id == User.id)
+            .outerjoin(recent, true())
+            .where(User.id == user_id)
+            .order_by(recent.c.timestamp, recent.c.id)
+        )
+    ).all()
+
+    version = rows[0][0] if rows else None
+    personality = personality_cache.get(user_id, version)
+    if personality is None:
+        settings = None
+        if version is not None:
+            settings = (
+                await db.execute(select(SoulSettings).where(SoulSettings.user_id == user_id))
+            ).scalars().first()
+        personality = render_personality(settings)
+        personality_cache.put(user_id, settings.version if settings else None, personality)
 
-    rows = list(reversed(rows))  
     messages = []
-    for msg in rows:
-        if msg.role == "user":
-            messages.append(HumanMessage(content=msg.content))
+    for _, role, content in rows:
+        if role is None:
+            continue
+        if role == "user":
+            messages.append(HumanMessage(content=content))
         else:
-            messages.append(AIMessage(content=msg.content))
+            messages.append(AIMessage(content=content))
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage="context_load")
+    return personality, messages
 
-    return messages
 
 
-
-def get_conversational_chain(user_id: str):
-    persist_dir = user_chroma_dir(user_id)
-    vectordb = load_vector_store(persist_dir=persist_dir)
-    if not vectordb:
+def _open_vector_store(user_id: str, location: str):
+    vectordb = open_user_store(user_id, location)
+    if vectordb is None:
         raise RuntimeError(f"Vector store not found for user_id={user_id}")
+    return vectordb
+
 
-    llm = ChatOpenAI(
-        api_key=OPENAI_API_KEY,
-        model=MODEL_NAME,
-        temperature=TEMPERATURE,
-    )
 
-    retriever = vectordb.as_retriever(search_kwargs={"k": RETRIEVER_K})
+def _build_conversational_chain(vectordb, user_id: str):
+    llm = get_chat_model(ANSWER_TAG)
+
+    retriever = user_retriever(vectordb, user_id, RETRIEVER_FETCH_K)
+    scope = user_filter(user_id)
+    if scope is not None and retriever.search_kwargs.get("filter") != scope:
+        # a shared collection must never be searched without the caller's user_id filter
+        raise RuntimeError(f"Retriever for user_id={user_id} is not scoped to that user")
 
     chain = ConversationalRetrievalChain.from_llm(
         llm=llm,
         retriever=retriever,
         chain_type="stuff",
         condense_question_prompt=CONDENSE_QUESTION_PROMPT,
+        condense_question_llm=get_chat_model(CONDENSE_TAG),
         combine_docs_chain_kwargs={"prompt": QA_PROMPT},
     )
     return chain
 
 
 
-def get_response(user_input: str, user_id: str) -> str:
-    db = next(get_db())
-
-    
-    settings = (
-        db.query(SoulSettings)
-        .filter(SoulSettings.user_id == int(user_id))
-        .first()
+def checkout_conversational_chain(user_id: str):
+    """
+    Check out the user's cache entry with its retrieval chain built, reusing the cached
+    store and chain for warm users. Return it with `store_cache.checkin` after the turn.
+    """
+    location = user_store_location(user_id)
+    return store_cache.checkout(
+        user_id,
+        location,
+        lambda: _open_vector_store(user_id, location),
+        lambda vectordb: _build_conversational_chain(vectordb, user_id),
     )
 
-   
-    if not settings:
-        settings = SoulSettings(
-            user_id=int(user_id),
-            tone="gentle",
-            empathy_level=5,
-            reasoning_depth=7,
-            creativity_level=5,
-            memory_aggressiveness=5,
-            boundaries="Respectful and supportive"
-        )
-        db.add(settings)
-        db.commit()
-        db.refresh(settings)
-
-    
-    PERSONALITY = f"""
---- USER'S AI SOUL PERSONALITY ---
-Tone: {settings.tone}
-Empathy Level: {settings.empathy_level}/10
-Reasoning Depth: {settings.reasoning_depth}/10
-Creativity: {settings.creativity_level}/10
-Memory Aggressiveness: {settings.memory_aggressiveness}/10
-Boundaries: {settings.boundaries}
-
-Follow these personality traits STRICTLY when responding.
---------------------------------
-"""
 
+
+async def _prepare_turn(user_input: str, user_id: str, context: Optional[TurnContext] = None):
+    """
+    Return the user's checked-out cache entry (its `chain` is ready) with the chain inputs;
+    `context` comes from `load_turn_context`.
+    """
+    if context is None:
+        async with AsyncSessionLocal() as db:
+            context = await load_turn_context(db, int(user_id))
+    personality, history = context
+
+    # opening a cold store touches disk, keep it off the event loop
+    with time_stage("store_open"):
+        entry = await run_in_threadpool(checkout_conversational_chain, user_id)
+    return entry, {
+        "question": user_input,
+        "chat_history": history,
+        "personality": personality,
+    }
+
+
+
+def is_ambiguous_follow_up(question: str, history: List) -> bool:
+    """Cheap local guess at whether the question only makes sense given earlier turns."""
+    if not history:
+        return False
+    if len(question.split()) <= 3:
+        return True
+    return bool(_REFERRING_WORDS.search(question))
+
+
+
+def build_retrieval_query(question: str, history: List) -> str:
+    """Retrieval query for the single-call path: the question plus the last few user turns."""
+    recent = [m.content for m in history if isinstance(m, HumanMessage)][-RETRIEVAL_QUERY_TURNS:]
+    query = "\n".join([question, *reversed(recent)])
+    return query[:RETRIEVAL_QUERY_MAX_CHARS]
+
+
+
+def choose_retrieval_path(question: str, history: List, mode: str = RETRIEVAL_MODE) -> str:
+    if not history:
+        return "no_history"
+    if mode == "single":
+        return "single"
+    if mode == "auto":
+        return "condense" if is_ambiguous_follow_up(question, history) else "single"
+    return "condense"
+
+
+
+_path_lock = threading.Lock()
+_path_stats: Dict[str, Dict[str, float]] = {}
+
+
+def _record_path(path: str, seconds: float) -> None:
+    with _path_lock:
+        entry = _path_stats.setdefault(path, {"turns": 0, "seconds": 0.0})
+        entry["turns"] += 1
+        entry["seconds"] += seconds
+    TURN_SECONDS.observe(seconds, path=path)
+
+
+def retrieval_path_stats() -> Dict[str, Dict[str, float]]:
+    """Turn counts and mean end-to-end seconds per retrieval path in this worker."""
+    with _path_lock:
+        return {
+            path: {**entry, "mean_seconds": entry["seconds"] / entry["turns"]}
+            for path, entry in _path_stats.items()
+        }
+
+
+
+async def _plan_turn(chain, inputs: Dict[str, Any]):
+    """
+    Pick the retrieval path for this turn, retrieve and pack the context, and return
+    (path, runnable, runnable_inputs, context_report). Every path ends in the answer step
+    of the chain; on the condense path the rewrite call runs here first, over history
+    trimmed to HISTORY_TOKEN_BUDGET.
+    """
+    question = inputs["question"]
+    history = inputs["chat_history"]
+    path = choose_retrieval_path(question, history)
+
+    if path == "condense":
+        format_history = chain.get_chat_history or _get_chat_history
+        history = trim_history(history, format_history)
+        with time_stage("condense"):
+            generated = await chain.question_generator.ainvoke(
+                {"question": question, "chat_history": format_history(history)}
+            )
+        question = query = generated[chain.question_generator.output_key]
+    elif path == "single":
+        query = build_retrieval_query(question, history)
+    else:
+        query = question
+
+    with time_stage("retrieval"):
+        docs = await chain.retriever.ainvoke(query)
+    with time_stage("packing"):
+        docs, report = pack_documents(
+            docs,
+            fixed_text=QA_PROMPT.format(context="", question=question, personality=inputs["personality"]),
+            max_docs=RETRIEVER_K,
+        )
+    RETRIEVED_DOCS.observe(report["docs_retrieved"], kind="retrieved")
+    RETRIEVED_DOCS.observe(report["docs_kept"], kind="kept")
+    PROMPT_TOKENS.observe(report["prompt_tokens"])
+    TOKENS.inc(report["prompt_tokens"], kind="prompt")
+    if path == "condense":
+        report["history_messages"] = len(history)
+    return path, chain.combine_docs_chain, {
+        "input_documents": docs,
+        "question": question,
+        "personality": inputs["personality"],
+    }, report
+
+
+
+async def get_response(
+    user_input: str,
+    user_id: str,
+    turn_info: Optional[Dict[str, Any]] = None,
+    context: Optional[TurnContext] = None,
+) -> str:
+    """
+    Generate the reply. Pass `context` when the caller has already loaded it, so no
+    session is opened here. If `turn_info` is given it receives the retrieval path and
+    packing report.
+    """
+    path = "unknown"
+    entry = None
     try:
-        chain = get_conversational_chain(user_id)
-        logger.info("Generating response for user_id=%s", user_id)
+        started = time.perf_counter()
+        entry, inputs = await _prepare_turn(user_input, user_id, context)
+        path, runnable, run_inputs, report = await _plan_turn(entry.chain, inputs)
+        logger.info(
+            "Generating response for user_id=%s path=%s prompt_tokens=%d",
+            user_id, path, report["prompt_tokens"],
+        )
 
-        history = load_recent_chat_history(db, int(user_id))
+        with time_stage("generation"):
+            result = await runnable.ainvoke(run_inputs)
 
-       
-        result = chain.invoke({
-            "question": user_input,
-            "chat_history": history,
-            "personality": PERSONALITY
-        })
+        _record_path(path, time.perf_counter() - started)
+        if turn_info is not None:
+            turn_info["retrieval_path"] = path
+            turn_info["context"] = report
 
-        answer = result.get("answer") or result.get("result") or "I couldn't generate a response."
+        answer = (
+            result.get("answer") or result.get("output_text") or result.get("result")
+            or "I couldn't generate a response."
+        )
+        TOKENS.inc(count_tokens(answer), kind="answer")
+        TURNS.inc(path=path, outcome="ok")
         return answer
 
     except Exception as e:
         logger.error(f"Error generating response for user_id={user_id}: {e}")
-        return "Sorry, something went wrong while generating a response."
-
-
-
-
-
-
-    
-       
-
-
-
-
-
-
-
-
-
-    
-    
-
-    
-
-
-    
-
-    
-    
-
-
-
-
-
-
-
-
-
-
-
-
-
+        TURNS.inc(path=path, outcome="fallback")
+        return FALLBACK_ANSWER
+    finally:
+        if entry is not None:
+            store_cache.checkin(entry)
+
+
+
+async def stream_response(
+    user_input: str,
+    user_id: str,
+    turn_info: Optional[Dict[str, Any]] = None,
+    context: Optional[TurnContext] = None,
+) -> AsyncIterator[str]:
+    """
+    Yield answer tokens as the model produces them. Only the answer step is streamed; the
+    condense step has already run. Closing the generator cancels the in-flight LLM call.
+    """
+    started = time.perf_counter()
+    entry, inputs = await _prepare_turn(user_input, user_id, context)
+    try:
+        path, runnable, run_inputs, report = await _plan_turn(entry.chain, inputs)
+        if turn_info is not None:
+            turn_info["retrieval_path"] = path
+            turn_info["context"] = report
+        logger.info(
+            "Streaming response for user_id=%s path=%s prompt_tokens=%d",
+            user_id, path, report["prompt_tokens"],
+        )
 
+        generation_started = time.perf_counter()
+        tokens = 0
+        try:
+            async for event in runnable.astream_events(run_inputs, version="v2"):
+                if event["event"] != "on_chat_model_stream" or ANSWER_TAG not in event.get("tags", []):
+                    continue
+                token = event["data"]["chunk"].content
+                if token:
+                    if not tokens:
+                        STAGE_SECONDS.observe(time.perf_counter() - generation_started, stage="first_token")
+                    tokens += 1  # OpenAI streams one token per chunk
+                    yield token
+        except (asyncio.CancelledError, GeneratorExit):
+            TURNS.inc(path=path, outcome="cancelled")
+            raise
+        except Exception:
+            TURNS.inc(path=path, outcome="error")
+            raise
+        finally:
+            TOKENS.inc(tokens, kind="answer")
+    finally:
+        store_cache.checkin(entry)
+
+    STAGE_SECONDS.observe(time.perf_counter() - generation_started, stage="generation")
+    TURNS.inc(path=path, outcome="ok")
+    _record_path(path, time.perf_counter() - started)
@@ -0,0 +1,163 @@
+from __future__ import annotations
+import os
+import logging
+import threading
+from typing import TYPE_CHECKING, Dict, Optional
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    # imported on first use: langchain_openai alone adds over a second to worker startup
+    import httpx
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Point at a local stub server in tests, e.g. OPENAI_BASE_URL=http://127.0.0.1:8089/v1
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+MODEL_NAME = os.getenv("CHAT_OPEN_AI", "gpt-4o-mini")
+TEMPERATURE = float(os.getenv("CHAT_OPEN_AI_TEMPERATURE", "0.3"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# Token-length checking downloads tiktoken encodings; turn it off for offline stub servers.
+EMBEDDING_CHECK_CTX_LENGTH = os.getenv("EMBEDDING_CHECK_CTX_LENGTH", "1").lower() in {"1","true","yes","on"}
+
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+
+
+class ClientRegistry:
+    """
+    Worker-wide owner of the OpenAI clients. One sync and one async httpx pool are
+    shared by every embeddings/chat model so keep-alive connections are reused
+    across turns instead of paying TCP + TLS setup per request.
+    """
+
+    def __init__(
+        self,
+        *,
+        api_key: Optional[str] = OPENAI_API_KEY,
+        base_url: Optional[str] = OPENAI_BASE_URL,
+        max_connections: int = HTTP_POOL_MAX_CONNECTIONS,
+        max_keepalive: int = HTTP_POOL_MAX_KEEPALIVE,
+        keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+        pool_timeout: float = HTTP_POOL_TIMEOUT,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self._limits = {
+            "max_connections": max_connections,
+            "max_keepalive_connections": max_keepalive,
+            "keepalive_expiry": keepalive_expiry,
+        }
+        self._timeouts = {
+            "connect": connect_timeout,
+            "read": read_timeout,
+            "write": read_timeout,
+            "pool": pool_timeout,
+        }
+        self._lock = threading.Lock()
+        self._http: Optional[httpx.Client] = None
+        self._async_http: Optional[httpx.AsyncClient] = None
+        self._embeddings: Optional[OpenAIEmbeddings] = None
+        self._chat_models: Dict[str, ChatOpenAI] = {}
+
+    def _pool_options(self) -> dict:
+        import httpx
+        return {"limits": httpx.Limits(**self._limits), "timeout": httpx.Timeout(**self._timeouts)}
+
+    def http_client(self) -> httpx.Client:
+        import httpx
+        with self._lock:
+            if self._http is None:
+                self._http = httpx.Client(**self._pool_options())
+            return self._http
+
+    def async_http_client(self) -> httpx.AsyncClient:
+        import httpx
+        with self._lock:
+            if self._async_http is None:
+                self._async_http = httpx.AsyncClient(**self._pool_options())
+            return self._async_http
+
+    def _require_key(self) -> str:
+        if not self.api_key:
+            raise RuntimeError("OpenAI API key not found")
+        return self.api_key
+
+    def embeddings(self) -> OpenAIEmbeddings:
+        if self._embeddings is None:
+            from langchain_openai import OpenAIEmbeddings
+            embeddings = OpenAIEmbeddings(
+                api_key=self._require_key(),
+                base_url=self.base_url,
+                model=EMBEDDING_MODEL,
+                max_retries=OPENAI_MAX_RETRIES,
+                check_embedding_ctx_length=EMBEDDING_CHECK_CTX_LENGTH,
+                http_client=self.http_client(),
+                http_async_client=self.async_http_client(),
+            )
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = embeddings
+        return self._embeddings
+
+    def chat_model(self, purpose: str = "answer") -> ChatOpenAI:
+        """Shared chat model per purpose; purposes only differ by their run tag."""
+        llm = self._chat_models.get(purpose)
+        if llm is None:
+            from langchain_openai import ChatOpenAI
+            llm = ChatOpenAI(
+                api_key=self._require_key(),
+                base_url=self.base_url,
+                model=MODEL_NAME,
+                temperature=TEMPERATURE,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=self.http_client(),
+                http_async_client=self.async_http_client(),
+                tags=[purpose],
+            )
+            with self._lock:
+                llm = self._chat_models.setdefault(purpose, llm)
+        return llm
+
+    def close(self) -> None:
+        """Close the sync pool. Use `aclose` from async code to close both."""
+        with self._lock:
+            http, self._http = self._http, None
+            self._embeddings = None
+            self._chat_models = {}
+        if http is not None:
+            http.close()
+
+    async def aclose(self) -> None:
+        with self._lock:
+            async_http, self._async_http = self._async_http, None
+        self.close()
+        if async_http is not None:
+            await async_http.aclose()
+
+
+registry = ClientRegistry()
+
+
+def get_embeddings() -> OpenAIEmbeddings:
+    return registry.embeddings()
+
+
+def get_chat_model(purpose: str = "answer") -> ChatOpenAI:
+    return registry.chat_model(purpose)
+
+
+async def shutdown_clients() -> None:
+    logger.info("Closing shared OpenAI HTTP clients")
+    await registry.aclose()
@@ -0,0 +1,305 @@
+"""
+Rolling memory compaction. A user's older memory chunks are grouped into fixed time
+windows, each window is summarized by the chat model, and the raw chunks are replaced
+by one summary vector. Meant to run nightly:
+
+    python -m app.compaction            # resumes an unfinished run, else starts a new one
+    python -m app.compaction --restart --users 3,7 --dry-run
+
+`SoulSettings.memory_aggressiveness` (1-10) controls how hard a user's memory is
+compacted: a higher setting summarizes raw turns sooner and folds them into larger
+windows, level 10 keeping one week of raw turns and level 1 ten weeks.
+
+Compaction runs outside the app workers; they notice a compacted store through its
+generation file (see `store_cache.store_generation`) and reopen it on their next lookup.
+
+Re-running is safe. Summary ids are derived from (user, window), an existing summary for
+a window is folded into its replacement, and the summary is written before the raw chunks
+are deleted, so an interrupted run only repeats work.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import fcntl
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select
+from app.clients import get_chat_model
+from app.context_packing import count_tokens
+from app.database import SessionLocal
+from app.models import SoulSettings, User
+from app.vector_store import (
+    DATA_DIR,
+    _get_embeddings,
+    add_embedded,
+    chunk_epoch,
+    delete_user_vectors,
+    get_user_vectors,
+    mark_user_store_changed,
+    store_cache,
+)
+
+logger = logging.getLogger(__name__)
+
+COMPACTION_DIR = os.getenv("COMPACTION_DIR", os.path.join(DATA_DIR, "_compaction"))
+COMPACTION_TAG = "compaction"
+# chunks a window needs before summarizing it is worth an LLM call
+COMPACTION_MIN_CHUNKS = int(os.getenv("COMPACTION_MIN_CHUNKS", "4"))
+# excerpt tokens per summarization call; larger windows are summarized incrementally
+COMPACTION_INPUT_TOKENS = int(os.getenv("COMPACTION_INPUT_TOKENS", "6000"))
+COMPACTION_SUMMARY_WORDS = int(os.getenv("COMPACTION_SUMMARY_WORDS", "200"))
+
+DAY = 86400
+
+SUMMARY_PROMPT = (
+    "You maintain the long-term memory of a counseling assistant. Summarize the conversation "
+    "excerpts below from {start} to {end} into one compact memory of at most {words} words. "
+    "Keep names, facts about the user, feelings, goals, commitments and dates. Refer to the "
+    "person as 'the user'. Do not add advice or anything not in the excerpts.\n\n"
+    "{earlier}"
+    "=== Excerpts ===\n{excerpts}\n\n"
+    "Memory:"
+)
+
+
+def compaction_policy(memory_aggressiveness: Optional[int]) -> Tuple[int, int]:
+    """(days of raw turns kept untouched, window length in days) for a 1-10 setting."""
+    level = min(max(memory_aggressiveness or 5, 1), 10)
+    keep_days = 7 * (11 - level)
+    if level <= 3:
+        window_days = 1
+    elif level <= 6:
+        window_days = 7
+    else:
+        window_days = 30
+    return keep_days, window_days
+
+
+def summary_id(user_id: str, window_start: int, window_days: int) -> str:
+    return f"summary-{user_id}-{window_start}-{window_days}d"
+
+
+def _day(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).date().isoformat()
+
+
+def summarize(excerpts: List[str], start: float, end: float, earlier: Optional[str] = None) -> str:
+    """Summarize a window, in as many calls as COMPACTION_INPUT_TOKENS requires."""
+    llm = get_chat_model(COMPACTION_TAG)
+    batches: List[List[str]] = [[]]
+    used = 0
+    for text in excerpts:
+        tokens = count_tokens(text)
+        if batches[-1] and used + tokens > COMPACTION_INPUT_TOKENS:
+            batches.append([])
+            used = 0
+        batches[-1].append(text)
+        used += tokens
+
+    summary = earlier
+    for batch in batches:
+        prompt = SUMMARY_PROMPT.format(
+            start=_day(start),
+            end=_day(end),
+            words=COMPACTION_SUMMARY_WORDS,
+            earlier=f"=== Memory so far for this period ===\n{summary}\n\n" if summary else "",
+            excerpts="\n---\n".join(batch),
+        )
+        summary = llm.invoke(prompt).content.strip()
+    return summary
+
+
+def compact_user(
+    user_id: str,
+    memory_aggressiveness: Optional[int],
+    *,
+    now: Optional[float] = None,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    """Compact one user's windows that are entirely older than their keep period."""
+    now = now or time.time()
+    keep_days, window_days = compaction_policy(memory_aggressiveness)
+    cutoff = now - keep_days * DAY
+    span = window_days * DAY
+
+    stored = get_user_vectors(user_id)
+    summaries: Dict[str, str] = {}
+    windows: Dict[int, List[Tuple[float, str, str]]] = {}
+    for doc_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+        metadata = metadata or {}
+        if metadata.get("kind") == "summary":
+            summaries[doc_id] = text
+            continue
+        epoch = chunk_epoch(metadata)
+        if epoch is None:
+            continue
+        start = int(epoch // span) * span
+        if start + span > cutoff:
+            continue
+        windows.setdefault(start, []).append((epoch, doc_id, text))
+
+    result = {"windows": 0, "chunks_removed": 0, "summaries_written": 0}
+    for start, chunks in sorted(windows.items()):
+        if len(chunks) < COMPACTION_MIN_CHUNKS:
+            continue
+        chunks.sort()
+        sid = summary_id(user_id, start, window_days)
+        result["windows"] += 1
+        result["chunks_removed"] += len(chunks)
+        if dry_run:
+            continue
+
+        text = summarize([c[2] for c in chunks], start, start + span - 1, summaries.get(sid))
+        text = f"[MEMORY SUMMARY {_day(start)} to {_day(start + span - 1)}]\n{text}"
+        vector = _get_embeddings().embed_documents([text])[0]
+        add_embedded(
+            user_id,
+            ids=[sid],
+            texts=[text],
+            vectors=[vector],
+            metadatas=[{
+                "kind": "summary",
+                "user_id": str(user_id),
+                "timestamp": _day(start + span - 1),
+                "ts_epoch": float(start + span - 1),
+                "window_start": float(start),
+                "window_days": window_days,
+                "source_chunks": len(chunks),
+            }],
+        )
+        delete_user_vectors(user_id, [c[1] for c in chunks])
+        result["summaries_written"] += 1
+    if result["summaries_written"]:
+        # app workers have this store open; their handles no longer match the files
+        mark_user_store_changed(user_id)
+    return result
+
+
+# -- run bookkeeping ---------------------------------------------------------
+
+def _state_path() -> str:
+    return os.path.join(COMPACTION_DIR, "state.json")
+
+
+def load_state() -> Optional[Dict[str, Any]]:
+    try:
+        with open(_state_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(state: Dict[str, Any]) -> None:
+    tmp = _state_path() + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, _state_path())
+
+
+def _users(only: Optional[List[str]] = None) -> List[Tuple[int, Optional[int]]]:
+    with SessionLocal() as db:
+        stmt = (
+            select(User.id, SoulSettings.memory_aggressiveness)
+            .outerjoin(SoulSettings, SoulSettings.user_id == User.id)
+            .order_by(User.id)
+        )
+        if only:
+            stmt = stmt.where(User.id.in_([int(u) for u in only]))
+        return [(row[0], row[1]) for row in db.execute(stmt)]
+
+
+def run(
+    *,
+    only: Optional[List[str]] = None,
+    restart: bool = False,
+    dry_run: bool = False,
+    now: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Compact every user in id order, checkpointing after each so a killed run can resume."""
+    os.makedirs(COMPACTION_DIR, exist_ok=True)
+    lock = open(os.path.join(COMPACTION_DIR, "lock"), "a")
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        raise RuntimeError("Another compaction run is in progress")
+
+    try:
+        state = None if (restart or dry_run) else load_state()
+        if state is None or state.get("finished_at") is not None:
+            state = {
+                "started_at": time.time(),
+                "finished_at": None,
+                "last_user_id": None,
+                "users_done": 0,
+                "users_failed": [],
+                "windows": 0,
+                "chunks_removed": 0,
+                "summaries_written": 0,
+            }
+        else:
+            logger.info("Resuming compaction after user %s", state["last_user_id"])
+
+        users = _users(only)
+        if state["last_user_id"] is not None:
+            users = [u for u in users if u[0] > state["last_user_id"]]
+        started = time.perf_counter()
+        for position, (user_id, aggressiveness) in enumerate(users, 1):
+            try:
+                result = compact_user(str(user_id), aggressiveness, now=now, dry_run=dry_run)
+            except Exception as e:
+                logger.error("Compaction failed for user %s: %s", user_id, e)
+                state["users_failed"].append(user_id)
+            else:
+                for key, value in result.items():
+                    state[key] += value
+                state["users_done"] += 1
+                if result["windows"]:
+                    logger.info("User %s: %s", user_id, result)
+            finally:
+                store_cache.invalidate(str(user_id))
+            state["last_user_id"] = user_id
+            if not dry_run:
+                save_state(state)
+            if position % 100 == 0:
+                logger.info("Compacted %d/%d users in %.0fs", position, len(users), time.perf_counter() - started)
+
+        state["finished_at"] = time.time()
+        if not dry_run:
+            save_state(state)
+        logger.info(
+            "Compaction %s: %d users, %d windows, %d chunks -> %d summaries, %d failed",
+            "dry run" if dry_run else "done", state["users_done"], state["windows"],
+            state["chunks_removed"], state["summaries_written"], len(state["users_failed"]),
+        )
+        return state
+    finally:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+        lock.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Summarize old chat memories into compact records")
+    parser.add_argument("--users", default="", help="Comma separated user ids; default is every user")
+    parser.add_argument("--restart", action="store_true", help="Ignore an unfinished previous run")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be compacted")
+    return parser.parse_args()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    state = run(
+        only=[u for u in args.users.split(",") if u] or None,
+        restart=args.restart,
+        dry_run=args.dry_run,
+    )
+    if state["users_failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
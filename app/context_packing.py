@@ -0,0 +1,158 @@
+from __future__ import annotations
+import os
+import re
+import logging
+import threading
+from typing import Callable, Dict, List, Tuple
+from langchain.schema import BaseMessage
+from langchain.schema.document import Document
+from app.clients import MODEL_NAME
+
+logger = logging.getLogger(__name__)
+
+# Prompt budget for retrieved context + personality + question, per chat model. This is a
+# cost/latency budget, not the model's context window.
+_MODEL_CONTEXT_BUDGETS = {
+    "gpt-4o-mini": 3000,
+    "gpt-4o": 3000,
+    "gpt-4-turbo": 3000,
+    "gpt-4": 2500,
+    "gpt-3.5-turbo": 2000,
+}
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0")) or _MODEL_CONTEXT_BUDGETS.get(MODEL_NAME, 2500)
+# Budget for chat history sent to the condense step
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1000"))
+# Chunks whose word-shingle Jaccard similarity to an already kept chunk is at least this are dropped
+CONTEXT_DEDUPE_THRESHOLD = float(os.getenv("CONTEXT_DEDUPE_THRESHOLD", "0.8"))
+# A chunk that does not fit is cut down to the remaining budget only if at least this many tokens remain
+CONTEXT_MIN_CHUNK_TOKENS = int(os.getenv("CONTEXT_MIN_CHUNK_TOKENS", "64"))
+
+_WORD = re.compile(r"\w+")
+# "[USER @ 2024-05-01]" headers added by format_turn; ignored when comparing chunks
+_TURN_HEADER = re.compile(r"\[(?:USER|ASSISTANT) @ [^\]]*\]")
+
+_encoder = None
+_encoder_lock = threading.Lock()
+_encoder_failed = False
+
+
+def _get_encoder():
+    """tiktoken encoding for the chat model, or None if it cannot be loaded (e.g. offline)."""
+    global _encoder, _encoder_failed
+    if _encoder is not None or _encoder_failed:
+        return _encoder
+    with _encoder_lock:
+        if _encoder is None and not _encoder_failed:
+            try:
+                import tiktoken
+
+                try:
+                    _encoder = tiktoken.encoding_for_model(MODEL_NAME)
+                except KeyError:
+                    _encoder = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                _encoder_failed = True
+                logger.warning("tiktoken unavailable, estimating tokens from length: %s", e)
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is None:
+        return (len(text) + 3) // 4
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    encoder = _get_encoder()
+    if encoder is None:
+        return text[: max_tokens * 4]
+    tokens = encoder.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoder.decode(tokens[:max_tokens])
+
+
+def _shingles(text: str, size: int = 3) -> frozenset:
+    words = _WORD.findall(_TURN_HEADER.sub(" ", text).lower())
+    if len(words) <= size:
+        return frozenset([tuple(words)])
+    return frozenset(tuple(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def dedupe_documents(docs: List[Document], threshold: float = CONTEXT_DEDUPE_THRESHOLD) -> Tuple[List[Document], int]:
+    """Drop chunks that near-duplicate a higher-ranked one. Returns (kept, dropped count)."""
+    kept: List[Document] = []
+    seen: List[frozenset] = []
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        if any(_jaccard(shingles, other) >= threshold for other in seen):
+            continue
+        kept.append(doc)
+        seen.append(shingles)
+    return kept, len(docs) - len(kept)
+
+
+def pack_documents(
+    docs: List[Document],
+    *,
+    fixed_text: str,
+    max_docs: int,
+    budget: int = CONTEXT_TOKEN_BUDGET,
+) -> Tuple[List[Document], Dict[str, int]]:
+    """
+    Fit retrieved chunks into the answer prompt. Priority, highest first:
+      1. the prompt scaffolding, personality and question (`fixed_text`), never trimmed
+      2. chunks in retrieval rank order, near-duplicates removed, at most `max_docs`
+    The first chunk that does not fit is truncated if enough budget remains; the rest are dropped.
+    """
+    unique, duplicates = dedupe_documents(docs)
+    used = count_tokens(fixed_text)
+    packed: List[Document] = []
+    trimmed = 0
+    for doc in unique[:max_docs]:
+        remaining = budget - used
+        tokens = count_tokens(doc.page_content)
+        if tokens <= remaining:
+            packed.append(doc)
+            used += tokens
+            continue
+        if remaining >= CONTEXT_MIN_CHUNK_TOKENS:
+            packed.append(Document(
+                page_content=truncate_to_tokens(doc.page_content, remaining),
+                metadata=doc.metadata,
+            ))
+            used += remaining
+            trimmed += 1
+        break
+    return packed, {
+        "prompt_tokens": used,
+        "docs_retrieved": len(docs),
+        "docs_duplicate": duplicates,
+        "docs_kept": len(packed),
+        "docs_truncated": trimmed,
+    }
+
+
+def trim_history(
+    history: List[BaseMessage],
+    format_history: Callable[[List[BaseMessage]], str],
+    budget: int = HISTORY_TOKEN_BUDGET,
+) -> List[BaseMessage]:
+    """Keep the newest messages whose formatted form fits `budget`; the latest one is always kept."""
+    kept: List[BaseMessage] = []
+    used = 0
+    for message in reversed(history):
+        tokens = count_tokens(format_history([message]))
+        if kept and used + tokens > budget:
+            break
+        kept.append(message)
+        used += tokens
+    return list(reversed(kept))
+
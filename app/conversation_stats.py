@@ -0,0 +1,203 @@
+"""
+Per-user conversation counters kept in `conversation_stats`. Every code path that inserts
+or deletes ChatMessage rows calls `record_messages` / `delete_messages` inside its own
+transaction, so reads are a primary-key lookup instead of a scan over the history.
+
+If the table ever drifts (manual SQL, a bug), rebuild it from chat_messages:
+
+    python -m app.conversation_stats --users 3,7
+"""
+from __future__ import annotations
+import time
+import logging
+import argparse
+from typing import Any, Dict, Iterable, List, Optional
+from sqlalchemy import LargeBinary, case, cast, delete, func, insert, select, text, true, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import SessionLocal
+from app.models import ChatMessage, ConversationStats
+
+logger = logging.getLogger(__name__)
+
+_COUNTERS = ("total_messages", "user_messages", "assistant_messages", "content_bytes")
+
+
+def byte_length(dialect: str, column):
+    if dialect == "postgresql":
+        return func.octet_length(column)
+    return func.length(cast(column, LargeBinary))
+
+
+def _least(dialect: str, current, new):
+    if dialect == "postgresql":
+        return func.least(current, new)  # ignores NULLs
+    return func.min(func.coalesce(current, new), new)
+
+
+def _greatest(dialect: str, current, new):
+    if dialect == "postgresql":
+        return func.greatest(current, new)
+    return func.max(func.coalesce(current, new), new)
+
+
+def _insert_for(dialect: str):
+    return pg_insert if dialect == "postgresql" else sqlite_insert
+
+
+async def record_messages(db: AsyncSession, messages: Iterable[ChatMessage]) -> None:
+    """Add flushed (not yet committed) messages to their owners' counters. The caller commits."""
+    deltas: Dict[int, Dict[str, Any]] = {}
+    for msg in messages:
+        d = deltas.setdefault(msg.user_id, {
+            "total_messages": 0, "user_messages": 0, "assistant_messages": 0,
+            "content_bytes": 0, "first_message_at": None, "last_message_at": None,
+        })
+        d["total_messages"] += 1
+        if msg.role in ("user", "assistant"):
+            d[f"{msg.role}_messages"] += 1
+        d["content_bytes"] += len(msg.content.encode("utf-8"))
+        if d["first_message_at"] is None or msg.timestamp < d["first_message_at"]:
+            d["first_message_at"] = msg.timestamp
+        if d["last_message_at"] is None or msg.timestamp > d["last_message_at"]:
+            d["last_message_at"] = msg.timestamp
+    if not deltas:
+        return
+
+    dialect = db.bind.dialect.name
+    table = ConversationStats.__table__
+    for user_id, d in deltas.items():
+        stmt = _insert_for(dialect)(table).values(user_id=user_id, **d)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id],
+            set_={
+                **{name: table.c[name] + stmt.excluded[name] for name in _COUNTERS},
+                "first_message_at": _least(dialect, table.c.first_message_at, stmt.excluded.first_message_at),
+                "last_message_at": _greatest(dialect, table.c.last_message_at, stmt.excluded.last_message_at),
+            },
+        )
+        await db.execute(stmt)
+
+
+async def delete_messages(db: AsyncSession, user_id: int, *conditions) -> int:
+    """
+    Delete the user's messages matching `conditions` and subtract exactly the deleted rows
+    from the counters. Returns the number deleted. The caller commits.
+    """
+    dialect = db.bind.dialect.name
+    deleted = (
+        await db.execute(
+            delete(ChatMessage)
+            .where(ChatMessage.user_id == user_id, *conditions)
+            .returning(ChatMessage.role, byte_length(dialect, ChatMessage.content))
+            .execution_options(synchronize_session=False)
+        )
+    ).all()
+    if not deleted:
+        return 0
+
+    by_role = {"user": 0, "assistant": 0}
+    content_bytes = 0
+    for role, nbytes in deleted:
+        if role in by_role:
+            by_role[role] += 1
+        content_bytes += nbytes or 0
+
+    # both are single index seeks on (user_id, timestamp, id)
+    first, last = (
+        await db.execute(
+            select(func.min(ChatMessage.timestamp), func.max(ChatMessage.timestamp))
+            .where(ChatMessage.user_id == user_id)
+        )
+    ).one()
+    table = ConversationStats.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.user_id == user_id)
+        .values(
+            total_messages=table.c.total_messages - len(deleted),
+            user_messages=table.c.user_messages - by_role["user"],
+            assistant_messages=table.c.assistant_messages - by_role["assistant"],
+            content_bytes=table.c.content_bytes - content_bytes,
+            first_message_at=first,
+            last_message_at=last,
+        )
+    )
+    return len(deleted)
+
+
+async def get_stats(db: AsyncSession, user_id: int) -> Optional[ConversationStats]:
+    return await db.get(ConversationStats, user_id)
+
+
+# -- reconciliation ----------------------------------------------------------
+
+def _aggregate(dialect: str):
+    return select(
+        ChatMessage.user_id,
+        func.count(),
+        func.coalesce(func.sum(case((ChatMessage.role == "user", 1), else_=0)), 0),
+        func.coalesce(func.sum(case((ChatMessage.role == "assistant", 1), else_=0)), 0),
+        func.coalesce(func.sum(byte_length(dialect, ChatMessage.content)), 0),
+        func.min(ChatMessage.timestamp),
+        func.max(ChatMessage.timestamp),
+    ).group_by(ChatMessage.user_id)
+
+
+def rebuild(only: Optional[List[int]] = None) -> Dict[str, int]:
+    """Recompute the counters from chat_messages in one transaction. Returns drift counts."""
+    started = time.perf_counter()
+    columns = ["user_id", *_COUNTERS, "first_message_at", "last_message_at"]
+    with SessionLocal() as db:
+        dialect = db.bind.dialect.name
+        if dialect == "postgresql":
+            # hold off concurrent upserts so none lands between the recount and the commit
+            db.execute(text("LOCK TABLE conversation_stats IN EXCLUSIVE MODE"))
+
+        stats_filter = ConversationStats.user_id.in_(only) if only else true()
+        message_filter = ChatMessage.user_id.in_(only) if only else true()
+        stored = {
+            row[0]: tuple(row[1:5])
+            for row in db.execute(
+                select(ConversationStats.user_id, *[ConversationStats.__table__.c[n] for n in _COUNTERS])
+                .where(stats_filter)
+            )
+        }
+        db.execute(delete(ConversationStats).where(stats_filter))
+        db.execute(
+            insert(ConversationStats).from_select(columns, _aggregate(dialect).where(message_filter))
+        )
+        fresh = {
+            row[0]: tuple(row[1:5])
+            for row in db.execute(
+                select(ConversationStats.user_id, *[ConversationStats.__table__.c[n] for n in _COUNTERS])
+                .where(stats_filter)
+            )
+        }
+        db.commit()
+
+    drifted = sum(1 for user_id, counters in fresh.items() if stored.get(user_id) != counters)
+    orphaned = sum(1 for user_id in stored if user_id not in fresh and any(stored[user_id]))
+    summary = {"users": len(fresh), "drifted": drifted, "orphaned": orphaned}
+    logger.info(
+        "Rebuilt conversation stats for %d users in %.1fs (%d drifted, %d stale rows removed)",
+        len(fresh), time.perf_counter() - started, drifted, orphaned,
+    )
+    return summary
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Rebuild per-user conversation stats from chat_messages")
+    parser.add_argument("--users", default="", help="Comma separated user ids; default is every user")
+    return parser.parse_args()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    rebuild([int(u) for u in args.users.split(",") if u] or None)
+
+
+if __name__ == "__main__":
+    main()
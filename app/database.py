@@ -1,17 +1,145 @@
 from __future__ import annotations
 import os
-from typing import Generator
-from sqlalchemy import create_engine
+import time
+import threading
+from typing import Any, AsyncGenerator, Dict, Generator
+from sqlalchemy import create_engine, event
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlalchemy.orm import sessionmaker,declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./users.db")
 
 SQL_ECHO = os.getenv("SQL_ECHO", "0").lower() in {"1","true","yes","on"}
 
-# Define connect_args based on the database type
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else{}
+# Connection pool (file SQLite and Postgres)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() in {"1","true","yes","on"}
+# Postgres: server-side cap on any single statement, in milliseconds (0 disables)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args, echo=SQL_ECHO,future=True)
+# SQLite: applied to every new connection. WAL lets readers run alongside the single writer.
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+def _async_url(url: str) -> str:
+    """Map a sync DATABASE_URL onto its asyncio driver (aiosqlite / asyncpg)."""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url[len("postgres://"):]
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+class PoolWaitStats:
+    """How long checkouts waited for a connection, per engine."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": self.wait_seconds,
+                "wait_seconds_mean": (self.wait_seconds / self.checkouts) if self.checkouts else 0.0,
+                "wait_seconds_max": self.max_wait_seconds,
+            }
+
+
+_pool_waits: Dict[str, PoolWaitStats] = {"sync": PoolWaitStats(), "async": PoolWaitStats()}
+
+
+def _timed_pool(base: type, name: str) -> type:
+    """Pool subclass that records checkout wait; survives `recreate()` since it is a class."""
+    stats = _pool_waits[name]
+
+    class TimedPool(base):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                conn = super()._do_get()
+            except sa_exc.TimeoutError:
+                stats.record_timeout()
+                raise
+            stats.record(time.perf_counter() - started)
+            return conn
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return _is_sqlite(url) and (":memory:" in url or url.split("://", 1)[-1] in ("", "/"))
+
+
+def _engine_options(url: str, name: str) -> Dict[str, Any]:
+    is_async = name == "async"
+    options: Dict[str, Any] = {"echo": SQL_ECHO}
+    if _is_memory_sqlite(url):
+        return options
+    connect_args: Dict[str, Any] = {}
+    if _is_sqlite(url):
+        connect_args["check_same_thread"] = False
+    elif url.startswith("postgres") and DB_STATEMENT_TIMEOUT_MS:
+        if "asyncpg" in url:
+            connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        else:
+            connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    options.update(
+        connect_args=connect_args,
+        poolclass=_timed_pool(AsyncAdaptedQueuePool if is_async else QueuePool, name),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    return options
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    finally:
+        cursor.close()
+
+
+engine = create_engine(DATABASE_URL, future=True, **_engine_options(DATABASE_URL, "sync"))
+if _is_sqlite(DATABASE_URL) and not _is_memory_sqlite(DATABASE_URL):
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
 
 Base = declarative_base()
 
@@ -22,6 +150,16 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL, "async"))
+if _is_sqlite(ASYNC_DATABASE_URL) and not _is_memory_sqlite(ASYNC_DATABASE_URL):
+    event.listen(async_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 def get_db()->Generator:
     db = SessionLocal()
     try:
@@ -29,9 +167,23 @@ def get_db()->Generator:
     finally:
         db.close()
 
+async def get_async_db()->AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def init_db()->None:
     from app import models
     models.Base.metadata.create_all(bind=engine)
 
-
-
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """Size/usage of each engine's pool plus checkout wait times."""
+    stats = {}
+    for name, pool in (("sync", engine.pool), ("async", async_engine.pool)):
+        entry: Dict[str, Any] = {"pool": type(pool).__name__}
+        for attr in ("size", "checkedin", "checkedout", "overflow"):
+            fn = getattr(pool, attr, None)
+            if callable(fn):
+                entry[attr] = fn()
+        entry.update(_pool_waits[name].snapshot())
+        stats[name] = entry
+    return stats
@@ -0,0 +1,276 @@
+from __future__ import annotations
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "1").lower() in {"1","true","yes","on"}
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join(DATA_DIR, "_embedding_cache.sqlite3"))
+EMBED_CACHE_MAX_ROWS = int(os.getenv("EMBED_CACHE_MAX_ROWS", "500000"))
+EMBED_CACHE_HOT_ENTRIES = int(os.getenv("EMBED_CACHE_HOT_ENTRIES", "4096"))
+# a hit only rewrites last_used when it is older than this; trimming needs no finer recency
+EMBED_CACHE_TOUCH_SECONDS = float(os.getenv("EMBED_CACHE_TOUCH_SECONDS", "3600"))
+# the file is shared by every worker; re-read its row count after this many local inserts
+EMBED_CACHE_RECOUNT_ROWS = int(os.getenv("EMBED_CACHE_RECOUNT_ROWS", "1000"))
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalize and collapse whitespace so trivially different strings share a key."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class _DiskStore:
+    """
+    SQLite table of packed float32 vectors with least-recently-used trimming. All workers
+    share the file, so `max_rows` caps the table, not one worker's inserts: the row count
+    is re-read from the table before trimming and every `recount_rows` local inserts.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_rows: int,
+        touch_seconds: float = EMBED_CACHE_TOUCH_SECONDS,
+        recount_rows: int = EMBED_CACHE_RECOUNT_ROWS,
+    ):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_rows = max_rows
+        self.touch_seconds = touch_seconds
+        self.recount_rows = recount_rows
+        self._since_count = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._rows = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        if not keys:
+            return {}
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        stale: List[str] = []
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector, last_used FROM embeddings WHERE key IN ({marks})", part
+                ).fetchall()
+                for key, blob, last_used in rows:
+                    found[key] = array("f", blob).tolist()
+                    if now - last_used >= self.touch_seconds:
+                        stale.append(key)
+            if stale:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in stale],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()],
+            )
+            inserted = self._conn.total_changes - before
+            self._rows += inserted
+            self._since_count += inserted
+            if self._rows > self.max_rows * 1.1 or self._since_count >= self.recount_rows:
+                # other workers insert too; the local estimate only says when to look
+                self._rows = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                self._since_count = 0
+            # trim in slabs so eviction cost is amortised over many inserts
+            if self._rows > self.max_rows * 1.1:
+                excess = self._rows - self.max_rows
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (excess,),
+                )
+                self._rows -= excess
+                self.evictions += excess
+            self._conn.commit()
+
+    def row_count(self) -> int:
+        return self._rows
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper keyed by sha256(model name + normalized text). Lookups go through
+    an in-memory LRU, then the on-disk store, and only misses reach the provider.
+    Identical texts inside one batch are embedded once.
+    """
+
+    def __init__(
+        self,
+        underlying: Callable[[], Embeddings],
+        *,
+        model_name: str,
+        path: str = EMBED_CACHE_PATH,
+        max_rows: int = EMBED_CACHE_MAX_ROWS,
+        hot_entries: int = EMBED_CACHE_HOT_ENTRIES,
+    ):
+        self._underlying = underlying
+        self.model_name = model_name
+        self.hot_entries = hot_entries
+        self._hot: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._hot_lock = threading.Lock()
+        self._disk = _DiskStore(path, max_rows)
+        self._counters = {"hot_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _hot_get(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._hot_lock:
+            for key in keys:
+                vector = self._hot.get(key)
+                if vector is not None:
+                    self._hot.move_to_end(key)
+                    found[key] = vector
+        return found
+
+    def _hot_put(self, items: Dict[str, List[float]]) -> None:
+        with self._hot_lock:
+            for key, vector in items.items():
+                self._hot[key] = vector
+                self._hot.move_to_end(key)
+            while len(self._hot) > self.hot_entries:
+                self._hot.popitem(last=False)
+
+    def _count(self, name: str, amount: int) -> None:
+        # called from threadpool lookups and from the event loop
+        with self._hot_lock:
+            self._counters[name] += amount
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        unique = list(dict.fromkeys(keys))
+        found = self._hot_get(unique)
+        self._count("hot_hits", len(found))
+        cold = [key for key in unique if key not in found]
+        from_disk = self._disk.get_many(cold)
+        if from_disk:
+            self._count("disk_hits", len(from_disk))
+            self._hot_put(from_disk)
+            found.update(from_disk)
+        return found
+
+    def _store(self, computed: Dict[str, List[float]]) -> None:
+        self._hot_put(computed)
+        self._disk.put_many(computed)
+
+    def _misses(self, texts: List[str], keys: List[str], found: Dict[str, List[float]]) -> Dict[str, str]:
+        missing: Dict[str, str] = {}
+        for text, key in zip(texts, keys):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self._count("misses", len(missing))
+        return missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        found = self._lookup(keys)
+        missing = self._misses(texts, keys, found)
+        if missing:
+            vectors = self._underlying().embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+        self._count("misses", 1)
+        vector = self._underlying().embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        found = await run_in_threadpool(self._lookup, keys)
+        missing = self._misses(texts, keys, found)
+        if missing:
+            vectors = await self._underlying().aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            await run_in_threadpool(self._store, computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        found = await run_in_threadpool(self._lookup, [key])
+        if key in found:
+            return found[key]
+        self._count("misses", 1)
+        vector = await self._underlying().aembed_query(text)
+        await run_in_threadpool(self._store, {key: vector})
+        return vector
+
+    def stats(self) -> Dict[str, float]:
+        with self._hot_lock:
+            counters = dict(self._counters)
+            hot_entries = len(self._hot)
+        hits = counters["hot_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            **counters,
+            "hit_rate": (hits / lookups) if lookups else 0.0,
+            "hot_entries": hot_entries,
+            "disk_rows": self._disk.row_count(),
+            "disk_evictions": self._disk.evictions,
+        }
+
+    def close(self) -> None:
+        self._disk.close()
+
+
+_cached: Optional[CachedEmbeddings] = None
+_cached_lock = threading.Lock()
+
+
+def get_cached_embeddings(underlying: Callable[[], Embeddings], model_name: str) -> CachedEmbeddings:
+    """Process-wide cache instance; `underlying` is resolved per call so client restarts are picked up."""
+    global _cached
+    if _cached is None:
+        with _cached_lock:
+            if _cached is None:
+                _cached = CachedEmbeddings(underlying, model_name=model_name)
+    return _cached
+
+
+def embedding_cache_stats() -> Optional[Dict[str, float]]:
+    return _cached.stats() if _cached is not None else None
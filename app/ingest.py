@@ -0,0 +1,350 @@
+from __future__ import annotations
+import os
+import json
+import time
+import uuid
+import fcntl
+import asyncio
+import logging
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from app.database import AsyncSessionLocal
+from app.metrics import INGESTED_CHUNKS, time_stage
+from app.models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", os.path.join(DATA_DIR, "_ingest"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+INGEST_FLUSH_SECONDS = float(os.getenv("INGEST_FLUSH_SECONDS", "2"))
+INGEST_FSYNC = os.getenv("INGEST_FSYNC", "0").lower() in {"1","true","yes","on"}
+INGEST_RETRY_MAX_SECONDS = float(os.getenv("INGEST_RETRY_MAX_SECONDS", "60"))
+
+
+def _record_ts(record: Dict[str, Any]) -> datetime:
+    ts = datetime.fromisoformat(record["ts"])
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts
+
+
+class IngestQueue:
+    """
+    Write-behind embedding stage for finished chat turns.
+
+    `enqueue` appends the turn to this worker's spool file and returns immediately. A
+    background task drains the queue once `batch_size` turns are waiting or the oldest
+    has waited `flush_seconds`, embeds every chunk of the batch (across users) in one
+    embeddings call, then upserts per user. The highest flushed sequence number is
+    recorded in an `.ack` file; on startup, spools left behind by dead workers are
+    replayed. Vector ids are derived from the assistant message id, so a replay after
+    a crash between upsert and ack does not duplicate memories. Turns whose messages
+    have been deleted by the time their batch flushes are dropped, not embedded.
+    """
+
+    def __init__(
+        self,
+        *,
+        spool_dir: str = INGEST_SPOOL_DIR,
+        batch_size: int = INGEST_BATCH_SIZE,
+        flush_seconds: float = INGEST_FLUSH_SECONDS,
+        fsync: bool = INGEST_FSYNC,
+    ):
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._spool = None
+        self._spool_path: Optional[str] = None
+        self._seq = 0
+        self._acked = 0
+        # held while a batch is written, so `discard` never races an in-flight flush
+        self._flush_lock = asyncio.Lock()
+        self._counters = {
+            "enqueued": 0,
+            "recovered": 0,
+            "discarded": 0,
+            "skipped_deleted": 0,
+            "flushed_turns": 0,
+            "flushed_chunks": 0,
+            "batches": 0,
+            "failures": 0,
+        }
+        self._last_flush_at: Optional[float] = None
+        self._last_batch_seconds: Optional[float] = None
+
+    # -- spool ---------------------------------------------------------------
+
+    def _open_spool(self) -> None:
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._spool_path = os.path.join(self.spool_dir, f"spool-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl")
+        self._spool = open(self._spool_path, "a+", encoding="utf-8")
+        # held for the lifetime of the worker; lets other workers tell live spools from orphans
+        fcntl.flock(self._spool.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        self._spool.write(json.dumps(record) + "\n")
+        self._spool.flush()
+        if self.fsync:
+            os.fsync(self._spool.fileno())
+
+    def _write_ack(self, seq: int) -> None:
+        self._acked = seq
+        tmp = self._spool_path + ".ack.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(seq))
+        os.replace(tmp, self._spool_path + ".ack")
+        if not self._pending and seq == self._seq:
+            # everything durable is flushed; start the spool over
+            self._spool.seek(0)
+            self._spool.truncate()
+
+    def _rewrite_spool(self) -> None:
+        """Replace the spool with the still-pending records."""
+        self._spool.seek(0)
+        self._spool.truncate()
+        for record in self._pending:
+            self._write(record)
+        if not self._pending:
+            self._write_ack(self._seq)
+
+    def _recover_orphans(self) -> None:
+        for name in sorted(os.listdir(self.spool_dir)):
+            path = os.path.join(self.spool_dir, name)
+            if not name.endswith(".jsonl") or path == self._spool_path:
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # owned by a live worker
+                acked = 0
+                try:
+                    with open(path + ".ack", "r", encoding="utf-8") as a:
+                        acked = int(a.read().strip() or 0)
+                except (OSError, ValueError):
+                    pass
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn final line from a crash mid-write
+                    if record.get("seq", 0) <= acked:
+                        continue
+                    self._seq += 1
+                    record["seq"] = self._seq
+                    self._write(record)
+                    self._pending.append(record)
+                    self._counters["recovered"] += 1
+            for stale in (path, path + ".ack"):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        if self._counters["recovered"]:
+            logger.info("Recovered %d unflushed turns from ingest spool", self._counters["recovered"])
+
+    # -- lifecycle -----------------------------------------------------------
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._open_spool()
+        self._recover_orphans()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Flush what is queued (bounded by `timeout`); anything left stays in the spool."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Ingest queue stop timed out with %d turns pending", len(self._pending))
+        self._task = None
+        spool, self._spool = self._spool, None
+        spool.close()
+        if not self._pending and self._acked == self._seq:
+            for stale in (self._spool_path, self._spool_path + ".ack"):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    # -- producer ------------------------------------------------------------
+
+    def enqueue(
+        self,
+        *,
+        user_id: str,
+        user_message_id: int,
+        assistant_message_id: int,
+        user_text: str,
+        answer: str,
+        ts: Optional[datetime] = None,
+    ) -> None:
+        if self._spool is None:
+            raise RuntimeError("Ingest queue is not running")
+        ts = ts or datetime.now(timezone.utc)
+        self._seq += 1
+        record = {
+            "seq": self._seq,
+            "user_id": str(user_id),
+            "user_message_id": user_message_id,
+            "assistant_message_id": assistant_message_id,
+            "user_text": user_text,
+            "answer": answer,
+            "ts": ts.isoformat(),
+            "enqueued_at": time.time(),
+        }
+        self._write(record)
+        self._pending.append(record)
+        self._counters["enqueued"] += 1
+        if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+            # first item starts the flush timer; a full batch flushes right away
+            self._wakeup.set()
+
+    async def discard(self, user_id: str, before: Optional[datetime] = None) -> int:
+        """
+        Drop the user's queued turns (those older than `before`, if given) from the queue
+        and the spool, after any batch already being written has finished. Returns how
+        many were dropped.
+        """
+        async with self._flush_lock:
+            keep: Deque[Dict[str, Any]] = deque()
+            dropped = 0
+            for record in self._pending:
+                if record["user_id"] == str(user_id) and (
+                    before is None or _record_ts(record) < before
+                ):
+                    dropped += 1
+                else:
+                    keep.append(record)
+            if dropped:
+                self._pending = keep
+                if self._spool is not None:
+                    self._rewrite_spool()
+                self._counters["discarded"] += dropped
+        return dropped
+
+    # -- consumer ------------------------------------------------------------
+
+    async def _run(self) -> None:
+        delay = 1.0
+        while self._pending or not self._stopping:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            age = time.time() - self._pending[0]["enqueued_at"]
+            if len(self._pending) < self.batch_size and age < self.flush_seconds and not self._stopping:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_seconds - age)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            async with self._flush_lock:
+                batch = [self._pending[i] for i in range(min(len(self._pending), self.batch_size))]
+                if not batch:
+                    continue  # discarded while waiting for the lock
+                try:
+                    await self._flush(batch)
+                except Exception as e:
+                    self._counters["failures"] += 1
+                    logger.warning("Embedding batch of %d turns failed, retrying in %.0fs: %s", len(batch), delay, e)
+                    failed = True
+                else:
+                    failed = False
+                    delay = 1.0
+                    for _ in batch:
+                        self._pending.popleft()
+                    self._write_ack(batch[-1]["seq"])
+            if failed:
+                if self._stopping:
+                    return
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, INGEST_RETRY_MAX_SECONDS)
+
+    async def _live(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The records whose messages both still exist; history may be deleted while queued."""
+        ids = {r[key] for r in batch for key in ("user_message_id", "assistant_message_id")}
+        async with AsyncSessionLocal() as db:
+            existing = set((await db.execute(select(ChatMessage.id).where(ChatMessage.id.in_(ids)))).scalars())
+        live = [r for r in batch if r["user_message_id"] in existing and r["assistant_message_id"] in existing]
+        if len(live) < len(batch):
+            self._counters["skipped_deleted"] += len(batch) - len(live)
+        return live
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        # the vector stack is imported by the first flush, not at worker startup
+        from app.vector_store import _get_embeddings, add_embedded, turn_chunks
+
+        started = time.perf_counter()
+        live = await self._live(batch)
+        owners: List[tuple] = []
+        for record in live:
+            for chunk in turn_chunks(
+                record["user_id"],
+                record["user_message_id"],
+                record["assistant_message_id"],
+                record["user_text"],
+                record["answer"],
+                _record_ts(record),
+            ):
+                owners.append((record["user_id"], chunk))
+        texts = [chunk[1] for _, chunk in owners]
+
+        if texts:
+            with time_stage("embed"):
+                vectors = await _get_embeddings().aembed_documents(texts)
+
+            per_user: Dict[str, Dict[str, list]] = defaultdict(
+                lambda: {"ids": [], "texts": [], "vectors": [], "metadatas": []}
+            )
+            for (user_id, (chunk_id, text, metadata)), vector in zip(owners, vectors):
+                rows = per_user[user_id]
+                rows["ids"].append(chunk_id)
+                rows["texts"].append(text)
+                rows["vectors"].append(vector)
+                rows["metadatas"].append(metadata)
+
+            with time_stage("store_write"):
+                for user_id, rows in per_user.items():
+                    await run_in_threadpool(add_embedded, user_id, **rows)
+            INGESTED_CHUNKS.inc(len(texts))
+
+        self._counters["batches"] += 1
+        # turns dropped by _live are counted in skipped_deleted only
+        self._counters["flushed_turns"] += len(live)
+        self._counters["flushed_chunks"] += len(texts)
+        self._last_flush_at = time.time()
+        self._last_batch_seconds = time.perf_counter() - started
+
+    # -- metrics -------------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        oldest = self._pending[0]["enqueued_at"] if self._pending else None
+        return {
+            **self._counters,
+            "depth": len(self._pending),
+            "lag_seconds": (time.time() - oldest) if oldest else 0.0,
+            "last_flush_at": self._last_flush_at,
+            "last_batch_seconds": self._last_batch_seconds,
+            "running": self._task is not None,
+        }
+
+
+ingest_queue = IngestQueue()
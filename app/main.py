@@ -1,19 +1,52 @@
+import os
+import sys
+import importlib
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.openapi.utils import get_openapi
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from app.auth import router as auth_router
-from app.database import init_db
+from app.clients import shutdown_clients
+from app.database import async_engine, init_db
+from app.ingest import ingest_queue
+from app.password_pool import password_pool
+from app.profiling import install_profiling
 from app.protected_routes import router as protected_router
+from app.routes_metrics import router as metrics_router
 from app.routes_chat import router as chat_router
 from app.routes_history import router as history_router
 from app.routes_soul import router as soul_router
 
+# create_all when a worker starts; gunicorn.conf.py runs it once in the master and turns this off
+DB_INIT_ON_STARTUP = os.getenv("DB_INIT_ON_STARTUP", "1").lower() in {"1", "true", "yes", "on"}
+# import LangChain and the vector stores before serving instead of on the first chat turn
+PRELOAD_CHAT = os.getenv("PRELOAD_CHAT", "0").lower() in {"1", "true", "yes", "on"}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DB_INIT_ON_STARTUP:
+        await run_in_threadpool(init_db)
+    if PRELOAD_CHAT:
+        await run_in_threadpool(importlib.import_module, "app.chains")
+    await ingest_queue.start()
+    yield
+    await ingest_queue.stop()
+    vector_store = sys.modules.get("app.vector_store")
+    if vector_store is not None:
+        vector_store.store_cache.clear()
+    password_pool.shutdown()
+    await shutdown_clients()
+    # pooled aiosqlite connections each own a non-daemon thread; close them so the worker can exit
+    await async_engine.dispose()
 
 
 app = FastAPI(
     title="AI Soul Counselor",
     version="0.1.0",
-    description="An AI powered counseling platform"
+    description="An AI powered counseling platform",
+    lifespan=lifespan,
 )
 
 
@@ -27,13 +60,14 @@ allow_headers=["*"],
 
 )
 
-init_db()
+install_profiling(app)
 
 app.include_router(soul_router)
 app.include_router(auth_router,prefix="/auth")
 app.include_router(protected_router, prefix="/protected")
 app.include_router(chat_router,prefix="/chat")
 app.include_router(history_router,prefix="/history")
+app.include_router(metrics_router)
 
 @app.get("/")
 def root():
@@ -0,0 +1,195 @@
+"""
+Process-local counters and histograms for the chat pipeline, rendered in the Prometheus
+text format by GET /metrics. Each worker exports its own numbers; Prometheus adds the
+instance label.
+
+Labels are fixed, low-cardinality strings (stage, retrieval path, outcome). Never put
+user ids or free text in a label. Recording costs one lock and a bisect, so this stays
+on in production; METRICS_ENABLED=0 turns recording into a no-op.
+"""
+from __future__ import annotations
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() in {"1", "true", "yes", "on"}
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+DOC_BUCKETS = (0, 1, 2, 4, 6, 8, 12, 16, 24)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = SECONDS_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket..., count above the last bucket], sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the seconds spent in the block, including when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+        lines = self._header()
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "soul_stage_seconds",
+    "Seconds spent per chat pipeline stage",
+    ("stage",),
+)
+TURN_SECONDS = Histogram(
+    "soul_chat_turn_seconds",
+    "Seconds from context load to the last answer token, per retrieval path",
+    ("path",),
+)
+TURNS = Counter(
+    "soul_chat_turns_total",
+    "Chat turns by retrieval path and outcome (ok, fallback, error, cancelled)",
+    ("path", "outcome"),
+)
+TOKENS = Counter(
+    "soul_chat_tokens_total",
+    "Prompt tokens sent to and answer tokens received from the answer model",
+    ("kind",),
+)
+PROMPT_TOKENS = Histogram(
+    "soul_chat_prompt_tokens",
+    "Answer prompt size in tokens",
+    buckets=TOKEN_BUCKETS,
+)
+RETRIEVED_DOCS = Histogram(
+    "soul_retrieved_docs",
+    "Chunks per turn returned by the retriever and kept after packing",
+    ("kind",),
+    buckets=DOC_BUCKETS,
+)
+INGESTED_CHUNKS = Counter(
+    "soul_ingest_chunks_total",
+    "Chunks embedded and written by the background ingest queue",
+)
+
+METRICS = (STAGE_SECONDS, TURN_SECONDS, TURNS, TOKENS, PROMPT_TOKENS, RETRIEVED_DOCS, INGESTED_CHUNKS)
+
+
+def time_stage(stage: str):
+    """`with time_stage("retrieval"): ...`"""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+def render_snapshot(prefix: str, stats: Optional[Dict[str, object]], labels: Optional[Dict[str, str]] = None) -> List[str]:
+    """
+    Numeric fields of an existing `stats()` dict as untyped samples named
+    `<prefix>_<field>`; strings, None and nested values are skipped.
+    """
+    lines: List[str] = []
+    if not stats:
+        return lines
+    names, values = tuple((labels or {}).keys()), tuple((labels or {}).values())
+    for field, value in stats.items():
+        if isinstance(value, bool):
+            value = int(value)
+        if not isinstance(value, (int, float)):
+            continue
+        lines.append(f"{prefix}_{field}{_format_labels(names, values)} {_format_value(value)}")
+    return lines
+
+
+def render(snapshots: Sequence[str] = ()) -> str:
+    lines: List[str] = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    # samples of one name must be contiguous; a stable sort keeps their label order
+    lines.extend(sorted(snapshots, key=lambda line: line.split("{", 1)[0].split(" ", 1)[0]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,152 @@
+"""
+Move per-user Chroma directories (DATA_DIR/<user_id>/chroma_db) into the shared
+collections used by VECTOR_STORE_MODE=shared. Vectors are copied as-is, so nothing
+is re-embedded.
+
+    python -m app.migrate_vectors --batch-size 1000 --delete-source
+"""
+from __future__ import annotations
+import os
+import time
+import shutil
+import logging
+import argparse
+from typing import Dict, Iterator, List, Optional
+import chromadb
+from app.vector_store import (
+    DATA_DIR,
+    SHARED_STORE_DIR,
+    release_client,
+    shared_collection_name,
+)
+
+logger = logging.getLogger(__name__)
+
+# collection name LangChain's Chroma wrapper uses when none is given
+SOURCE_COLLECTION = "langchain"
+
+
+def iter_user_dirs(data_dir: str, only: Optional[List[str]] = None) -> Iterator[tuple]:
+    for name in sorted(os.listdir(data_dir)):
+        if name.startswith("_") or (only and name not in only):
+            continue
+        path = os.path.join(data_dir, name, "chroma_db")
+        if os.path.isdir(path):
+            yield name, path
+
+
+def migrate_user(
+    user_id: str,
+    source_dir: str,
+    shared: chromadb.api.ClientAPI,
+    *,
+    batch_size: int,
+    delete_source: bool,
+) -> int:
+    """Copy one user's vectors into their shared collection. Returns the number copied."""
+    source = chromadb.PersistentClient(path=source_dir)
+    try:
+        try:
+            collection = source.get_collection(SOURCE_COLLECTION)
+        except ValueError:
+            return 0
+        target = shared.get_or_create_collection(shared_collection_name(user_id))
+
+        copied = 0
+        total = collection.count()
+        while copied < total:
+            page = collection.get(
+                limit=batch_size,
+                offset=copied,
+                include=["embeddings", "documents", "metadatas"],
+            )
+            if not page["ids"]:
+                break
+            metadatas = [{**(m or {}), "user_id": user_id} for m in page["metadatas"]]
+            target.upsert(
+                ids=page["ids"],
+                embeddings=page["embeddings"],
+                documents=page["documents"],
+                metadatas=metadatas,
+            )
+            copied += len(page["ids"])
+
+        landed = len(target.get(where={"user_id": user_id}, include=[])["ids"])
+        if landed < total:
+            raise RuntimeError(f"user {user_id}: copied {landed} of {total} vectors")
+    finally:
+        release_client(source)
+
+    if delete_source:
+        shutil.rmtree(source_dir, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(source_dir))  # only succeeds if nothing else lives there
+        except OSError:
+            pass
+    return copied
+
+
+def migrate(
+    *,
+    data_dir: str = DATA_DIR,
+    shared_dir: str = SHARED_STORE_DIR,
+    batch_size: int = 1000,
+    delete_source: bool = False,
+    only: Optional[List[str]] = None,
+) -> Dict[str, int]:
+    os.makedirs(shared_dir, exist_ok=True)
+    shared = chromadb.PersistentClient(path=shared_dir)
+    started = time.perf_counter()
+    summary = {"users": 0, "vectors": 0, "failed": 0}
+    try:
+        for user_id, source_dir in iter_user_dirs(data_dir, only):
+            try:
+                copied = migrate_user(
+                    user_id, source_dir, shared,
+                    batch_size=batch_size, delete_source=delete_source,
+                )
+            except Exception as e:
+                summary["failed"] += 1
+                logger.error("Failed to migrate user %s: %s", user_id, e)
+                continue
+            summary["users"] += 1
+            summary["vectors"] += copied
+            logger.info("Migrated user %s (%d vectors)", user_id, copied)
+    finally:
+        release_client(shared)
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        "Migrated %d users / %d vectors in %.1fs (%.0f vectors/s), %d failed",
+        summary["users"], summary["vectors"], elapsed,
+        summary["vectors"] / elapsed if elapsed else 0.0, summary["failed"],
+    )
+    return summary
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Move per-user Chroma stores into shared collections")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--shared-dir", default=SHARED_STORE_DIR)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--users", default="", help="Comma separated user ids; default is every user")
+    parser.add_argument("--delete-source", action="store_true", help="Remove each per-user store once verified")
+    return parser.parse_args()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    summary = migrate(
+        data_dir=args.data_dir,
+        shared_dir=args.shared_dir,
+        batch_size=args.batch_size,
+        delete_source=args.delete_source,
+        only=[u for u in args.users.split(",") if u] or None,
+    )
+    if summary["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
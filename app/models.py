@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, func
+from datetime import datetime, timezone
+from sqlalchemy import BigInteger, Column, Integer, String, ForeignKey, DateTime, Text, Index, func
 from sqlalchemy.orm import relationship
 from app.database import Base
 
@@ -13,6 +14,7 @@ class User(Base):
 
     messages = relationship("ChatMessage", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
     soul_settings = relationship("SoulSettings", back_populates="user", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+    stats = relationship("ConversationStats", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
 
 
 # --- ChatMessage Model ---
@@ -20,13 +22,38 @@ class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     role = Column(String(20), nullable=False)  # "user" or "assistant"
     content = Column(Text, nullable=False)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    # set client-side so every row carries microseconds and compares consistently in keyset queries
+    timestamp = Column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
+        index=True,
+    )
 
     user = relationship("User", back_populates="messages")
 
+    __table_args__ = (
+        # serves every per-user history read in (timestamp, id) order; also covers user_id lookups
+        Index("ix_chat_messages_user_ts_id", "user_id", "timestamp", "id"),
+    )
+
+
+# --- ConversationStats Model ---
+class ConversationStats(Base):
+    """Per-user message counters, maintained in the same transaction as every insert/delete."""
+    __tablename__ = "conversation_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    total_messages = Column(Integer, nullable=False, default=0, server_default="0")
+    user_messages = Column(Integer, nullable=False, default=0, server_default="0")
+    assistant_messages = Column(Integer, nullable=False, default=0, server_default="0")
+    content_bytes = Column(BigInteger, nullable=False, default=0, server_default="0")
+    first_message_at = Column(DateTime(timezone=True))
+    last_message_at = Column(DateTime(timezone=True))
+
 
 # --- SoulSettings Model ---
 
@@ -42,9 +69,15 @@ class SoulSettings(Base):
     memory_aggressiveness=Column(Integer, default=5)
     boundaries=Column(String(500), default="Respectful and supportive")
     creativity_level=Column(Integer, default=5)
+    # days of history kept by the retention sweep; NULL keeps everything
+    retention_days = Column(Integer, nullable=True)
+    # bumped by every UPDATE; cached personality prompts are keyed on it
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     user = relationship("User", back_populates="soul_settings", uselist=False)
 
+    __mapper_args__ = {"version_id_col": version}
+
 
 
 
@@ -0,0 +1,502 @@
+from __future__ import annotations
+import os
+import json
+import uuid
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import hnswlib
+except ImportError:  # shipped with chromadb as chroma-hnswlib; exact search still works without it
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+NUMPY_ANN_THRESHOLD = int(os.getenv("NUMPY_ANN_THRESHOLD", "20000"))
+NUMPY_COMPACT_RATIO = float(os.getenv("NUMPY_COMPACT_RATIO", "0.25"))
+
+
+def _matches(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Subset of Chroma's `where` syntax: equality, $eq/$ne/$in/$nin/$lt/$lte/$gt/$gte, $and/$or."""
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, c) for c in cond):
+                return False
+            continue
+        if key == "$or":
+            if not any(_matches(metadata, c) for c in cond):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        for op, arg in cond.items():
+            if op == "$eq" and value != arg:
+                return False
+            if op == "$ne" and value == arg:
+                return False
+            if op == "$in" and value not in arg:
+                return False
+            if op == "$nin" and value in arg:
+                return False
+            if op in ("$lt", "$lte", "$gt", "$gte"):
+                if value is None:
+                    return False
+                if op == "$lt" and not value < arg:
+                    return False
+                if op == "$lte" and not value <= arg:
+                    return False
+                if op == "$gt" and not value > arg:
+                    return False
+                if op == "$gte" and not value >= arg:
+                    return False
+    return True
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    One user's memories as a contiguous float32 matrix on disk.
+
+    Layout of `path`:
+        store.json            {"dim": d, "generation": g}, replaced atomically
+        vectors-<g>.f32       append-only rows of d float32 values, read through np.memmap
+        meta-<g>.jsonl        append log: {"id", "text", "metadata"} per row, {"delete": [ids]}
+
+    Search is an exact cosine top-k over the live rows. Past `ann_threshold` live rows an
+    in-memory hnswlib index is built (when available) and its candidates are re-checked
+    against deletions and filters, falling back to the exact scan if too few survive.
+    Deleted rows are tombstoned and reclaimed by rewriting a new generation once they
+    exceed `compact_ratio` of the store.
+
+    Writers serialize on a `.lock` file, and every handle replays log entries appended by
+    other processes (or reloads after another process compacted) before it reads or writes,
+    so app workers and offline jobs can share a directory.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embedding: Embeddings,
+        *,
+        ann_threshold: int = NUMPY_ANN_THRESHOLD,
+        compact_ratio: float = NUMPY_COMPACT_RATIO,
+    ):
+        self.path = path
+        self._embedding = embedding
+        self.ann_threshold = ann_threshold
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        self._meta_file = None
+        self._vec_file = None
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    # -- files ---------------------------------------------------------------
+
+    def _file(self, kind: str, generation: Optional[int] = None) -> str:
+        generation = self._generation if generation is None else generation
+        ext = "f32" if kind == "vectors" else "jsonl"
+        return os.path.join(self.path, f"{kind}-{generation}.{ext}")
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock for writers; other processes (workers, offline jobs) may share the store."""
+        with open(os.path.join(self.path, ".lock"), "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _manifest_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(os.path.join(self.path, "store.json"))
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self) -> None:
+        self._close_appenders()
+        self._dim: Optional[int] = None
+        self._generation = 0
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._alive: List[bool] = []
+        self._row_of: Dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._ann = None
+        self._ann_rows = 0
+        self._meta_offset = 0
+
+        self._stamp = self._manifest_stamp()
+        if self._stamp is not None:
+            with open(os.path.join(self.path, "store.json"), "r", encoding="utf-8") as f:
+                info = json.load(f)
+            self._dim = info.get("dim")
+            self._generation = info.get("generation", 0)
+        self._replay()
+
+    def _replay(self) -> None:
+        """Apply metadata log entries past the last offset read."""
+        meta_path = self._file("meta")
+        if not self._dim or not os.path.exists(meta_path):
+            return
+        vec_path = self._file("vectors")
+        n_vectors = os.path.getsize(vec_path) // (4 * self._dim) if os.path.exists(vec_path) else 0
+        with open(meta_path, "rb") as f:
+            f.seek(self._meta_offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # line still being written, or torn by a crash
+                entry = json.loads(raw)
+                if "delete" in entry:
+                    for doc_id in entry["delete"]:
+                        row = self._row_of.pop(doc_id, None)
+                        if row is not None:
+                            self._alive[row] = False
+                elif len(self._ids) >= n_vectors:
+                    break  # metadata for a vector that never landed
+                else:
+                    self._append_row(entry["id"], entry["text"], entry.get("metadata") or {})
+                self._meta_offset += len(raw)
+        self._refresh_matrix()
+
+    def _sync(self) -> None:
+        """Pick up writes made through other handles on the same directory."""
+        if self._manifest_stamp() != self._stamp:
+            self._load()
+            return
+        try:
+            size = os.path.getsize(self._file("meta"))
+        except OSError:
+            return
+        if size != self._meta_offset:
+            self._replay()
+
+    def _append_row(self, doc_id: str, text: str, metadata: Dict[str, Any]) -> None:
+        old = self._row_of.get(doc_id)
+        if old is not None:
+            self._alive[old] = False
+        self._row_of[doc_id] = len(self._ids)
+        self._ids.append(doc_id)
+        self._texts.append(text)
+        self._metadatas.append(metadata)
+        self._alive.append(True)
+
+    def _refresh_matrix(self) -> None:
+        n = len(self._ids)
+        if not self._dim or n == 0:
+            self._matrix = None
+            self._norms = np.zeros(0, dtype=np.float32)
+            return
+        self._matrix = np.memmap(self._file("vectors"), dtype=np.float32, mode="r", shape=(n, self._dim))
+        start = len(self._norms)
+        if start > n:
+            start = 0
+            self._norms = np.zeros(0, dtype=np.float32)
+        fresh = np.linalg.norm(self._matrix[start:n], axis=1).astype(np.float32)
+        self._norms = np.concatenate([self._norms[:start], fresh])
+
+    def _open_appenders(self) -> None:
+        if self._vec_file is None:
+            self._vec_file = open(self._file("vectors"), "ab")
+            self._meta_file = open(self._file("meta"), "ab")
+        # sizes from the files, not our handles' positions: other handles append too
+        expected = len(self._ids) * 4 * self._dim
+        if os.fstat(self._vec_file.fileno()).st_size > expected:
+            # vectors appended without their metadata line by a crashed writer
+            self._vec_file.truncate(expected)
+        if os.fstat(self._meta_file.fileno()).st_size > self._meta_offset:
+            # a metadata line torn by a crashed writer; the next one must start clean
+            self._meta_file.truncate(self._meta_offset)
+
+    def _append_meta(self, entries: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(e) + "\n" for e in entries).encode("utf-8")
+        self._meta_file.write(data)
+        self._meta_file.flush()
+        self._meta_offset += len(data)
+
+    def _write_manifest(self) -> None:
+        tmp = os.path.join(self.path, "store.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": self._dim, "generation": self._generation}, f)
+        os.replace(tmp, os.path.join(self.path, "store.json"))
+        self._stamp = self._manifest_stamp()
+
+    def _close_appenders(self) -> None:
+        for f in (getattr(self, "_vec_file", None), getattr(self, "_meta_file", None)):
+            if f is not None:
+                f.close()
+        self._vec_file = self._meta_file = None
+
+    # -- writes --------------------------------------------------------------
+
+    def upsert_vectors(
+        self,
+        ids: List[str],
+        texts: List[str],
+        vectors: List[List[float]],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ) -> List[str]:
+        """Append pre-computed embeddings; an id that already exists is replaced."""
+        if not ids:
+            return []
+        metadatas = metadatas or [{} for _ in ids]
+        block = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            self._sync()
+            if self._dim is None:
+                self._dim = int(block.shape[1])
+                self._write_manifest()
+            if block.shape[1] != self._dim:
+                raise ValueError(f"Expected {self._dim}-dim vectors, got {block.shape[1]}")
+            self._open_appenders()
+            self._vec_file.write(block.tobytes())
+            self._vec_file.flush()
+            self._append_meta([
+                {"id": i, "text": t, "metadata": m} for i, t, m in zip(ids, texts, metadatas)
+            ])
+            for i, t, m in zip(ids, texts, metadatas):
+                self._append_row(i, t, m)
+            self._refresh_matrix()
+        return list(ids)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = self._embedding.embed_documents(texts)
+        return self.upsert_vectors(ids, texts, vectors, metadatas)
+
+    async def aadd_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = await self._embedding.aembed_documents(texts)
+        return await run_in_threadpool(self.upsert_vectors, ids, texts, vectors, metadatas)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock, self._file_lock():
+            self._sync()
+            present = [i for i in ids if i in self._row_of]
+            if not present:
+                return False
+            self._open_appenders()
+            self._append_meta([{"delete": present}])
+            for doc_id in present:
+                self._alive[self._row_of.pop(doc_id)] = False
+            dead = len(self._ids) - len(self._row_of)
+            if self._ids and dead / len(self._ids) > self.compact_ratio:
+                self._compact()
+        return True
+
+    def compact(self) -> None:
+        """Rewrite live rows into a new generation and drop the old files."""
+        with self._lock, self._file_lock():
+            self._sync()
+            self._compact()
+
+    def _compact(self) -> None:
+        live = [row for row, alive in enumerate(self._alive) if alive]
+        old_generation = self._generation
+        new_generation = old_generation + 1
+        with open(self._file("vectors", new_generation), "wb") as vf:
+            if live and self._matrix is not None:
+                vf.write(np.ascontiguousarray(self._matrix[live]).tobytes())
+        with open(self._file("meta", new_generation), "w", encoding="utf-8") as mf:
+            for row in live:
+                mf.write(json.dumps({
+                    "id": self._ids[row],
+                    "text": self._texts[row],
+                    "metadata": self._metadatas[row],
+                }) + "\n")
+
+        self._close_appenders()
+        self._matrix = None
+        self._generation = new_generation
+        self._write_manifest()
+        for kind in ("vectors", "meta"):
+            try:
+                os.remove(self._file(kind, old_generation))
+            except OSError:
+                pass
+        self._load()
+
+    def persist(self) -> None:
+        with self._lock:
+            for f in (self._vec_file, self._meta_file):
+                if f is not None:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_appenders()
+            self._matrix = None
+            self._ann = None
+
+    # -- reads ---------------------------------------------------------------
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, List[Any]]:
+        """Chroma-style `get`: live rows by id and/or metadata filter."""
+        with self._lock:
+            self._sync()
+            rows = (
+                [self._row_of[i] for i in ids if i in self._row_of]
+                if ids is not None
+                else [r for r, alive in enumerate(self._alive) if alive]
+            )
+            rows = [r for r in rows if _matches(self._metadatas[r], where)]
+            return {
+                "ids": [self._ids[r] for r in rows],
+                "documents": [self._texts[r] for r in rows],
+                "metadatas": [self._metadatas[r] for r in rows],
+            }
+
+    def count(self) -> int:
+        with self._lock:
+            self._sync()
+            return len(self._row_of)
+
+    def _candidate_mask(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        mask = np.fromiter(self._alive, dtype=bool, count=len(self._alive))
+        if where:
+            mask &= np.fromiter(
+                (_matches(m, where) for m in self._metadatas), dtype=bool, count=len(self._metadatas)
+            )
+        return mask
+
+    def _ann_index(self):
+        if hnswlib is None or self._matrix is None or len(self._row_of) < self.ann_threshold:
+            return None
+        n = len(self._ids)
+        if self._ann is None:
+            index = hnswlib.Index(space="cosine", dim=self._dim)
+            index.init_index(max_elements=max(2 * n, 1024), ef_construction=200, M=16)
+            index.add_items(np.asarray(self._matrix), np.arange(n))
+            index.set_ef(128)
+            self._ann, self._ann_rows = index, n
+        elif self._ann_rows < n:
+            if n > self._ann.get_max_elements():
+                self._ann.resize_index(2 * n)
+            self._ann.add_items(np.asarray(self._matrix[self._ann_rows:n]), np.arange(self._ann_rows, n))
+            self._ann_rows = n
+        return self._ann
+
+    def _search(
+        self,
+        query: List[float],
+        k: int,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[int, float]]:
+        """Return (row, cosine distance) pairs for the k nearest live rows matching `where`."""
+        with self._lock:
+            self._sync()
+            if self._matrix is None or not self._row_of:
+                return []
+            q = np.asarray(query, dtype=np.float32)
+            q_norm = float(np.linalg.norm(q)) or 1.0
+            mask = self._candidate_mask(where)
+
+            index = self._ann_index()
+            if index is not None:
+                fetch = min(len(self._ids), max(4 * k, k + 32))
+                labels, distances = index.knn_query(q, k=fetch)
+                hits = [
+                    (int(row), float(dist))
+                    for row, dist in zip(labels[0], distances[0])
+                    if mask[row]
+                ]
+                if len(hits) >= k or len(hits) == int(mask.sum()):
+                    return hits[:k]
+
+            candidates = np.flatnonzero(mask)
+            if candidates.size == 0:
+                return []
+            sims = (self._matrix[candidates] @ q) / (self._norms[candidates] * q_norm + 1e-12)
+            k = min(k, candidates.size)
+            top = np.argpartition(-sims, k - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+            return [(int(candidates[i]), float(1.0 - sims[i])) for i in top]
+
+    def _documents(self, hits: List[Tuple[int, float]]) -> List[Tuple[Document, float]]:
+        return [
+            (Document(page_content=self._texts[row], metadata=self._metadatas[row]), dist)
+            for row, dist in hits
+        ]
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self._documents(self._search(embedding, k, filter))
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    async def asimilarity_search(
+        self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Document]:
+        vector = await self._embedding.aembed_query(query)
+        return await run_in_threadpool(self.similarity_search_by_vector, vector, k, filter)
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return lambda distance: 1.0 - distance
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        path: str,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        store = cls(path, embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
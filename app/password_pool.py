@@ -0,0 +1,92 @@
+from __future__ import annotations
+import os
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+from app import utilities
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", "2"))
+# hashes allowed to wait for a worker before new requests are turned away with 429
+PASSWORD_POOL_MAX_QUEUE = int(os.getenv("PASSWORD_POOL_MAX_QUEUE", "32"))
+PASSWORD_POOL_RETRY_AFTER = int(os.getenv("PASSWORD_POOL_RETRY_AFTER", "2"))
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+class PasswordPool:
+    """
+    Dedicated process pool for bcrypt so hashing bursts (logins after a deploy) neither
+    hold the GIL nor occupy the thread pool that serves chat. At most `workers` hashes
+    run at once and `max_queue` more may wait; beyond that callers get PasswordPoolBusy.
+    """
+
+    def __init__(self, workers: int = PASSWORD_POOL_WORKERS, max_queue: int = PASSWORD_POOL_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counters = {"completed": 0, "failed": 0, "rejected": 0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that runs an event loop and client threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._counters["rejected"] += 1
+                raise PasswordPoolBusy()
+            self._in_flight += 1
+        outcome = "failed"
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            try:
+                result = await loop.run_in_executor(executor, fn, *args)
+            except BrokenProcessPool:
+                # a worker died; start a fresh pool on the next call instead of failing forever
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                logger.error("Password hashing pool broke; it will be restarted")
+                raise
+            outcome = "completed"
+            return result
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._counters[outcome] += 1
+
+    async def hash_password(self, password: str) -> str:
+        return await self._run(utilities.hash_password, password)
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(utilities.verify_and_update, password, hashed)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "in_flight": self._in_flight, "workers": self.workers}
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_pool = PasswordPool()
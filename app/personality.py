@@ -0,0 +1,93 @@
+"""
+The personality block that opens every answer prompt, rendered from a user's SoulSettings.
+
+Settings change rarely, so each worker keeps the rendered block per user together with the
+`SoulSettings.version` it was rendered from. The chat path reads only the version column;
+a PUT /soul/settings in any worker bumps it, which makes every other worker's entry stale
+on that user's next turn.
+"""
+from __future__ import annotations
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from app.models import SoulSettings
+
+PERSONALITY_CACHE_MAX_ENTRIES = int(os.getenv("PERSONALITY_CACHE_MAX_ENTRIES", "10000"))
+
+# written at registration, and used for users who predate that
+DEFAULT_SOUL_SETTINGS = {
+    "tone": "gentle",
+    "empathy_level": 5,
+    "reasoning_depth": 7,
+    "creativity_level": 5,
+    "memory_aggressiveness": 5,
+    "boundaries": "Respectful and supportive",
+}
+
+
+def render_personality(settings: Optional[SoulSettings]) -> str:
+    values = DEFAULT_SOUL_SETTINGS if settings is None else {
+        name: getattr(settings, name) for name in DEFAULT_SOUL_SETTINGS
+    }
+    return f"""
+--- USER'S AI SOUL PERSONALITY ---
+Tone: {values["tone"]}
+Empathy Level: {values["empathy_level"]}/10
+Reasoning Depth: {values["reasoning_depth"]}/10
+Creativity: {values["creativity_level"]}/10
+Memory Aggressiveness: {values["memory_aggressiveness"]}/10
+Boundaries: {values["boundaries"]}
+
+Follow these personality traits STRICTLY when responding.
+--------------------------------
+"""
+
+
+class PersonalityCache:
+    """LRU of user_id -> (settings version, rendered block). A version of None means defaults."""
+
+    def __init__(self, max_entries: int = PERSONALITY_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Tuple[Optional[int], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, version: Optional[int]) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id: int, version: Optional[int], text: str) -> None:
+        with self._lock:
+            self._entries[user_id] = (version, text)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+personality_cache = PersonalityCache()
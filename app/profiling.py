@@ -0,0 +1,167 @@
+"""
+On-demand profiling of single requests. A profiled request runs with a sampler thread
+that snapshots every thread's Python stack each PROFILE_INTERVAL_MS, and the samples are
+written as folded stacks (one `thread;outer;...;inner count` line per stack), the input
+format of flamegraph.pl, speedscope and inferno.
+
+A request is profiled when either:
+  - it carries `X-Profile: <PROFILE_TOKEN>` (the response then names the file in
+    `X-Profile-File`), or
+  - it is picked by PROFILE_SAMPLE_RATE; sampled profiles are only kept if the request
+    took at least PROFILE_MIN_MS.
+
+Every thread is sampled, so anyio's worker threads (store opens, vector writes and the
+other `run_in_threadpool` calls) appear next to the event loop. The event loop is shared,
+so its samples also include other requests that were in flight. One request per worker is
+profiled at a time. With neither setting configured the middleware is not installed.
+"""
+from __future__ import annotations
+import os
+import re
+import sys
+import time
+import random
+import logging
+import secrets
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN") or None
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MIN_MS = float(os.getenv("PROFILE_MIN_MS", "1000"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.getenv("DATA_DIR", "data"), "_profiles"))
+PROFILE_MAX_DEPTH = int(os.getenv("PROFILE_MAX_DEPTH", "200"))
+
+PROFILE_HEADER = b"x-profile"
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    # shortest name: relative to the longest sys.path entry that contains the file
+    for root in sorted(filter(None, sys.path), key=len, reverse=True):
+        if filename.startswith(root.rstrip(os.sep) + os.sep):
+            filename = filename[len(root.rstrip(os.sep)) + 1:]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Counts the Python stacks of every other thread until stopped."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._labels: Dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def _profile_path(method: str, path: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", path).strip("-") or "root"
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%f")
+    return os.path.join(PROFILE_DIR, f"{stamp}-{method.lower()}-{slug[:60]}.folded")
+
+
+class ProfilingMiddleware:
+    """ASGI middleware, so a streamed response is profiled until its last chunk is sent."""
+
+    def __init__(self, app, token: Optional[str] = PROFILE_TOKEN, sample_rate: float = PROFILE_SAMPLE_RATE):
+        self.app = app
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self._busy = threading.Lock()
+
+    def _requested(self, scope) -> Tuple[bool, bool]:
+        """(profile this request, asked for by header)."""
+        if self.token is not None:
+            for name, value in scope.get("headers", ()):
+                if name == PROFILE_HEADER:
+                    return secrets.compare_digest(value, self.token), True
+        return self.sample_rate > 0 and random.random() < self.sample_rate, False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        wanted, by_header = self._requested(scope)
+        if not wanted or not self._busy.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        target = _profile_path(scope["method"], scope["path"])
+        sampler = StackSampler(PROFILE_INTERVAL_MS / 1000)
+        sampler.start()
+
+        async def send_with_header(message):
+            if by_header and message["type"] == "http.response.start":
+                headers = list(message.get("headers", [])) + [(b"x-profile-file", os.path.basename(target).encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            sampler.stop()
+            self._busy.release()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if by_header or elapsed_ms >= PROFILE_MIN_MS:
+                # formatting and writing a large profile would stall every request on this loop
+                await run_in_threadpool(self._write, target, sampler, elapsed_ms)
+
+    @staticmethod
+    def _write(path: str, sampler: StackSampler, elapsed_ms: float) -> None:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(path, "w") as f:
+                f.write(sampler.folded())
+        except OSError as e:
+            logger.warning("Could not write profile %s: %s", path, e)
+            return
+        logger.info(
+            "Profiled request in %.0f ms: %d samples -> %s",
+            elapsed_ms, sum(sampler.samples.values()), path,
+        )
+
+
+def install_profiling(app) -> bool:
+    """Add the middleware only when profiling is configured; otherwise requests never see it."""
+    if PROFILE_TOKEN is None and PROFILE_SAMPLE_RATE <= 0:
+        return False
+    app.add_middleware(ProfilingMiddleware)
+    logger.info("Request profiling enabled (header=%s, sample_rate=%s)", PROFILE_TOKEN is not None, PROFILE_SAMPLE_RATE)
+    return True
@@ -1,17 +1,22 @@
 from __future__ import annotations
 from fastapi import APIRouter, Depends
-from app.auth_dependency import get_current_user
-from app.models import User
+from app.auth_dependency import Principal, get_current_user
+from app.database import pool_stats
 
 
 
 router = APIRouter(prefix="/protected", tags=["protected routes"])
 
 @router.get("/")
-def protected_route(current_user: User=Depends(get_current_user)):
+def protected_route(current_user: Principal = Depends(get_current_user)):
     name=current_user.username or current_user.email or "user"
     return{"message":f"Hello, {name}!"}
 
+@router.get("/db/pool")
+def db_pool_stats(current_user: Principal = Depends(get_current_user)):
+    """Connection pool size, usage and checkout wait times for this worker's engines."""
+    return pool_stats()
+
 
 
 
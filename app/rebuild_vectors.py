@@ -0,0 +1,400 @@
+"""
+Rebuild users' vector memory from chat_messages, the source of truth. Use it after a
+chunking or embedding model change, or when a store is corrupted:
+
+    python -m app.rebuild_vectors --workers 4 --max-rpm 3000 --max-tpm 1000000
+    python -m app.rebuild_vectors --users 3,7 --restart
+
+Messages are paired into turns the way /chat stores them (a user message and the reply
+that follows it), chunked and embedded in large batches, so the rebuilt chunks have the
+same ids and metadata as live ones. Compaction summaries in the old store are re-embedded
+and kept; the raw turns they replaced come back too and are folded in again on the next
+compaction run.
+
+Per-directory stores (per_user, numpy) are built in a staging directory next to the live
+one and swapped in when complete, so readers never see a half-built store. App workers
+may keep running: the swapped-in directory has a new store generation, so they reopen it
+on their next lookup, and turns chatted while the user was being rebuilt (which the
+ingest queue wrote to the old directory) are replayed from chat_messages after the swap.
+Shared collections are updated in place: new chunks are upserted, then the user's stale
+ids are deleted. A model change with a different vector size therefore needs per-directory
+mode.
+
+Users are spread over a process pool. Progress is checkpointed after each user, and a run
+that was interrupted resumes where it stopped. `--max-rpm`/`--max-tpm` are split evenly
+between the workers.
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import fcntl
+import shutil
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timezone
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from sqlalchemy import select
+from app.context_packing import count_tokens
+from app.database import SessionLocal
+from app.models import ChatMessage, User
+from app.vector_store import (
+    DATA_DIR,
+    VECTOR_STORE_MODE,
+    _get_embeddings,
+    add_embedded,
+    close_vector_store,
+    delete_user_vectors,
+    get_user_vectors,
+    load_vector_store,
+    store_cache,
+    turn_chunks,
+    upsert_embedded,
+    user_store_location,
+)
+
+logger = logging.getLogger(__name__)
+
+REBUILD_DIR = os.getenv("REBUILD_DIR", os.path.join(DATA_DIR, "_rebuild"))
+# chunks per embeddings request; the OpenAI API accepts up to 2048 inputs
+REBUILD_BATCH_SIZE = int(os.getenv("REBUILD_BATCH_SIZE", "512"))
+REBUILD_READ_BATCH = 1000
+
+
+class RateLimiter:
+    """Keeps one process under a requests-per-minute and tokens-per-minute budget."""
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._next_request = 0.0
+        self._tokens_free_at = 0.0
+
+    def acquire(self, tokens: int) -> None:
+        now = time.monotonic()
+        wait_until = now
+        if self.rpm:
+            wait_until = max(wait_until, self._next_request)
+        if self.tpm:
+            wait_until = max(wait_until, self._tokens_free_at)
+        if wait_until > now:
+            time.sleep(wait_until - now)
+        start = max(now, wait_until)
+        if self.rpm:
+            self._next_request = start + 60.0 / self.rpm
+        if self.tpm:
+            self._tokens_free_at = start + 60.0 * tokens / self.tpm
+
+
+def iter_turns(user_id: int) -> Iterator[Tuple[ChatMessage, ChatMessage]]:
+    """(user message, assistant reply) pairs in conversation order, read in batches."""
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(ChatMessage)
+            .where(ChatMessage.user_id == user_id)
+            .order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+            .execution_options(yield_per=REBUILD_READ_BATCH)
+        ).scalars()
+        pending: Optional[ChatMessage] = None
+        for msg in rows:
+            if msg.role == "user":
+                pending = msg
+            elif pending is not None:
+                yield pending, msg
+                pending = None
+
+
+def _existing_summaries(user_id: str, live: Optional[str]) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """Compaction summaries in the current store; unreadable stores just contribute none."""
+    try:
+        if live is None:
+            found = get_user_vectors(user_id, where={"kind": "summary"})
+        else:
+            if not os.path.isdir(live):
+                return []
+            store = load_vector_store(live)
+            try:
+                if hasattr(store, "_collection"):
+                    found = store._collection.get(where={"kind": "summary"}, include=["documents", "metadatas"])
+                else:
+                    found = store.get(where={"kind": "summary"})
+            finally:
+                close_vector_store(store)
+    except Exception as e:
+        logger.warning("Could not read summaries for user %s, rebuilding without them: %s", user_id, e)
+        return []
+    return list(zip(found["ids"], found["documents"], found["metadatas"]))
+
+
+def _swap(live: str, staging: str) -> None:
+    retired = f"{live}.old-{int(time.time())}"
+    if os.path.exists(live):
+        os.rename(live, retired)
+    os.rename(staging, live)
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+def rebuild_user(
+    user_id: int,
+    *,
+    batch_size: int = REBUILD_BATCH_SIZE,
+    requests_per_minute: float = 0,
+    tokens_per_minute: float = 0,
+) -> Dict[str, Any]:
+    """Re-embed one user's history into a fresh store. Returns turn/chunk counts and timing."""
+    started = time.perf_counter()
+    uid = str(user_id)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    embeddings = _get_embeddings()
+
+    shared = VECTOR_STORE_MODE == "shared"
+    live = None if shared else user_store_location(uid).rstrip(os.sep)
+    summaries = _existing_summaries(uid, live)
+    store_cache.invalidate(uid)
+
+    target = None
+    staging = None
+    old_ids = set()
+    if shared:
+        old_ids = set(get_user_vectors(uid)["ids"])
+    else:
+        staging = live + ".rebuild"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        target = load_vector_store(staging)
+
+    result = {
+        "user_id": user_id,
+        "turns": 0,
+        "chunks": 0,
+        "summaries": len(summaries),
+        "requests": 0,
+        "caught_up": 0,  # turns saved while the user was being rebuilt
+    }
+    written = set()
+    seen_turns: Set[int] = set()
+    pending: List[Tuple[str, str, Dict[str, Any]]] = []
+
+    def flush() -> None:
+        if not pending:
+            return
+        texts = [text for _, text, _ in pending]
+        limiter.acquire(sum(count_tokens(text) for text in texts))
+        vectors = embeddings.embed_documents(texts)
+        rows = {
+            "ids": [chunk_id for chunk_id, _, _ in pending],
+            "texts": texts,
+            "vectors": vectors,
+            "metadatas": [metadata for _, _, metadata in pending],
+        }
+        if target is None:
+            add_embedded(uid, **rows)
+        else:
+            upsert_embedded(target, **rows)
+        written.update(rows["ids"])
+        result["requests"] += 1
+        result["chunks"] += len(pending)
+        pending.clear()
+
+    def add_turns() -> int:
+        """Embed every turn not seen yet; returns how many were added."""
+        added = 0
+        for user_msg, bot_msg in iter_turns(user_id):
+            if bot_msg.id in seen_turns:
+                continue
+            seen_turns.add(bot_msg.id)
+            ts = bot_msg.timestamp
+            if ts.tzinfo is None:
+                ts = ts.replace(tzinfo=timezone.utc)  # SQLite hands back naive UTC
+            pending.extend(turn_chunks(uid, user_msg.id, bot_msg.id, user_msg.content, bot_msg.content, ts))
+            added += 1
+            if len(pending) >= batch_size:
+                flush()
+        return added
+
+    try:
+        result["turns"] += add_turns()
+        pending.extend(summaries)
+        flush()
+    except BaseException:
+        if target is not None:
+            close_vector_store(target)
+            shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    if target is not None:
+        target.persist()
+        close_vector_store(target)
+        _swap(live, staging)
+        # turns saved since the read above were embedded into the retired directory
+        target = None
+        store_cache.invalidate(uid)
+        caught_up = add_turns()
+        flush()
+        result["turns"] += caught_up
+        result["caught_up"] = caught_up
+    else:
+        delete_user_vectors(uid, sorted(old_ids - written))
+    store_cache.invalidate(uid)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+# -- run bookkeeping ---------------------------------------------------------
+
+def _state_path() -> str:
+    return os.path.join(REBUILD_DIR, "state.json")
+
+
+def load_state() -> Optional[Dict[str, Any]]:
+    try:
+        with open(_state_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(state: Dict[str, Any]) -> None:
+    tmp = _state_path() + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, _state_path())
+
+
+def _user_ids(only: Optional[List[str]] = None) -> List[int]:
+    with SessionLocal() as db:
+        stmt = select(User.id).order_by(User.id)
+        if only:
+            stmt = stmt.where(User.id.in_([int(u) for u in only]))
+        return list(db.execute(stmt).scalars())
+
+
+def run(
+    *,
+    only: Optional[List[str]] = None,
+    restart: bool = False,
+    workers: int = 1,
+    batch_size: int = REBUILD_BATCH_SIZE,
+    requests_per_minute: float = 0,
+    tokens_per_minute: float = 0,
+) -> Dict[str, Any]:
+    """Rebuild every selected user, checkpointing after each so a killed run can resume."""
+    os.makedirs(REBUILD_DIR, exist_ok=True)
+    lock = open(os.path.join(REBUILD_DIR, "lock"), "a")
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        raise RuntimeError("Another vector rebuild is in progress")
+
+    try:
+        state = None if restart else load_state()
+        if state is None or state.get("finished_at") is not None:
+            state = {
+                "started_at": time.time(),
+                "finished_at": None,
+                "users_done": [],
+                "users_failed": [],
+                "turns": 0,
+                "chunks": 0,
+                "requests": 0,
+            }
+        else:
+            logger.info("Resuming vector rebuild, %d users already done", len(state["users_done"]))
+
+        done = set(state["users_done"])
+        users = [u for u in _user_ids(only) if u not in done]
+        state["users_failed"] = [u for u in state["users_failed"] if u not in users]
+        workers = max(1, min(workers, len(users) or 1))
+        options = {
+            "batch_size": batch_size,
+            "requests_per_minute": requests_per_minute / workers,
+            "tokens_per_minute": tokens_per_minute / workers,
+        }
+
+        started = time.perf_counter()
+        chunks_before = state["chunks"]
+
+        def record(user_id: int, result: Optional[Dict[str, Any]], error: Optional[BaseException]) -> None:
+            if error is not None:
+                logger.error("Rebuild failed for user %s: %s", user_id, error)
+                state["users_failed"].append(user_id)
+            else:
+                for key in ("turns", "chunks", "requests"):
+                    state[key] += result[key]
+                state["users_done"].append(user_id)
+                logger.info(
+                    "User %s: %d turns -> %d chunks (+%d summaries) in %.1fs",
+                    user_id, result["turns"], result["chunks"] - result["summaries"],
+                    result["summaries"], result["seconds"],
+                )
+            save_state(state)
+            finished = len(state["users_done"]) + len(state["users_failed"]) - len(done)
+            if finished % 100 == 0:
+                elapsed = time.perf_counter() - started
+                logger.info(
+                    "Rebuilt %d/%d users in %.0fs (%.0f chunks/s)", finished, len(users), elapsed,
+                    (state["chunks"] - chunks_before) / elapsed if elapsed else 0.0,
+                )
+
+        if workers == 1:
+            for user_id in users:
+                try:
+                    record(user_id, rebuild_user(user_id, **options), None)
+                except Exception as e:
+                    record(user_id, None, e)
+        else:
+            # spawn: each worker gets its own engines, clients and file handles
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                futures = {pool.submit(rebuild_user, user_id, **options): user_id for user_id in users}
+                for future in as_completed(futures):
+                    try:
+                        record(futures[future], future.result(), None)
+                    except Exception as e:
+                        record(futures[future], None, e)
+
+        state["finished_at"] = time.time()
+        save_state(state)
+        elapsed = time.perf_counter() - started
+        logger.info(
+            "Vector rebuild done: %d users, %d turns, %d chunks in %d requests, %.1fs (%.0f chunks/s), %d failed",
+            len(state["users_done"]), state["turns"], state["chunks"], state["requests"], elapsed,
+            (state["chunks"] - chunks_before) / elapsed if elapsed else 0.0, len(state["users_failed"]),
+        )
+        return state
+    finally:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+        lock.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Re-embed users' vector memory from chat history")
+    parser.add_argument("--users", default="", help="Comma separated user ids; default is every user")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes to spread users over")
+    parser.add_argument("--batch-size", type=int, default=REBUILD_BATCH_SIZE, help="Chunks per embeddings request")
+    parser.add_argument("--max-rpm", type=float, default=0, help="Embedding requests per minute, all workers (0 = no limit)")
+    parser.add_argument("--max-tpm", type=float, default=0, help="Embedding tokens per minute, all workers (0 = no limit)")
+    parser.add_argument("--restart", action="store_true", help="Ignore an unfinished previous run")
+    return parser.parse_args()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    state = run(
+        only=[u for u in args.users.split(",") if u] or None,
+        restart=args.restart,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        requests_per_minute=args.max_rpm,
+        tokens_per_minute=args.max_tpm,
+    )
+    if state["users_failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+History retention. Messages are deleted in bounded batches, each in its own short
+transaction, and the vector chunks built from them are removed in the same pass, so
+retrieval stops surfacing deleted conversations and the stores shrink.
+
+`SoulSettings.retention_days` is the per-user policy (RETENTION_DEFAULT_DAYS for users
+who have not set one; 0 keeps everything). The sweep applies it to every user:
+
+    python -m app.retention                  # nightly
+    python -m app.retention --users 3,7 --dry-run
+"""
+from __future__ import annotations
+import os
+import time
+import fcntl
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from app.conversation_stats import delete_messages
+from app.database import AsyncSessionLocal, async_engine
+from app.ingest import ingest_queue
+from app.models import ChatMessage, SoulSettings, User
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+RETENTION_DEFAULT_DAYS = int(os.getenv("RETENTION_DEFAULT_DAYS", "0"))
+# rows per delete transaction; keeps each write lock short on SQLite
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+# pause between batches so live writers get the database in between
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))
+RETENTION_DIR = os.getenv("RETENTION_DIR", os.path.join(DATA_DIR, "_retention"))
+
+
+class _VectorIndex:
+    """The user's chunk ids by source message id and by age, read once per purge."""
+
+    def __init__(self, user_id: str):
+        from app.vector_store import chunk_epoch, get_user_vectors
+
+        self.by_message: Dict[int, Set[str]] = {}
+        self.by_age: List[Tuple[float, str]] = []
+        self.all_ids: Set[str] = set()
+        stored = get_user_vectors(user_id)
+        for doc_id, metadata in zip(stored["ids"], stored["metadatas"]):
+            metadata = metadata or {}
+            self.all_ids.add(doc_id)
+            for key in ("user_message_id", "assistant_message_id"):
+                if metadata.get(key) is not None:
+                    self.by_message.setdefault(int(metadata[key]), set()).add(doc_id)
+            epoch = chunk_epoch(metadata)
+            if epoch is not None:
+                self.by_age.append((epoch, doc_id))
+
+    def for_messages(self, message_ids: List[int]) -> Set[str]:
+        found: Set[str] = set()
+        for message_id in message_ids:
+            found |= self.by_message.get(message_id, set())
+        return found
+
+    def older_than(self, epoch: float) -> Set[str]:
+        return {doc_id for ts, doc_id in self.by_age if ts < epoch}
+
+
+async def _purge_vectors(user_id: str, ids: Set[str]) -> int:
+    if ids:
+        from app.vector_store import delete_user_vectors
+        await run_in_threadpool(delete_user_vectors, user_id, sorted(ids))
+    return len(ids)
+
+
+async def purge_history(
+    db: AsyncSession,
+    user_id: int,
+    before: Optional[datetime] = None,
+    *,
+    batch_size: int = RETENTION_BATCH_SIZE,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """
+    Delete the user's messages older than `before` (all of them if None) and every vector
+    chunk made from them. A turn's chunks go as soon as either of its messages does, and
+    chunks without message ids (summaries, older memories) go by their own age. Vectors
+    are removed ahead of each SQL batch, so an interrupted purge never leaves memories of
+    rows that are already gone. Turns of the purged range still waiting in this worker's
+    ingest queue are dropped first; the queue skips any other turn whose messages are
+    gone by the time it flushes.
+    """
+    started = time.perf_counter()
+    uid = str(user_id)
+    conditions = [ChatMessage.user_id == user_id]
+    if before is not None:
+        if before.tzinfo is None:
+            before = before.replace(tzinfo=timezone.utc)
+        before = before.astimezone(timezone.utc)  # SQLite compares the stored UTC text
+        conditions.append(ChatMessage.timestamp < before)
+
+    if dry_run:
+        rows = (await db.execute(select(func.count()).select_from(ChatMessage).where(*conditions))).scalar_one()
+        return {"rows": rows, "vectors": 0, "batches": 0, "seconds": 0.0}
+
+    discarded = await ingest_queue.discard(uid, before)
+    if discarded:
+        logger.info("Dropped %d queued turns of user %s before embedding", discarded, uid)
+    index = await run_in_threadpool(_VectorIndex, uid)
+    result = {"rows": 0, "vectors": 0, "batches": 0}
+    removed: Set[str] = set()
+    while True:
+        ids = (
+            await db.execute(
+                select(ChatMessage.id)
+                .where(*conditions)
+                .order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+                .limit(batch_size)
+            )
+        ).scalars().all()
+        await db.rollback()  # don't hold a read transaction while the vector store is written
+        if not ids:
+            break
+        chunk_ids = index.for_messages(ids) - removed
+        result["vectors"] += await _purge_vectors(uid, chunk_ids)
+        removed |= chunk_ids
+        result["rows"] += await delete_messages(db, user_id, ChatMessage.id.in_(ids))
+        await db.commit()
+        result["batches"] += 1
+        if len(ids) < batch_size:
+            break
+        if RETENTION_BATCH_PAUSE:
+            await asyncio.sleep(RETENTION_BATCH_PAUSE)
+
+    leftover = index.all_ids if before is None else index.older_than(before.timestamp())
+    result["vectors"] += await _purge_vectors(uid, leftover - removed)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+# -- scheduled sweep -----------------------------------------------------------
+
+async def _policies(db: AsyncSession, only: Optional[List[str]] = None) -> List[Tuple[int, int]]:
+    stmt = (
+        select(User.id, SoulSettings.retention_days)
+        .outerjoin(SoulSettings, SoulSettings.user_id == User.id)
+        .order_by(User.id)
+    )
+    if only:
+        stmt = stmt.where(User.id.in_([int(u) for u in only]))
+    policies = []
+    for user_id, days in await db.execute(stmt):
+        days = RETENTION_DEFAULT_DAYS if days is None else days
+        if days:
+            policies.append((user_id, days))
+    return policies
+
+
+async def sweep(
+    *,
+    only: Optional[List[str]] = None,
+    dry_run: bool = False,
+    now: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """Apply every user's retention policy. Safe to re-run; a finished user has nothing left to do."""
+    now = now or datetime.now(timezone.utc)
+    started = time.perf_counter()
+    summary = {"users": 0, "rows": 0, "vectors": 0, "failed": 0}
+    async with AsyncSessionLocal() as db:
+        policies = await _policies(db, only)
+        await db.rollback()
+        for user_id, days in policies:
+            try:
+                result = await purge_history(db, user_id, now - timedelta(days=days), dry_run=dry_run)
+            except Exception as e:
+                await db.rollback()
+                summary["failed"] += 1
+                logger.error("Retention failed for user %s: %s", user_id, e)
+                continue
+            summary["users"] += 1
+            summary["rows"] += result["rows"]
+            summary["vectors"] += result["vectors"]
+            if result["rows"] or result["vectors"]:
+                logger.info("User %s (%d days): %s", user_id, days, result)
+
+    elapsed = time.perf_counter() - started
+    summary["seconds"] = round(elapsed, 3)
+    logger.info(
+        "Retention %s: %d users, %d rows (%.0f rows/s), %d vectors (%.0f vectors/s) in %.1fs, %d failed",
+        "dry run" if dry_run else "sweep", summary["users"],
+        summary["rows"], summary["rows"] / elapsed if elapsed else 0.0,
+        summary["vectors"], summary["vectors"] / elapsed if elapsed else 0.0,
+        elapsed, summary["failed"],
+    )
+    return summary
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Delete chat history and memories past each user's retention period")
+    parser.add_argument("--users", default="", help="Comma separated user ids; default is every user")
+    parser.add_argument("--dry-run", action="store_true", help="Count what would be deleted")
+    return parser.parse_args()
+
+
+async def _main(args: argparse.Namespace) -> Dict[str, Any]:
+    try:
+        return await sweep(only=[u for u in args.users.split(",") if u] or None, dry_run=args.dry_run)
+    finally:
+        await async_engine.dispose()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    os.makedirs(RETENTION_DIR, exist_ok=True)
+    with open(os.path.join(RETENTION_DIR, "lock"), "a") as lock:
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise SystemExit("Another retention sweep is in progress")
+        summary = asyncio.run(_main(args))
+    if summary["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
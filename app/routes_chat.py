@@ -1,66 +1,150 @@
 from __future__ import annotations
-from datetime import datetime
+import json
+import asyncio
+import logging
+from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app.auth_dependency import get_current_user
-from app.database import get_db
-from app.models import ChatMessage, User
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.auth_dependency import Principal, get_current_user
+from app.database import AsyncSessionLocal, get_async_db
+from app.models import ChatMessage
 from app.schemas import ChatRequest, ChatResponse
-from app.chains import get_response, user_chroma_dir
-from app.vector_store import embed_and_store
+from app.conversation_stats import record_messages
+from app.ingest import ingest_queue
+from app.metrics import time_stage
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["chat"])
 
+
+def _enqueue_turn(user_msg: ChatMessage, bot_msg: ChatMessage) -> None:
+    """Hand the finished turn to the write-behind embedding queue; never blocks the reply."""
+    try:
+        ingest_queue.enqueue(
+            user_id=str(bot_msg.user_id),
+            user_message_id=user_msg.id,
+            assistant_message_id=bot_msg.id,
+            user_text=user_msg.content,
+            answer=bot_msg.content,
+        )
+    except Exception:
+        logger.warning("enqueue failed for user %s", bot_msg.user_id, exc_info=True)
+
+
+async def _save_turn(db: AsyncSession, user_msg: ChatMessage, bot_msg: ChatMessage) -> None:
+    """Write both sides of the turn and their stats in one transaction."""
+    with time_stage("save"):
+        db.add_all([user_msg, bot_msg])
+        await db.flush()
+        await record_messages(db, [user_msg, bot_msg])
+        await db.commit()
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @router.post("", response_model=ChatResponse) 
-def chat_with_soul(
+async def chat_with_soul(
     request: ChatRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
-   
+    # LangChain loads with the first chat turn, so auth/history traffic never pays for it
+    from app.chains import get_response, load_turn_context
+
     user_id_int = current_user.id
     user_id = str(user_id_int)
+    received_at = datetime.now(timezone.utc)
 
-    
-    user_msg = ChatMessage(
-        user_id=user_id_int,
-        role="user",
-        content=request.text,
-    )
-    db.add(user_msg)
-    db.commit()
-    db.refresh(user_msg)
+    context = await load_turn_context(db, user_id_int)
+    # give the connection back to the pool while the model runs
+    await db.close()
 
+    turn_info = {}
     try:
-        answer = get_response(request.text, user_id)
+        answer = await get_response(request.text, user_id, turn_info, context)
     except RuntimeError as e:
        
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to generate a response: {e}"
         )
-    
+
+    user_msg = ChatMessage(
+        user_id=user_id_int,
+        role="user",
+        content=request.text,
+        timestamp=received_at,
+    )
     bot_msg = ChatMessage(
         user_id=user_id_int,
         role="assistant",
         content=answer,
     )
+    await _save_turn(db, user_msg, bot_msg)
 
-    db.add(bot_msg)
-    db.commit()
-    db.refresh(bot_msg)
+    _enqueue_turn(user_msg, bot_msg)
+
+    return ChatResponse(response=answer, user_id=user_id, metadata=turn_info or None)
+
+
+@router.post("/stream")
+async def chat_with_soul_stream(
+    request: ChatRequest,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Same turn as POST /chat, but answer tokens are sent as Server-Sent Events
+    (`token` events, then one `done` event). The turn is saved and embedded once the
+    stream completes; if the client disconnects or generation fails, nothing is saved.
+    """
+    from app.chains import FALLBACK_ANSWER, load_turn_context, stream_response
+
+    user_id_int = current_user.id
+    user_id = str(user_id_int)
+    received_at = datetime.now(timezone.utc)
+
+    context = await load_turn_context(db, user_id_int)
+    await db.close()
+
+    async def event_stream():
+        parts = []
+        turn_info = {}
+        try:
+            async for token in stream_response(request.text, user_id, turn_info, context):
+                parts.append(token)
+                yield _sse("token", {"token": token})
+        except asyncio.CancelledError:
+            logger.info("Client disconnected, cancelled stream for user_id=%s", user_id)
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming response for user_id={user_id}: {e}")
+            yield _sse("error", {"detail": FALLBACK_ANSWER})
+            return
+
+        answer = "".join(parts) or "I couldn't generate a response."
+
+        # the request-scoped session is already closed once streaming starts
+        user_msg = ChatMessage(user_id=user_id_int, role="user", content=request.text, timestamp=received_at)
+        bot_msg = ChatMessage(user_id=user_id_int, role="assistant", content=answer)
+        async with AsyncSessionLocal() as stream_db:
+            await _save_turn(stream_db, user_msg, bot_msg)
+
+        _enqueue_turn(user_msg, bot_msg)
+
+        yield _sse("done", {"response": answer, "user_id": user_id, "metadata": turn_info})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    try:
-        persist_dir = user_chroma_dir(user_id)
-        
-        ts = datetime.utcnow().isoformat() + "Z"
-        embed_and_store(
-            text=f"[USER @ {ts}]\n{request.text}\n\n[ASSISTANT @ {ts}]\n{answer}",
-            persist_dir=persist_dir,
-            user_id=user_id,
-        )
-    except Exception as e:
-        
-        print(f"[warn] embedding failed for user {user_id}: {e}")
 
-    return ChatResponse(response=answer, user_id=user_id)
+@router.get("/ingest/stats")
+async def ingest_stats(current_user: Principal = Depends(get_current_user)):
+    """Depth, lag and throughput of the background embedding queue in this worker."""
+    return ingest_queue.stats()
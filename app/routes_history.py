@@ -1,125 +1,338 @@
 from __future__ import annotations
-from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session
-from app.database import get_db
-from typing import List, Literal, Optional
-from app.models import ChatMessage, User
-from app.schemas import HistoryItem, HistoryAppend, HistoryList
-from app.auth_dependency import get_current_user
+import os
+import json
+import time
+import base64
+import logging
+import binascii
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import and_, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal, get_async_db
+from typing import AsyncIterator, List, Literal, Optional
+from app.models import ChatMessage
+from app.schemas import (
+    ConversationStatsOut,
+    HistoryAppend,
+    HistoryImportItem,
+    HistoryImportResult,
+    HistoryItem,
+    HistoryList,
+)
+from app.conversation_stats import get_stats, record_messages
+from app.auth_dependency import Principal, get_current_user
+from app.ingest import ingest_queue
+from app.retention import purge_history
+
+logger = logging.getLogger(__name__)
+
+# rows fetched per round trip from the export cursor / inserted per import transaction
+HISTORY_EXPORT_BATCH_SIZE = int(os.getenv("HISTORY_EXPORT_BATCH_SIZE", "1000"))
+HISTORY_IMPORT_BATCH_SIZE = int(os.getenv("HISTORY_IMPORT_BATCH_SIZE", "1000"))
 
 router = APIRouter(prefix="/history", tags=["History"])
 
+def encode_cursor(msg: ChatMessage) -> str:
+    payload = json.dumps([msg.timestamp.isoformat(), msg.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, msg_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(ts), int(msg_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get("/", response_model=HistoryList)
-def get_history(
+async def get_history(
     limit: int = Query(10, ge=1, le=1000,description="Max items to return"),
-    offset: int = Query(0, ge=0, description="Items to skip"),
+    offset: int = Query(0, ge=0, description="Items to skip (deprecated, use cursors)"),
+    after: Optional[str] = Query(None, description="Cursor: return items after this one (next_cursor)"),
+    before: Optional[str] = Query(None, description="Cursor: return items before this one (prev_cursor)"),
     role: Optional[Literal["user","bot"]] = Query(
         None, description= "filter by role"
     ),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
 
 ):
+    """
+    Oldest-first history. Page with the opaque `next_cursor` / `prev_cursor` values; each
+    page is an index range scan on (user_id, timestamp, id) however deep it is.
+    """
+    if after and before:
+        raise HTTPException(status_code=400, detail="Use either 'after' or 'before', not both")
+
     q = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.user_id == current_user.id)
+        select(ChatMessage)
+        .where(ChatMessage.user_id == current_user.id)
     )
     if role:
-        q = q.filter(ChatMessage.role == role)
-    
+        q = q.where(ChatMessage.role == role)
+
+    if before:
+        ts, msg_id = decode_cursor(before)
+        q = q.where(or_(
+            ChatMessage.timestamp < ts,
+            and_(ChatMessage.timestamp == ts, ChatMessage.id < msg_id),
+        )).order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+        rows: List[ChatMessage] = (await db.execute(q.limit(limit + 1))).scalars().all()
+        has_more = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        items = [HistoryItem.model_validate(row) for row in rows]
+        return HistoryList(
+            user_id=current_user.id,
+            items=items,
+            next_cursor=encode_cursor(rows[-1]) if rows else before,
+            prev_cursor=encode_cursor(rows[0]) if rows and has_more else None,
+        )
+
+    if after:
+        ts, msg_id = decode_cursor(after)
+        q = q.where(or_(
+            ChatMessage.timestamp > ts,
+            and_(ChatMessage.timestamp == ts, ChatMessage.id > msg_id),
+        ))
     q = q.order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
-    rows:List[ChatMessage] = q.offset(offset).limit(limit).all()
+    if not after and offset:
+        q = q.offset(offset)
+    rows = (await db.execute(q.limit(limit + 1))).scalars().all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     items = [HistoryItem.model_validate(row) for row in rows]
-    next_offset = offset + len(items) if len(items) == limit else None
-    return HistoryList(user_id=current_user.id, items=items, total=next_offset)
+    next_offset = offset + len(items) if has_more and not after else None
+    return HistoryList(
+        user_id=current_user.id,
+        items=items,
+        total=next_offset,
+        next_cursor=encode_cursor(rows[-1]) if rows and has_more else None,
+        prev_cursor=encode_cursor(rows[0]) if rows and (after or offset) else None,
+    )
+
+
+@router.get("/export")
+async def export_history(
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    The whole history as NDJSON, oldest first, one `{"id","role","content","timestamp"}`
+    object per line. Rows come from a server-side cursor in batches, so memory use does
+    not grow with the history. The output can be fed straight back to /history/import.
+    """
+    user_id = current_user.id
+
+    async def lines() -> AsyncIterator[bytes]:
+        started = time.perf_counter()
+        exported = 0
+        # the request-scoped session is closed before the body is sent
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(
+                select(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.timestamp)
+                .where(ChatMessage.user_id == user_id)
+                .order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+                .execution_options(yield_per=HISTORY_EXPORT_BATCH_SIZE)
+            )
+            async for batch in result.partitions():
+                chunk = "".join(
+                    json.dumps({
+                        "id": msg_id,
+                        "role": role,
+                        "content": content,
+                        "timestamp": ts.isoformat() if ts else None,
+                    }) + "\n"
+                    for msg_id, role, content, ts in batch
+                )
+                exported += len(batch)
+                yield chunk.encode("utf-8")
+        seconds = time.perf_counter() - started
+        logger.info(
+            "Exported %d messages for user_id=%s in %.2fs (%.0f rows/s)",
+            exported, user_id, seconds, exported / seconds if seconds else 0.0,
+        )
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="history-{user_id}.ndjson"'},
+    )
+
+
+@router.post("/import", response_model=HistoryImportResult)
+async def import_history(
+    request: Request,
+    embed: bool = Query(False, description="Also add imported user/assistant turns to memory"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    Append an NDJSON stream of `{"role","content","timestamp"?}` lines (the export format)
+    to the current user's history. The body is parsed as it arrives and written in batches
+    of HISTORY_IMPORT_BATCH_SIZE, one transaction each. A bad line stops the import with a
+    400 naming the line; every row before it is kept and counted in the error. With `embed`,
+    each user message followed by an assistant message is queued for embedding like a
+    chat turn.
+    """
+    user_id = current_user.id
+    started = time.perf_counter()
+    imported = 0
+    embedded = 0
+    line_no = 0
+    batch: List[ChatMessage] = []
+    pending_user: Optional[ChatMessage] = None
+
+    async def flush() -> None:
+        nonlocal imported, embedded, pending_user
+        if not batch:
+            return
+        rows = [
+            {"user_id": m.user_id, "role": m.role, "content": m.content, "timestamp": m.timestamp}
+            for m in batch
+        ]
+        if embed:
+            # vector ids are derived from message ids, so fetch them back in input order
+            ids = (
+                await db.execute(insert(ChatMessage).returning(ChatMessage.id, sort_by_parameter_order=True), rows)
+            ).scalars().all()
+            for msg, msg_id in zip(batch, ids):
+                msg.id = msg_id
+        else:
+            await db.execute(insert(ChatMessage), rows)
+        await record_messages(db, batch)
+        await db.commit()
+        imported += len(batch)
+
+        if embed:
+            for msg in batch:
+                if msg.role == "user":
+                    pending_user = msg
+                    continue
+                if pending_user is not None:
+                    try:
+                        ingest_queue.enqueue(
+                            user_id=str(user_id),
+                            user_message_id=pending_user.id,
+                            assistant_message_id=msg.id,
+                            user_text=pending_user.content,
+                            answer=msg.content,
+                            ts=msg.timestamp,
+                        )
+                        embedded += 1
+                    except RuntimeError as e:
+                        logger.warning("Not embedding imported turns for user_id=%s: %s", user_id, e)
+                pending_user = None
+        batch.clear()
+
+    def failed(detail: str) -> HTTPException:
+        return HTTPException(
+            status_code=400,
+            detail={"line": line_no, "error": detail, "imported": imported},
+        )
+
+    async def add_line(raw: bytes) -> None:
+        nonlocal line_no
+        line_no += 1
+        if not raw.strip():
+            return
+        try:
+            item = HistoryImportItem.model_validate_json(raw)
+        except ValidationError as e:
+            await flush()
+            raise failed(str(e.errors()[0]["msg"]))
+        ts = item.timestamp or datetime.now(timezone.utc)
+        # stored as UTC: SQLite drops the offset, and keyset paging compares raw values
+        ts = ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+        batch.append(ChatMessage(user_id=user_id, role=item.role, content=item.content, timestamp=ts))
+        if len(batch) >= HISTORY_IMPORT_BATCH_SIZE:
+            await flush()
+
+    buffer = b""
+    async for chunk in request.stream():
+        *complete, buffer = (buffer + chunk).split(b"\n")
+        for raw in complete:
+            await add_line(raw)
+    await add_line(buffer)
+    await flush()
+
+    seconds = time.perf_counter() - started
+    rate = imported / seconds if seconds else 0.0
+    logger.info("Imported %d messages for user_id=%s in %.2fs (%.0f rows/s)", imported, user_id, seconds, rate)
+    return HistoryImportResult(
+        user_id=user_id,
+        imported=imported,
+        embedded_turns=embedded,
+        seconds=round(seconds, 3),
+        rows_per_second=round(rate, 1),
+    )
 
 
 @router.get("/count")
-def count_history(
+async def count_history(
 role: Optional[Literal["user","assistant"]] = Query(
     None, description="Count the role only if provided"
 ),
-db: Session=Depends(get_db),
-current_user: User = Depends(get_current_user),
+db: AsyncSession=Depends(get_async_db),
+current_user: Principal = Depends(get_current_user),
 ):
-   q=db.query(ChatMessage).filter(ChatMessage.user_id == current_user.id)
+   stats = await get_stats(db, current_user.id)
+   if stats is None:
+       return {"total": 0}
    if role:
-       q=q.filter(ChatMessage.role == role)
-       return{"total":q.count()}
-   
+       return {"total": getattr(stats, f"{role}_messages")}
+   return {"total": stats.total_messages}
+
+
+@router.get("/stats", response_model=ConversationStatsOut)
+async def history_stats(
+    db: AsyncSession=Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Message counts by role, first/last message time and stored content size."""
+    stats = await get_stats(db, current_user.id)
+    if stats is None:
+        return ConversationStatsOut(user_id=current_user.id)
+    return stats
+
 @ router.post("/",response_model=HistoryItem,status_code=status.HTTP_201_CREATED)
-def append_history(
+async def append_history(
     body: HistoryAppend,
-    db: Session=Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession=Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     if body.role not in ("user","assistant"):
         raise HTTPException(status_code=422,detail="role must be 'user' or 'assistant'")
     msg = ChatMessage(user_id=current_user.id, role=body.role, content=body.content)
     db.add(msg)
-    db.commit()
-    db.refresh(msg)
+    await db.flush()
+    await record_messages(db, [msg])
+    await db.commit()
+    await db.refresh(msg)
     return msg
 
 @router.delete("/", status_code=status.HTTP_204_NO_CONTENT)
-def delete_history(
-    db:Session=Depends(get_db),
-    current_user: User=Depends(get_current_user),
+async def delete_history(
+    db:AsyncSession=Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    #Delete all messages for all users
-    db.query(ChatMessage).filter(
-        ChatMessage.user_id == current_user.id
-    ).delete(synchronize_session=False)
-    db.commit()
+    """Delete all of the current user's messages and the memories built from them."""
+    await purge_history(db, current_user.id)
 
 @router.delete("/before", status_code=status.HTTP_204_NO_CONTENT)
-def delete_history_before(
+async def delete_history_before(
     before:datetime=Query(...,Description="Delete this history before this UTC timestamp"),
-    db:Session=Depends(get_db),
-    current_user: User=Depends(get_current_user),
+    db:AsyncSession=Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
 ):
 
     """
-    Delete all messages for the current user created before the given timestamp.
-    Use ISO 8601, e.g. ?before=2025-08-20T00:00:00Z
+    Delete all messages for the current user created before the given timestamp, and
+    the memories built from them. Use ISO 8601, e.g. ?before=2025-08-20T00:00:00Z
 
     """
 
-    db.query(ChatMessage).filter(
-        ChatMessage.user_id == current_user.id,
-        ChatMessage.created_at < before,
-    ).delete(synchronize_session=False)
-    db.commit()
-
-    
-    
-
-
-   
-
-
-
-
-
-
-
-       
-       
-
-
-
-
-
-
-
-
-
-    
-    
-
-
-
-
-
-
+    await purge_history(db, current_user.id, before)
@@ -0,0 +1,58 @@
+from __future__ import annotations
+import os
+import sys
+import secrets
+from typing import List, Optional
+from fastapi import APIRouter, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from app.auth_dependency import principal_cache
+from app.database import pool_stats
+from app.ingest import ingest_queue
+from app.metrics import render, render_snapshot
+from app.password_pool import password_pool
+from app.personality import personality_cache
+
+# Scrapers send it as a bearer token; unset leaves /metrics open (keep it off the public ingress then)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") or None
+
+router = APIRouter(tags=["metrics"])
+
+
+def _loaded(module: str, attr: str):
+    """`module.attr` if that module has been imported (and finished importing), else None."""
+    return getattr(sys.modules.get(module), attr, None)
+
+
+def _snapshots() -> List[str]:
+    """
+    The existing per-worker stats, read at scrape time. The chat stack is only reported
+    once a chat turn has loaded it; a scrape must not import LangChain.
+    """
+    lines: List[str] = []
+    for engine, stats in pool_stats().items():
+        lines += render_snapshot("soul_db_pool", stats, {"engine": engine})
+    path_stats = _loaded("app.chains", "retrieval_path_stats")
+    if path_stats is not None:
+        for path, stats in path_stats().items():
+            lines += render_snapshot("soul_retrieval_path", stats, {"path": path})
+    store_cache = _loaded("app.vector_store", "store_cache")
+    if store_cache is not None:
+        lines += render_snapshot("soul_store_cache", store_cache.stats())
+    embedding_stats = _loaded("app.embedding_cache", "embedding_cache_stats")
+    if embedding_stats is not None:
+        lines += render_snapshot("soul_embedding_cache", embedding_stats())
+    lines += render_snapshot("soul_ingest", ingest_queue.stats())
+    lines += render_snapshot("soul_principal_cache", principal_cache.stats())
+    lines += render_snapshot("soul_password_pool", password_pool.stats())
+    lines += render_snapshot("soul_personality_cache", personality_cache.stats())
+    return lines
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus text exposition of this worker's pipeline metrics and cache/pool stats."""
+    if METRICS_TOKEN is not None:
+        scheme, _, token = (authorization or "").partition(" ")
+        if scheme.lower() != "bearer" or not secrets.compare_digest(token, METRICS_TOKEN):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return PlainTextResponse(render(_snapshots()), media_type="text/plain; version=0.0.4")
@@ -1,20 +1,23 @@
 from __future__ import annotations
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from app.database import get_db
-from app.models import User, SoulSettings
-from app.auth_dependency import get_current_user
+from app.models import SoulSettings
+from app.auth_dependency import Principal, get_current_user
+from app.personality import DEFAULT_SOUL_SETTINGS, personality_cache
 from app.schemas import SoulSettingsUpdate, SoulSettingsResponse
 
 router = APIRouter(prefix="/soul", tags=["Soul Settings"])
 
-def get_soul_settings(db: Session, user: User) -> SoulSettings:
+def get_soul_settings(db: Session, user: Principal) -> SoulSettings:
     "Get or create the soul settings for the user"
     settings = db.query(SoulSettings).filter(SoulSettings.user_id == user.id).first()
     if settings:
         return settings
 
-    settings = SoulSettings(user_id=user.id)
+    # registration creates the row; this only covers accounts made before it did
+    settings = SoulSettings(user_id=user.id, **DEFAULT_SOUL_SETTINGS)
     db.add(settings)
     db.commit()
     db.refresh(settings)
@@ -23,7 +26,7 @@ def get_soul_settings(db: Session, user: User) -> SoulSettings:
 @router.get("/settings", response_model=SoulSettingsResponse)
 def read_soul_settings(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     settings: SoulSettings = get_soul_settings(db, current_user)
     return settings
@@ -32,7 +35,7 @@ def read_soul_settings(
 def update_soul_settings(
     settings_update: SoulSettingsUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     settings = get_soul_settings(db, current_user)
 
@@ -48,9 +51,20 @@ def update_soul_settings(
         settings.boundaries = settings_update.boundaries
     if settings_update.creativity_level is not None:
         settings.creativity_level = settings_update.creativity_level
+    if settings_update.retention_days is not None:
+        settings.retention_days = settings_update.retention_days or None
 
     db.add(settings)
-    db.commit()
+    try:
+        # the UPDATE bumps settings.version, so every worker re-renders the personality
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Settings were changed by another request, reload and try again",
+        )
+    personality_cache.invalidate(current_user.id)
     db.refresh(settings)
     return settings
 
@@ -51,12 +51,36 @@ class HistoryItem(BaseModel):
 class HistoryList(BaseModel):
     user_id: Optional[int] = None
     items: List[HistoryItem]
-    total: Optional[int] = None
+    total: Optional[int] = None  # next offset, kept for offset-paging clients
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+class ConversationStatsOut(BaseModel):
+    user_id: int
+    total_messages: int = 0
+    user_messages: int = 0
+    assistant_messages: int = 0
+    content_bytes: int = 0
+    first_message_at: Optional[datetime] = None
+    last_message_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
 
 class HistoryAppend(BaseModel):
     role: Literal["user", "assistant"]
     content: str
 
+class HistoryImportItem(HistoryAppend):
+    "One NDJSON line of /history/import; the export format, `id` is ignored"
+    timestamp: Optional[datetime] = None
+
+class HistoryImportResult(BaseModel):
+    user_id: int
+    imported: int
+    embedded_turns: int = 0
+    seconds: float
+    rows_per_second: float
+
 class SoulSettingsRequest(BaseModel):
     tone: Literal["formal", "casual", "funny", "direct", "gentle"] = "gentle"
     empathy_level: int = Field(5, ge=1, le=10)
@@ -64,6 +88,8 @@ class SoulSettingsRequest(BaseModel):
     creativity_level: int = Field(5, ge=1, le=10)
     memory_aggressiveness: int = Field(5, ge=1, le=10)
     boundaries: str = "Respectful and supportive"
+    # 0 turns retention off again
+    retention_days: Optional[int] = Field(None, ge=0, le=36500)
 
 class SoulSettingsUpdate(SoulSettingsRequest):
     "Used for creating and updating soul settings"
@@ -72,6 +98,7 @@ class SoulSettingsUpdate(SoulSettingsRequest):
 class SoulSettingsResponse(SoulSettingsRequest):
     id: int
     user_id: int
+    version: int
     
     model_config = ConfigDict(from_attributes=True)
 
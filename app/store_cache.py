@@ -0,0 +1,318 @@
+from __future__ import annotations
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STORE_CACHE_MAX_ENTRIES = int(os.getenv("STORE_CACHE_MAX_ENTRIES", "256"))
+STORE_CACHE_IDLE_SECONDS = float(os.getenv("STORE_CACHE_IDLE_SECONDS", "900"))
+STORE_CACHE_MAX_BYTES = int(os.getenv("STORE_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# replaced by offline jobs that change a store behind the workers' backs
+GENERATION_FILE = ".generation"
+
+
+def _dir_size(path: str) -> int:
+    """On-disk size of a persist directory, used as a proxy for the memory an open store holds."""
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def store_generation(persist_dir: str) -> Optional[Tuple[int, int]]:
+    """
+    Identity of the files at `persist_dir`: the inodes of the directory and of its
+    generation file. It changes when the directory is swapped for a new one or
+    `bump_generation` is called, in any process. None for locations that are not
+    directories (shared collections).
+    """
+    try:
+        directory = os.stat(persist_dir).st_ino
+    except OSError:
+        return None
+    try:
+        stamp = os.stat(os.path.join(persist_dir, GENERATION_FILE)).st_ino
+    except OSError:
+        stamp = 0
+    return directory, stamp
+
+
+def bump_generation(persist_dir: str) -> None:
+    """Make every worker reopen the store at `persist_dir` on its next lookup."""
+    path = os.path.join(persist_dir, GENERATION_FILE)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(str(time.time()))
+    os.replace(tmp, path)  # a new inode, even within one mtime tick
+
+
+class _Entry:
+    __slots__ = (
+        "persist_dir", "generation", "store", "chain", "size_bytes", "last_used",
+        "in_use", "evicted", "released",
+    )
+
+    def __init__(self, persist_dir: str, store: Any, size_bytes: int, generation: Optional[Tuple[int, int]] = None):
+        self.persist_dir = persist_dir
+        self.generation = generation
+        self.store = store
+        self.chain: Any = None
+        self.size_bytes = size_bytes
+        self.last_used = time.monotonic()
+        # requests between checkout() and checkin(); the store is only released at zero
+        self.in_use = 0
+        self.evicted = False
+        self.released = False
+
+
+class UserStoreCache:
+    """
+    Bounded LRU of opened per-user vector stores and the retrieval chains built on them.
+    Entries are evicted when idle for longer than `idle_seconds`, or oldest-first once
+    `max_entries` open handles or `max_bytes` of estimated store size is exceeded.
+    Entries checked out by a request are never evicted for age or budget; one dropped by
+    `invalidate`/`clear` while checked out is released by its last `checkin`. An entry
+    whose `store_generation` changed since it was opened (another process rebuilt or
+    compacted the store) is dropped and reopened on lookup.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int = STORE_CACHE_MAX_ENTRIES,
+        idle_seconds: float = STORE_CACHE_IDLE_SECONDS,
+        max_bytes: int = STORE_CACHE_MAX_BYTES,
+        on_evict: Optional[Callable[[Any], None]] = None,
+    ):
+        self.max_entries = max_entries
+        self.idle_seconds = idle_seconds
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._user_locks: Dict[str, threading.Lock] = {}
+        self._bytes = 0
+        self._counters = {
+            "store_hits": 0,
+            "store_misses": 0,
+            "chain_hits": 0,
+            "chain_misses": 0,
+            "evictions_idle": 0,
+            "evictions_budget": 0,
+            "invalidations": 0,
+            "deferred_releases": 0,
+            "stale_reopens": 0,
+        }
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        with self._lock:
+            lock = self._user_locks.get(user_id)
+            if lock is None:
+                lock = self._user_locks[user_id] = threading.Lock()
+            return lock
+
+    def _touch(self, user_id: str, persist_dir: str, generation, stale: List[_Entry]) -> Optional[_Entry]:
+        # caller holds self._lock
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if entry.persist_dir != persist_dir or entry.generation != generation:
+            stale.append(self._drop(user_id))
+            self._counters["stale_reopens"] += 1
+            return None
+        entry.last_used = time.monotonic()
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def _drop(self, user_id: str) -> Optional[_Entry]:
+        # caller holds self._lock
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry.size_bytes
+            entry.evicted = True
+            lock = self._user_locks.get(user_id)
+            # a held lock still guards a writer; the next caller must queue on the same one
+            if lock is not None and not lock.locked():
+                del self._user_locks[user_id]
+        return entry
+
+    def _collect(self) -> list:
+        """Pop idle and over-budget entries; return them so they are released outside the lock."""
+        evicted = []
+        now = time.monotonic()
+        for user_id, entry in list(self._entries.items()):
+            if now - entry.last_used < self.idle_seconds:
+                break
+            if entry.in_use:
+                continue
+            evicted.append(self._drop(user_id))
+            self._counters["evictions_idle"] += 1
+        # never the newest entry: it is the one being handed out, and alone it may exceed max_bytes
+        for user_id, entry in list(self._entries.items())[:-1]:
+            if len(self._entries) <= self.max_entries and self._bytes <= self.max_bytes:
+                break
+            if entry.in_use:
+                continue
+            evicted.append(self._drop(user_id))
+            self._counters["evictions_budget"] += 1
+        return evicted
+
+    def _release(self, evicted: list) -> None:
+        if not self.on_evict:
+            return
+        with self._lock:
+            ready = []
+            for entry in evicted:
+                if entry.in_use:
+                    # still checked out; the last checkin() comes back here
+                    self._counters["deferred_releases"] += 1
+                elif not entry.released:
+                    entry.released = True
+                    ready.append(entry)
+        for entry in ready:
+            try:
+                self.on_evict(entry.store)
+            except Exception as e:
+                logger.warning("Failed to release evicted vector store %s: %s", entry.persist_dir, e)
+
+    def _get_entry(self, user_id: str, persist_dir: str, opener: Callable[[], Any], pin: bool = False) -> _Entry:
+        generation = store_generation(persist_dir)
+        stale: List[_Entry] = []
+        with self._lock:
+            entry = self._touch(user_id, persist_dir, generation, stale)
+            if entry is not None:
+                self._counters["store_hits"] += 1
+                entry.in_use += pin
+                return entry
+        self._release(stale)
+        stale = []
+
+        with self._user_lock(user_id):
+            with self._lock:
+                entry = self._touch(user_id, persist_dir, generation, stale)
+                if entry is not None:
+                    self._counters["store_hits"] += 1
+                    entry.in_use += pin
+                    return entry
+                self._counters["store_misses"] += 1
+            self._release(stale)
+
+            store = opener()
+            entry = _Entry(persist_dir, store, _dir_size(persist_dir), generation)
+
+            with self._lock:
+                entry.in_use += pin
+                self._entries[user_id] = entry
+                self._bytes += entry.size_bytes
+                evicted = self._collect()
+        self._release(evicted)
+        return entry
+
+    def _build_chain(self, user_id: str, entry: _Entry, builder: Callable[[Any], Any]) -> Any:
+        chain = entry.chain
+        if chain is not None:
+            with self._lock:
+                self._counters["chain_hits"] += 1
+            return chain
+
+        with self._user_lock(user_id):
+            if entry.chain is None:
+                entry.chain = builder(entry.store)
+                with self._lock:
+                    self._counters["chain_misses"] += 1
+            else:
+                with self._lock:
+                    self._counters["chain_hits"] += 1
+            return entry.chain
+
+    def get_store(self, user_id: str, persist_dir: str, opener: Callable[[], Any]) -> Any:
+        """Return the cached store for the user, opening it with `opener()` on a miss."""
+        return self._get_entry(user_id, persist_dir, opener).store
+
+    def get_chain(
+        self,
+        user_id: str,
+        persist_dir: str,
+        opener: Callable[[], Any],
+        builder: Callable[[Any], Any],
+    ) -> Any:
+        """Return the cached chain for the user, building it with `builder(store)` on a miss."""
+        return self._build_chain(user_id, self._get_entry(user_id, persist_dir, opener), builder)
+
+    def checkout(
+        self,
+        user_id: str,
+        persist_dir: str,
+        opener: Callable[[], Any],
+        builder: Optional[Callable[[Any], Any]] = None,
+    ) -> _Entry:
+        """
+        Pin the user's entry (opening the store, and building the chain if `builder` is
+        given) for the length of a request. Every checkout must be paired with `checkin`.
+        """
+        entry = self._get_entry(user_id, persist_dir, opener, pin=True)
+        if builder is not None:
+            try:
+                self._build_chain(user_id, entry, builder)
+            except BaseException:
+                self.checkin(entry)
+                raise
+        return entry
+
+    def checkin(self, entry: _Entry) -> None:
+        with self._lock:
+            entry.in_use -= 1
+            release = entry.evicted and entry.in_use == 0
+        if release:
+            self._release([entry])
+
+    @contextmanager
+    def lease(self, user_id: str, persist_dir: str, opener: Callable[[], Any]) -> Iterator[Any]:
+        """`with cache.lease(...) as store:` the store cannot be released inside the block."""
+        entry = self.checkout(user_id, persist_dir, opener)
+        try:
+            yield entry.store
+        finally:
+            self.checkin(entry)
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            entry = self._drop(user_id)
+            if entry is not None:
+                self._counters["invalidations"] += 1
+        if entry is not None:
+            self._release([entry])
+
+    def clear(self) -> None:
+        with self._lock:
+            evicted = [self._drop(user_id) for user_id in list(self._entries)]
+        self._release(evicted)
+
+    def sweep(self) -> int:
+        """Evict idle entries without waiting for the next lookup. Returns how many were evicted."""
+        with self._lock:
+            evicted = self._collect()
+        self._release(evicted)
+        return len(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["store_hits"] + self._counters["store_misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hit_rate": (self._counters["store_hits"] / lookups) if lookups else 0.0,
+            }
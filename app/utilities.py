@@ -1,22 +1,43 @@
 from __future__ import annotations
 import os 
-from typing import Optional,Dict,Any
-from passlib.context import CryptContext
+import threading
+from typing import Optional,Dict,Any,Tuple
 from datetime import datetime, timedelta, timezone
 from jose import jwt,JWTError
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor; hashes made with another cost are upgraded on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+_pwd_context = None
+_pwd_context_lock = threading.Lock()
+
+def _get_pwd_context():
+    """
+    The bcrypt CryptContext, built on first use. Hashing runs in the password pool's
+    processes, so web workers (which only sign and check JWTs) never import passlib.
+    """
+    global _pwd_context
+    if _pwd_context is None:
+        with _pwd_context_lock:
+            if _pwd_context is None:
+                from passlib.context import CryptContext
+
+                _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+    return _pwd_context
 
 def hash_password(password: str) -> str:
     password = password.encode("utf-8")[:72].decode("utf-8", errors = "ignore")
-    return pwd_context.hash(password)
+    return _get_pwd_context().hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return _get_pwd_context().verify(plain_password, hashed_password)
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """(valid, replacement hash or None); a replacement is returned when the cost factor changed."""
+    return _get_pwd_context().verify_and_update(plain_password, hashed_password)
 
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -1,36 +1,181 @@
 from __future__ import annotations
 import os
-from typing import Optional, Iterable
-from datetime import date
+import zlib
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Iterable
+from datetime import date, datetime, timezone
 from dotenv import load_dotenv
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
+from app.clients import EMBEDDING_MODEL, get_embeddings
+from app.embedding_cache import EMBED_CACHE_ENABLED, get_cached_embeddings
 from langchain_community.vectorstores import Chroma
 from langchain.schema.document import Document
+from langchain_core.vectorstores import VectorStore, VectorStoreRetriever
+from app.store_cache import UserStoreCache, bump_generation
+from app.numpy_store import NumpyVectorStore
 
 
 load_dotenv()
 
 def _get_embeddings() -> OpenAIEmbeddings:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OpenAI API key not found")
-    return OpenAIEmbeddings(api_key=api_key)
+    """Shared, connection-pooled embeddings client for this worker, behind the embedding cache."""
+    if EMBED_CACHE_ENABLED:
+        return get_cached_embeddings(get_embeddings, EMBEDDING_MODEL)
+    return get_embeddings()
 
 DATA_DIR = os.getenv("DATA_DIR", "data")
 
+# per_user: one Chroma directory per account under DATA_DIR/<user_id>/chroma_db
+# shared:   every account in one of SHARED_COLLECTIONS collections, scoped by user_id metadata
+# numpy:    one memory-mapped float32 matrix per account under DATA_DIR/<user_id>/vectors
+VECTOR_STORE_MODE = os.getenv("VECTOR_STORE_MODE", "per_user").lower()
+SHARED_COLLECTIONS = int(os.getenv("SHARED_COLLECTIONS", "8"))
+SHARED_STORE_DIR = os.getenv("SHARED_STORE_DIR", os.path.join(DATA_DIR, "_shared", "chroma_db"))
+_SHARED_PREFIX = "shared:"
+
 def user_chroma_dir(user_id: str) -> str:
     """Return per-user Chroma persist directory and make sure it exists."""
     path = os.path.join(DATA_DIR, user_id, "chroma_db")
     os.makedirs(path, exist_ok=True)
     return path
 
-def load_vector_store(persist_dir:str)->Optional[Chroma]:
-    """Load a Chroma vector store from disk, or return None if missing."""
+def user_numpy_dir(user_id: str) -> str:
+    """Return per-user NumPy store directory and make sure it exists."""
+    path = os.path.join(DATA_DIR, user_id, "vectors")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def load_vector_store(persist_dir:str)->Optional[VectorStore]:
+    """Load the configured per-user vector store from disk, or return None if missing."""
     if not os.path.exists(persist_dir):
         return None
+    if VECTOR_STORE_MODE == "numpy":
+        return NumpyVectorStore(persist_dir, _get_embeddings())
+    from chromadb.api.client import SharedSystemClient
+
+    # chromadb reuses one system per path; a handle that is still in use elsewhere (or
+    # predates a rebuild) must not be shared with, or stopped under, the new one
+    SharedSystemClient._identifer_to_system.pop(persist_dir, None)
     return Chroma(persist_directory=persist_dir, embedding_function=_get_embeddings())
 
+def release_client(client) -> None:
+    """Stop a chromadb client's own system so its SQLite/HNSW handles are freed."""
+    from chromadb.api.client import SharedSystemClient
+
+    identifier = getattr(client, "_identifier", None)
+    if identifier is None:
+        return
+    registered = SharedSystemClient._identifer_to_system.get(identifier)
+    system = getattr(getattr(client, "_server", None), "_system", None) or registered
+    if registered is system:
+        SharedSystemClient._identifer_to_system.pop(identifier, None)
+    if system is not None:
+        system.stop()
+
+_shared_stores: Dict[str, Chroma] = {}
+_shared_lock = threading.Lock()
+
+def close_vector_store(vectordb: VectorStore) -> None:
+    """Release the files or Chroma client behind an evicted store. Shared collections stay open."""
+    if isinstance(vectordb, NumpyVectorStore):
+        vectordb.close()
+        return
+    if any(vectordb is shared for shared in _shared_stores.values()):
+        return
+    release_client(getattr(vectordb, "_client", None))
+
+store_cache = UserStoreCache(on_evict=close_vector_store)
+
+def mark_user_store_changed(user_id: str) -> None:
+    """
+    For offline jobs: make every worker drop its open handle on the user's store and
+    reopen it on the next lookup. Shared collections are written in place and need none.
+    """
+    location = user_store_location(user_id)
+    if not location.startswith(_SHARED_PREFIX):
+        bump_generation(location)
+
+def shared_collection_name(user_id: str) -> str:
+    return f"memories_{zlib.crc32(str(user_id).encode('utf-8')) % SHARED_COLLECTIONS}"
+
+def _shared_store(name: str) -> Chroma:
+    with _shared_lock:
+        store = _shared_stores.get(name)
+        if store is None:
+            os.makedirs(SHARED_STORE_DIR, exist_ok=True)
+            store = _shared_stores[name] = Chroma(
+                collection_name=name,
+                persist_directory=SHARED_STORE_DIR,
+                embedding_function=_get_embeddings(),
+            )
+        return store
+
+def user_store_location(user_id: str) -> str:
+    """Cache key for where a user's memories live: a directory, or a shared collection."""
+    if VECTOR_STORE_MODE == "shared":
+        return _SHARED_PREFIX + shared_collection_name(user_id)
+    if VECTOR_STORE_MODE == "numpy":
+        return user_numpy_dir(user_id)
+    return user_chroma_dir(user_id)
+
+def open_user_store(user_id: str, location: str) -> Optional[VectorStore]:
+    if location.startswith(_SHARED_PREFIX):
+        return _shared_store(location[len(_SHARED_PREFIX):])
+    return load_vector_store(location)
+
+def user_filter(user_id: str) -> Optional[Dict[str, str]]:
+    """Metadata filter every query against a shared collection must carry."""
+    if VECTOR_STORE_MODE == "shared":
+        return {"user_id": str(user_id)}
+    return None
+
+@contextmanager
+def user_vector_store(user_id: str, persist_dir: Optional[str] = None) -> Iterator[Optional[VectorStore]]:
+    """
+    The user's open store from the process-wide cache, loaded on a miss and pinned for
+    the block so an eviction cannot close it mid-write. None if the user has no store.
+    """
+    if persist_dir is None or VECTOR_STORE_MODE == "shared":
+        location = user_store_location(user_id)
+    else:
+        location = persist_dir
+    if not location.startswith(_SHARED_PREFIX) and not os.path.exists(location):
+        yield None
+        return
+    with store_cache.lease(user_id, location, lambda: open_user_store(user_id, location)) as vectordb:
+        yield vectordb
+
+
+class UserScopedRetriever(VectorStoreRetriever):
+    """
+    Retriever pinned to one user. The user_id filter is always applied to the search and
+    any document whose metadata names another user is dropped before it reaches a prompt.
+    """
+
+    user_id: str
+
+    def _scoped(self, docs: List[Document]) -> List[Document]:
+        return [d for d in docs if str(d.metadata.get("user_id")) == self.user_id]
+
+    def _get_relevant_documents(self, query: str, *, run_manager) -> List[Document]:
+        return self._scoped(super()._get_relevant_documents(query, run_manager=run_manager))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager) -> List[Document]:
+        return self._scoped(await super()._aget_relevant_documents(query, run_manager=run_manager))
+
+
+def user_retriever(vectordb: VectorStore, user_id: str, k: int) -> VectorStoreRetriever:
+    scope = user_filter(user_id)
+    if scope is None:
+        return vectordb.as_retriever(search_kwargs={"k": k})
+    return UserScopedRetriever(
+        vectorstore=vectordb,
+        user_id=str(user_id),
+        search_kwargs={"k": k, "filter": scope},
+    )
+
 def embed_and_store(
         text: str,
         persist_dir: str,
@@ -40,7 +185,7 @@ def embed_and_store(
         chunk_overlap: int=100,
 )-> int:
     """
-    Split text and persist to Chroma at persist_dir. Return the number of chunks needed.
+    Split text and persist to the user's store at persist_dir. Return the number of chunks needed.
     """
     os.makedirs(persist_dir, exist_ok=True)
     
@@ -52,20 +197,97 @@ def embed_and_store(
         Document(page_content=chunk, metadata={"timestamp": ts, "user_id": user_id}) for chunk in chunks
     )
 
-    vectordb = Chroma.from_documents(
-        documents=documents,
-        embedding=_get_embeddings(),
-        persist_directory=persist_dir,
-    )
-    vectordb.persist()
+    with user_vector_store(user_id or "default", persist_dir) as vectordb:
+        vectordb.add_documents(list(documents))
+        vectordb.persist()
     return len(chunks)
 
+def format_turn(user_text: str, answer: str, ts: str) -> str:
+    """The text a user/assistant turn is embedded as."""
+    return f"[USER @ {ts}]\n{user_text}\n\n[ASSISTANT @ {ts}]\n{answer}"
 
-        
+def split_text(text: str, chunk_size: int=1000, chunk_overlap: int=100) -> List[str]:
+    splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return splitter.split_text(text)
 
+def chunk_epoch(metadata: Dict[str, Any]) -> Optional[float]:
+    """When a chunk was written: `ts_epoch` from the ingest queue, else the `timestamp` date."""
+    if metadata.get("ts_epoch") is not None:
+        return float(metadata["ts_epoch"])
+    stamp = metadata.get("timestamp")
+    if not stamp:
+        return None
+    try:
+        return datetime.fromisoformat(str(stamp)).replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
 
+def turn_chunks(
+        user_id: str,
+        user_message_id: int,
+        assistant_message_id: int,
+        user_text: str,
+        answer: str,
+        ts: datetime,
+) -> List[tuple]:
+    """(id, text, metadata) for each chunk of a turn. Ids come from the assistant message id."""
+    chunks = split_text(format_turn(user_text, answer, ts.isoformat()))
+    metadata = {
+        "timestamp": ts.date().isoformat(),
+        "ts_epoch": ts.timestamp(),
+        "user_id": str(user_id),
+        "user_message_id": user_message_id,
+        "assistant_message_id": assistant_message_id,
+    }
+    return [(f"turn-{assistant_message_id}-{i}", chunk, dict(metadata)) for i, chunk in enumerate(chunks)]
 
-                
+def upsert_embedded(
+        vectordb: VectorStore,
+        *,
+        ids: List[str],
+        texts: List[str],
+        vectors: List[List[float]],
+        metadatas: List[Dict[str, Any]],
+) -> None:
+    """Upsert already-embedded chunks into an open store, whatever its backend."""
+    if isinstance(vectordb, NumpyVectorStore):
+        vectordb.upsert_vectors(ids, texts, vectors, metadatas)
+        return
+    vectordb._collection.upsert(ids=ids, embeddings=vectors, documents=texts, metadatas=metadatas)
 
+def add_embedded(
+        user_id: str,
+        persist_dir: Optional[str] = None,
+        *,
+        ids: List[str],
+        texts: List[str],
+        vectors: List[List[float]],
+        metadatas: List[Dict[str, Any]],
+) -> None:
+    """Upsert already-embedded chunks into the user's store. Re-adding the same ids is a no-op."""
+    if persist_dir is not None and VECTOR_STORE_MODE != "shared":
+        os.makedirs(persist_dir, exist_ok=True)
+    if user_filter(user_id) is not None:
+        metadatas = [{**m, "user_id": str(user_id)} for m in metadatas]
+    with user_vector_store(user_id, persist_dir) as vectordb:
+        upsert_embedded(vectordb, ids=ids, texts=texts, vectors=vectors, metadatas=metadatas)
 
+def get_user_vectors(user_id: str, where: Optional[Dict[str, Any]] = None) -> Dict[str, list]:
+    """ids, documents and metadatas of a user's stored chunks, optionally filtered by metadata."""
+    scope = user_filter(user_id)
+    if scope is not None:
+        where = {"$and": [scope, where]} if where else scope
+    with user_vector_store(user_id) as vectordb:
+        if vectordb is None:
+            return {"ids": [], "documents": [], "metadatas": []}
+        if isinstance(vectordb, NumpyVectorStore):
+            return vectordb.get(where=where)
+        return vectordb._collection.get(where=where, include=["documents", "metadatas"])
 
+def delete_user_vectors(user_id: str, ids: List[str]) -> None:
+    """Delete chunks by id from a user's store. Callers get the ids from `get_user_vectors`."""
+    if not ids:
+        return
+    with user_vector_store(user_id) as vectordb:
+        if vectordb is not None:
+            vectordb.delete(ids=ids)
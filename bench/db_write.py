@@ -0,0 +1,154 @@
+"""
+Concurrent write benchmark for the database engine profile. Starts several processes (the
+gunicorn workers) that each run many concurrent chat turns against one database: write the
+user/assistant pair with its stats upsert in one transaction, then read recent history.
+
+    python -m bench.db_write --workers 4 --tasks 8 --seconds 20
+    python -m bench.db_write --journal-mode DELETE      # the pre-WAL behaviour, for comparison
+    DATABASE_URL=postgresql://... python -m bench.db_write --no-reset
+
+Every knob the engine reads from the environment (DB_POOL_SIZE, SQLITE_SYNCHRONOUS, ...)
+applies here too; `--journal-mode` is a shortcut for SQLITE_JOURNAL_MODE.
+"""
+from __future__ import annotations
+import os
+import time
+import asyncio
+import argparse
+import statistics
+import multiprocessing
+from typing import Any, Dict, List
+
+WORKER_USER_BASE = 900000
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def _run_worker(worker: int, tasks: int, seconds: float, payload: str) -> Dict[str, Any]:
+    from sqlalchemy import select
+    from sqlalchemy.exc import OperationalError
+    from app.conversation_stats import record_messages
+    from app.database import AsyncSessionLocal, async_engine, pool_stats
+    from app.models import ChatMessage
+
+    deadline = time.perf_counter() + seconds
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+
+    async def turn_loop(task: int) -> None:
+        user_id = WORKER_USER_BASE + worker * 1000 + task
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                async with AsyncSessionLocal() as db:
+                    rows = [
+                        ChatMessage(user_id=user_id, role="user", content=payload),
+                        ChatMessage(user_id=user_id, role="assistant", content=payload),
+                    ]
+                    db.add_all(rows)
+                    await db.flush()
+                    await record_messages(db, rows)
+                    await db.commit()
+                    await db.execute(
+                        select(ChatMessage.id)
+                        .where(ChatMessage.user_id == user_id)
+                        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+                        .limit(6)
+                    )
+            except OperationalError as e:
+                key = str(e.orig).splitlines()[0] if e.orig else type(e).__name__
+                errors[key] = errors.get(key, 0) + 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(turn_loop(t) for t in range(tasks)))
+    stats = pool_stats()["async"]
+    await async_engine.dispose()
+    return {"latencies": latencies, "errors": errors, "pool": stats}
+
+
+def _worker_main(worker: int, tasks: int, seconds: float, payload: str, out) -> None:
+    out.put(asyncio.run(_run_worker(worker, tasks, seconds, payload)))
+
+
+def _reset(database_url: str) -> None:
+    if database_url.startswith("sqlite"):
+        path = database_url.split("///", 1)[-1]
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Concurrent chat-turn write benchmark")
+    parser.add_argument("--db", default=None, help="DATABASE_URL; default sqlite:///./bench_writes.db")
+    parser.add_argument("--workers", type=int, default=4, help="Processes, like gunicorn workers")
+    parser.add_argument("--tasks", type=int, default=8, help="Concurrent turns per process")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--payload-bytes", type=int, default=400)
+    parser.add_argument("--journal-mode", default=None, help="Override SQLITE_JOURNAL_MODE (WAL, DELETE)")
+    parser.add_argument("--no-reset", action="store_true", help="Keep an existing SQLite file")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    database_url = args.db or os.getenv("DATABASE_URL") or "sqlite:///./bench_writes.db"
+    os.environ["DATABASE_URL"] = database_url
+    if args.journal_mode:
+        os.environ["SQLITE_JOURNAL_MODE"] = args.journal_mode
+    if not args.no_reset:
+        _reset(database_url)
+
+    # the parent only creates the schema; workers import the engine fresh under spawn
+    from app.database import engine, init_db
+    init_db()
+    engine.dispose()
+
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    payload = "x" * args.payload_bytes
+    procs = [
+        ctx.Process(target=_worker_main, args=(w, args.tasks, args.seconds, payload, out))
+        for w in range(args.workers)
+    ]
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    # workers start their clock after importing the app, so the run window is --seconds
+    elapsed = args.seconds
+
+    latencies = [l for r in results for l in r["latencies"]]
+    errors: Dict[str, int] = {}
+    for r in results:
+        for key, count in r["errors"].items():
+            errors[key] = errors.get(key, 0) + count
+    waits = [r["pool"]["wait_seconds_max"] for r in results]
+
+    print(f"database      {database_url}")
+    print(f"journal mode  {os.getenv('SQLITE_JOURNAL_MODE', 'WAL') if database_url.startswith('sqlite') else '-'}")
+    print(f"concurrency   {args.workers} workers x {args.tasks} tasks, {elapsed:.1f}s")
+    print(f"turns         {len(latencies)} ({len(latencies) / elapsed:.1f}/s, {2 * len(latencies) / elapsed:.1f} rows/s)")
+    if latencies:
+        print(
+            "latency ms    p50 %.1f  p95 %.1f  p99 %.1f  mean %.1f"
+            % tuple(x * 1000 for x in (
+                _percentile(latencies, 0.50), _percentile(latencies, 0.95),
+                _percentile(latencies, 0.99), statistics.fmean(latencies),
+            ))
+        )
+    print(f"pool wait ms  max {max(waits) * 1000:.1f}")
+    print(f"errors        {sum(errors.values())}")
+    for key, count in sorted(errors.items(), key=lambda kv: -kv[1]):
+        print(f"  {count:6d}  {key}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Offline stand-ins for the OpenAI chat and embedding models, for benchmarks. Replies and
+vectors are deterministic functions of the input, and each call sleeps for a configurable
+latency, so a run measures the service rather than OpenAI and network noise.
+
+    from bench.fakes import install_fakes
+    install_fakes(chat_latency=0.3, token_delay=0.01, embed_latency=0.05)
+
+Call it before the first request; every `get_chat_model` / `get_embeddings` after that
+returns the fakes.
+"""
+from __future__ import annotations
+import time
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+import app.clients
+from app.clients import ClientRegistry
+
+_WORDS = (
+    "you", "feel", "that", "is", "okay", "and", "it", "makes", "sense", "to", "take",
+    "a", "moment", "breathe", "notice", "what", "matters", "most", "right", "now",
+)
+
+
+class FakeChatModel(BaseChatModel):
+    """Answers with `reply_tokens` words chosen from a hash of the prompt."""
+
+    latency: float = 0.3
+    token_delay: float = 0.01
+    reply_tokens: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = "\n".join(str(m.content) for m in messages)
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        return [
+            (" " if i else "") + _WORDS[digest[i % len(digest)] % len(_WORDS)]
+            for i in range(self.reply_tokens)
+        ]
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._tokens(messages)
+        time.sleep(self.latency + self.token_delay * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.latency + self.token_delay * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for token in self._tokens(messages):
+            time.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for token in self._tokens(messages):
+            await asyncio.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    """Hash-seeded vectors; `latency` is paid once per call, like one API request."""
+
+    latency: float = 0.05
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return super().embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return super().embed_query(text)
+
+
+class FakeClientRegistry(ClientRegistry):
+    """A ClientRegistry that hands out the fakes and never needs an API key."""
+
+    def __init__(
+        self,
+        *,
+        chat_latency: float = 0.3,
+        token_delay: float = 0.01,
+        reply_tokens: int = 40,
+        embed_latency: float = 0.05,
+        embed_size: int = 256,
+    ):
+        super().__init__(api_key="bench")
+        self._embeddings = FakeEmbeddings(size=embed_size, latency=embed_latency)
+        self.chat_options: Dict[str, Any] = {
+            "latency": chat_latency,
+            "token_delay": token_delay,
+            "reply_tokens": reply_tokens,
+        }
+
+    def embeddings(self) -> FakeEmbeddings:
+        return self._embeddings
+
+    def chat_model(self, purpose: str = "answer") -> FakeChatModel:
+        llm = self._chat_models.get(purpose)
+        if llm is None:
+            llm = FakeChatModel(tags=[purpose], **self.chat_options)
+            with self._lock:
+                llm = self._chat_models.setdefault(purpose, llm)
+        return llm
+
+
+def install_fakes(**options: Any) -> FakeClientRegistry:
+    """Swap the worker's client registry for one serving the fakes."""
+    app.clients.registry = FakeClientRegistry(**options)
+    return app.clients.registry
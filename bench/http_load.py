@@ -0,0 +1,354 @@
+"""
+HTTP load benchmark. Boots `app.main:app` under uvicorn in a child process with the
+offline model stand-ins from bench.fakes, registers a pool of users, then drives a mix of
+login, chat, history and soul-settings requests at a fixed concurrency and reports
+p50/p95/p99 and req/s per endpoint.
+
+    python -m bench.http_load --users 50 --concurrency 32 --seconds 30 --out base.json
+    git checkout my-branch
+    python -m bench.http_load --users 50 --concurrency 32 --seconds 30 --compare base.json
+
+The mix is a list of endpoint=weight pairs, e.g. `--mix chat=1` for chat only;
+`chat_stream` is available but off by default. Each run gets a fresh SQLite database and
+DATA_DIR under --workdir unless DATABASE_URL is set. Engine and store knobs (DB_POOL_SIZE,
+VECTOR_STORE_MODE, RETRIEVAL_MODE, ...) are read from the environment as usual, so the same
+command compares configurations as well as commits.
+"""
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+import random
+import logging
+import shutil
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+from bench.db_write import _percentile
+
+DEFAULT_MIX = "chat=4,history=3,soul_get=1,soul_put=1,login=1"
+ENDPOINTS = ("login", "chat", "chat_stream", "history", "soul_get", "soul_put")
+PASSWORD = "bench-password"
+PROMPTS = (
+    "I have been feeling anxious about work lately.",
+    "Can you help me think through a hard conversation with my sister?",
+    "What did we talk about last time?",
+    "Why does that keep happening?",
+    "I slept badly again and I feel flat today.",
+    "How can I be kinder to myself when I make mistakes?",
+)
+
+
+# -- server --------------------------------------------------------------------
+
+def _serve(port: int, env: Dict[str, str], fakes: Dict[str, Any], log_level: str) -> None:
+    os.environ.update(env)
+    from bench.fakes import install_fakes
+    install_fakes(**fakes)
+    import uvicorn
+    from app.main import app
+    # app.chains configures INFO logging on import; per-turn lines would swamp the run
+    logging.getLogger().setLevel(log_level.upper())
+    uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level=log_level)).run()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_ready(base_url: str, proc: multiprocessing.Process, timeout: float = 60.0) -> None:
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.perf_counter() < deadline:
+            if not proc.is_alive():
+                raise SystemExit("Server process exited during startup")
+            try:
+                if (await client.get("/")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit("Server did not start within %.0fs" % timeout)
+
+
+# -- load ----------------------------------------------------------------------
+
+class Recorder:
+    """Latencies and failures per endpoint, kept only inside the measured window."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.errors: Dict[str, Dict[str, int]] = {name: {} for name in ENDPOINTS}
+        self.recording = False
+
+    def add(self, endpoint: str, seconds: float, error: Optional[str]) -> None:
+        if not self.recording:
+            return
+        if error is None:
+            self.latencies[endpoint].append(seconds)
+        else:
+            errors = self.errors[endpoint]
+            errors[error] = errors.get(error, 0) + 1
+
+
+def _parse_mix(mix: str) -> Tuple[List[str], List[float]]:
+    names, weights = [], []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint {name!r} in --mix; choose from {', '.join(ENDPOINTS)}")
+        if float(weight or 1) > 0:
+            names.append(name)
+            weights.append(float(weight or 1))
+    if not names:
+        raise SystemExit("--mix has no endpoint with a positive weight")
+    return names, weights
+
+
+async def _register(client: httpx.AsyncClient, email: str) -> str:
+    r = await client.post("/auth/register", json={"email": email, "password": PASSWORD})
+    if r.status_code not in (201, 400, 409):
+        raise SystemExit(f"Registering {email} failed: {r.status_code} {r.text}")
+    r = await client.post("/auth/login", json={"email": email, "password": PASSWORD})
+    if r.status_code != 200:
+        raise SystemExit(f"Logging in {email} failed: {r.status_code} {r.text}")
+    return r.json()["access_token"]
+
+
+async def _call(client: httpx.AsyncClient, endpoint: str, email: str, token: str, rng: random.Random) -> Optional[str]:
+    """Send one request; returns None on success or a short error key."""
+    headers = {"Authorization": f"Bearer {token}"}
+    if endpoint == "login":
+        r = await client.post("/auth/login", json={"email": email, "password": PASSWORD})
+    elif endpoint == "chat":
+        r = await client.post("/chat", json={"text": rng.choice(PROMPTS)}, headers=headers)
+        # /chat answers 200 with a fallback text when generation fails; the metadata is missing then
+        if r.status_code == 200 and not r.json().get("metadata"):
+            return "fallback"
+    elif endpoint == "chat_stream":
+        async with client.stream("POST", "/chat/stream", json={"text": rng.choice(PROMPTS)}, headers=headers) as r:
+            body = b"".join([chunk async for chunk in r.aiter_bytes()])
+        if r.status_code == 200 and b"event: done" not in body:
+            return "stream error"
+    elif endpoint == "history":
+        r = await client.get("/history/history/", params={"limit": 20}, headers=headers)
+    elif endpoint == "soul_get":
+        r = await client.get("/soul/settings", headers=headers)
+    else:
+        r = await client.put("/soul/settings", json={"empathy_level": rng.randint(1, 10)}, headers=headers)
+    return None if r.status_code < 400 else str(r.status_code)
+
+
+async def run_load(base_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    names, weights = _parse_mix(args.mix)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(args.request_timeout)
+    recorder = Recorder()
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def register(i: int) -> Tuple[str, str]:
+            email = f"bench-{i}@example.com"
+            async with semaphore:
+                return email, await _register(client, email)
+
+        users = await asyncio.gather(*(register(i) for i in range(args.users)))
+        setup_seconds = time.perf_counter() - started
+
+        stop = asyncio.Event()
+
+        async def virtual_user(worker: int) -> None:
+            rng = random.Random(args.seed + worker)
+            while not stop.is_set():
+                email, token = users[rng.randrange(len(users))]
+                endpoint = rng.choices(names, weights)[0]
+                t0 = time.perf_counter()
+                try:
+                    error = await _call(client, endpoint, email, token, rng)
+                except httpx.HTTPError as e:
+                    error = type(e).__name__
+                recorder.add(endpoint, time.perf_counter() - t0, error)
+
+        tasks = [asyncio.create_task(virtual_user(w)) for w in range(args.concurrency)]
+        await asyncio.sleep(args.warmup)
+        recorder.recording = True
+        window_start = time.perf_counter()
+        await asyncio.sleep(args.seconds)
+        recorder.recording = False
+        window = time.perf_counter() - window_start
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    return _summarize(recorder, window, setup_seconds)
+
+
+def _endpoint_summary(latencies: List[float], errors: Dict[str, int], window: float) -> Dict[str, Any]:
+    ms = lambda seconds: round(seconds * 1000, 2)
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors.values()),
+        "error_kinds": errors,
+        "rps": round(len(latencies) / window, 2),
+        "p50_ms": ms(_percentile(latencies, 0.50)),
+        "p95_ms": ms(_percentile(latencies, 0.95)),
+        "p99_ms": ms(_percentile(latencies, 0.99)),
+        "mean_ms": ms(statistics.fmean(latencies)) if latencies else 0.0,
+    }
+
+
+def _summarize(recorder: Recorder, window: float, setup_seconds: float) -> Dict[str, Any]:
+    endpoints = {
+        name: _endpoint_summary(recorder.latencies[name], recorder.errors[name], window)
+        for name in ENDPOINTS
+        if recorder.latencies[name] or recorder.errors[name]
+    }
+    every = [l for name in ENDPOINTS for l in recorder.latencies[name]]
+    errors: Dict[str, int] = {}
+    for name in ENDPOINTS:
+        for kind, count in recorder.errors[name].items():
+            errors[f"{name} {kind}"] = count
+    return {
+        "window_seconds": round(window, 2),
+        "setup_seconds": round(setup_seconds, 2),
+        "endpoints": endpoints,
+        "total": _endpoint_summary(every, errors, window),
+    }
+
+
+# -- reporting -----------------------------------------------------------------
+
+def _git_revision() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+
+def _print_table(result: Dict[str, Any]) -> None:
+    print(f"{'endpoint':<12} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    rows = list(result["endpoints"].items()) + [("total", result["total"])]
+    for name, s in rows:
+        print(
+            f"{name:<12} {s['requests']:>8} {s['errors']:>6} {s['rps']:>8.1f} "
+            f"{s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f}"
+        )
+    for kind, count in sorted(result["total"]["error_kinds"].items(), key=lambda kv: -kv[1]):
+        print(f"  {count:6d}  {kind}")
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], max_regression: Optional[float]) -> List[str]:
+    """Print per-endpoint changes against a baseline; returns the regressions past the limit."""
+    def change(new: float, old: float) -> float:
+        return (new - old) / old * 100 if old else 0.0
+
+    meta = baseline.get("meta", {})
+    print(f"\nagainst {meta.get('commit') or 'baseline'} ({meta.get('created_at', '?')})")
+    print(f"{'endpoint':<12} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    regressions = []
+    names = [n for n in result["endpoints"] if n in baseline.get("endpoints", {})] + ["total"]
+    for name in names:
+        new = result["total"] if name == "total" else result["endpoints"][name]
+        old = baseline["total"] if name == "total" else baseline["endpoints"][name]
+        rps = change(new["rps"], old["rps"])
+        p50, p95, p99 = (change(new[k], old[k]) for k in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"{name:<12} {rps:>+8.1f}% {p50:>+8.1f}% {p95:>+8.1f}% {p99:>+8.1f}%")
+        if max_regression is not None and (p95 > max_regression or -rps > max_regression):
+            regressions.append(f"{name}: req/s {rps:+.1f}%, p95 {p95:+.1f}%")
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="HTTP load benchmark with offline model stand-ins")
+    parser.add_argument("--users", type=int, default=20, help="Registered users the requests are spread over")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight")
+    parser.add_argument("--seconds", type=float, default=20.0, help="Measured window")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Unmeasured load before the window")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"endpoint=weight pairs; default {DEFAULT_MIX}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--chat-latency", type=float, default=0.3, help="Fake model seconds to first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Fake model seconds per token")
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Fake embeddings seconds per call")
+    parser.add_argument("--server-log-level", default="error")
+    parser.add_argument("--workdir", default=None, help="Database and DATA_DIR location; default a temp dir")
+    parser.add_argument("--keep", action="store_true", help="Keep the work directory afterwards")
+    parser.add_argument("--out", default=None, help="Write the result as a JSON baseline")
+    parser.add_argument("--compare", default=None, help="Baseline JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="With --compare, exit 1 if p95 rises or req/s drops by more than this percent")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    _parse_mix(args.mix)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench-http-")
+    os.makedirs(workdir, exist_ok=True)
+    env = {
+        "DATABASE_URL": os.getenv("DATABASE_URL") or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "DATA_DIR": os.path.join(workdir, "data"),
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY") or "bench",
+        "ANONYMIZED_TELEMETRY": os.getenv("ANONYMIZED_TELEMETRY", "False"),
+    }
+    fakes = {
+        "chat_latency": args.chat_latency,
+        "token_delay": args.token_delay,
+        "reply_tokens": args.reply_tokens,
+        "embed_latency": args.embed_latency,
+    }
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = multiprocessing.get_context("spawn").Process(target=_serve, args=(port, env, fakes, args.server_log_level))
+    server.start()
+    try:
+        asyncio.run(_wait_ready(base_url, server))
+        result = asyncio.run(run_load(base_url, args))
+    finally:
+        server.terminate()  # SIGTERM: uvicorn runs the lifespan shutdown
+        server.join(30)
+        if server.is_alive():
+            server.kill()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result["meta"] = {
+        **_git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "database": env["DATABASE_URL"].split(":", 1)[0],
+        "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "keep", "workdir", "server_log_level")},
+    }
+    _print_table(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nwrote {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.max_regression)
+        if regressions:
+            print("\nregressions past %.0f%%:" % args.max_regression)
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Startup benchmark: how long a fresh interpreter takes to import the app, and where the
+time goes. Each run is a new `python -X importtime` process, so nothing is cached in
+sys.modules; the report groups self time by top-level package and flags the heavy
+packages (LangChain, OpenAI, Chroma, ...) that a worker should only load on its first
+chat turn.
+
+    python -m bench.import_time --runs 5 --out startup.json
+    python -m bench.import_time --compare startup.json --max-regression 15
+    python -m bench.import_time --module app.chains      # what the first chat turn adds
+"""
+from __future__ import annotations
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from bench.http_load import _git_revision
+
+# loaded lazily by the chat path (passlib by the password pool's processes);
+# importing app.main should pull in none of these
+HEAVY_PACKAGES = (
+    "langchain", "langchain_core", "langchain_community", "langchain_openai",
+    "openai", "chromadb", "numpy", "tiktoken", "httpx", "passlib",
+)
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def _run_once(module: str, env: Dict[str, str]) -> Tuple[float, List[Tuple[str, int, int]]]:
+    """Wall seconds for the import, and (module, self_us, cumulative_us) per imported module."""
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; "
+        "print(time.perf_counter() - t)"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, env=env,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            rows.append((match.group(4), int(match.group(1)), int(match.group(2))))
+    return float(proc.stdout.strip().splitlines()[-1]), rows
+
+
+def measure(module: str, runs: int) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="bench-import-")
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [os.getcwd(), os.getenv("PYTHONPATH")])),
+        # importing must not touch a real database or data directory
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'import.db')}",
+        "DATA_DIR": os.path.join(workdir, "data"),
+    }
+    walls: List[float] = []
+    by_package: Dict[str, List[int]] = defaultdict(list)
+    slowest: Dict[str, List[int]] = defaultdict(list)
+    modules_loaded = set()
+    try:
+        for _ in range(runs):
+            wall, rows = _run_once(module, env)
+            walls.append(wall)
+            totals: Dict[str, int] = defaultdict(int)
+            for name, self_us, cumulative_us in rows:
+                totals[name.split(".")[0]] += self_us
+                slowest[name].append(self_us)
+                modules_loaded.add(name)
+            for package, us in totals.items():
+                by_package[package].append(us)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    packages = {
+        package: round(statistics.median(values) / 1000, 1)
+        for package, values in by_package.items()
+    }
+    return {
+        "module": module,
+        "runs": runs,
+        "wall_ms": {
+            "median": round(statistics.median(walls) * 1000, 1),
+            "min": round(min(walls) * 1000, 1),
+            "max": round(max(walls) * 1000, 1),
+        },
+        "modules": len(modules_loaded),
+        "packages_ms": dict(sorted(packages.items(), key=lambda kv: -kv[1])),
+        "slowest_modules_ms": dict(sorted(
+            ((name, round(statistics.median(values) / 1000, 1)) for name, values in slowest.items()),
+            key=lambda kv: -kv[1],
+        )[:25]),
+        "heavy_loaded": sorted(p for p in HEAVY_PACKAGES if p in packages),
+    }
+
+
+def _print_report(result: Dict[str, Any], top: int) -> None:
+    wall = result["wall_ms"]
+    print(f"import {result['module']}: median {wall['median']:.0f} ms "
+          f"(min {wall['min']:.0f}, max {wall['max']:.0f}) over {result['runs']} runs, "
+          f"{result['modules']} modules")
+    print(f"\n{'package':<28} {'self ms':>8}")
+    for package, ms in list(result["packages_ms"].items())[:top]:
+        print(f"{package:<28} {ms:>8.1f}")
+    print(f"\n{'module':<48} {'self ms':>8}")
+    for name, ms in list(result["slowest_modules_ms"].items())[:top]:
+        print(f"{name:<48} {ms:>8.1f}")
+    heavy = result["heavy_loaded"]
+    print(f"\nheavy packages loaded: {', '.join(heavy) if heavy else 'none'}")
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], max_regression: Optional[float]) -> List[str]:
+    old, new = baseline["wall_ms"]["median"], result["wall_ms"]["median"]
+    change = (new - old) / old * 100 if old else 0.0
+    meta = baseline.get("meta", {})
+    print(f"\nagainst {meta.get('commit') or 'baseline'} ({meta.get('created_at', '?')}): "
+          f"{old:.0f} ms -> {new:.0f} ms ({change:+.1f}%)")
+    regressions = []
+    newly_heavy = sorted(set(result["heavy_loaded"]) - set(baseline.get("heavy_loaded", [])))
+    if newly_heavy:
+        print(f"newly loaded heavy packages: {', '.join(newly_heavy)}")
+        regressions.append(f"imports {', '.join(newly_heavy)}")
+    if max_regression is not None and change > max_regression:
+        regressions.append(f"median import time {change:+.1f}%")
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Import-time startup benchmark")
+    parser.add_argument("--module", default="app.main", help="Module to import; default app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12, help="Rows per table")
+    parser.add_argument("--out", default=None, help="Write the result as a JSON baseline")
+    parser.add_argument("--compare", default=None, help="Baseline JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="With --compare, exit 1 if the median import time rises by more than this percent")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    result = measure(args.module, args.runs)
+    result["meta"] = {
+        **_git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+    }
+    _print_report(result, args.top)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nwrote {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.max_regression)
+        if regressions:
+            print("\nregressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
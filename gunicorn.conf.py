@@ -0,0 +1,14 @@
+"""
+Gunicorn settings read from the working directory. The schema is created once here in
+the master before any worker forks, instead of in every worker as it starts.
+"""
+import os
+
+
+def on_starting(server):
+    from app.database import engine, init_db
+
+    init_db()
+    # workers inherit this module state through fork; don't hand them open connections
+    engine.dispose()
+    os.environ["DB_INIT_ON_STARTUP"] = "0"
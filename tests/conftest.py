@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+import itertools
+import pytest
+
+# app modules read their settings at import time, so point them at a scratch area first
+_TMP = tempfile.mkdtemp(prefix="soul-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TMP, 'test.db')}")
+os.environ.setdefault("DATA_DIR", os.path.join(_TMP, "data"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_emails = itertools.count()
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def auth_headers(client):
+    email = f"user{next(_emails)}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "test-password"})
+    assert r.status_code == 201, r.text
+    r = client.post("/auth/login", json={"email": email, "password": "test-password"})
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
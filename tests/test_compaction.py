@@ -0,0 +1,18 @@
+from app.compaction import compaction_policy
+
+
+def test_higher_aggressiveness_compacts_more():
+    policies = [compaction_policy(level) for level in range(1, 11)]
+    keep_days = [keep for keep, _ in policies]
+    windows = [window for _, window in policies]
+    assert keep_days == sorted(keep_days, reverse=True)
+    assert len(set(keep_days)) == 10
+    assert windows == sorted(windows)
+    assert compaction_policy(1) == (70, 1)
+    assert compaction_policy(10) == (7, 30)
+
+
+def test_policy_defaults_and_clamps():
+    assert compaction_policy(None) == compaction_policy(5)
+    assert compaction_policy(-3) == compaction_policy(1)
+    assert compaction_policy(42) == compaction_policy(10)
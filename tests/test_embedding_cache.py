@@ -0,0 +1,34 @@
+from app.embedding_cache import _DiskStore
+
+
+def _changes(store):
+    return store._conn.total_changes
+
+
+def test_hits_only_refresh_stale_last_used(tmp_path):
+    store = _DiskStore(str(tmp_path / "cache.sqlite3"), max_rows=100, touch_seconds=3600)
+    store.put_many({"fresh": [1.0, 2.0], "stale": [3.0, 4.0]})
+    store._conn.execute("UPDATE embeddings SET last_used = last_used - 7200 WHERE key = 'stale'")
+    store._conn.commit()
+
+    before = _changes(store)
+    assert store.get_many(["fresh", "stale", "missing"]) == {"fresh": [1.0, 2.0], "stale": [3.0, 4.0]}
+    assert _changes(store) - before == 1
+
+    before = _changes(store)
+    store.get_many(["fresh", "stale"])
+    assert _changes(store) == before
+    store.close()
+
+
+def test_trim_counts_rows_written_by_other_workers(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    ours = _DiskStore(path, max_rows=10, recount_rows=5)
+    other = _DiskStore(path, max_rows=10, recount_rows=5)
+    other.put_many({f"other-{i}": [float(i)] for i in range(10)})
+    # our estimate starts at 0; the recount after 5 inserts sees 15 rows and trims
+    ours.put_many({f"ours-{i}": [float(i)] for i in range(5)})
+    assert ours._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 10
+    assert ours.row_count() == 10
+    ours.close()
+    other.close()
@@ -0,0 +1,23 @@
+import json
+
+
+def _export(client, headers):
+    r = client.get("/history/history/export", headers=headers)
+    assert r.status_code == 200
+    return [json.loads(line) for line in r.text.splitlines()]
+
+
+def test_import_converts_offsets_to_utc(client, auth_headers):
+    body = "\n".join(json.dumps(line) for line in [
+        {"role": "user", "content": "from India", "timestamp": "2026-01-01T10:00:00+05:30"},
+        {"role": "assistant", "content": "naive", "timestamp": "2026-01-01T05:00:00"},
+    ])
+    r = client.post("/history/history/import", content=body, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    assert r.json()["imported"] == 2
+
+    rows = _export(client, auth_headers)
+    # 10:00+05:30 is 04:30 UTC, so it sorts before the naive 05:00 UTC row
+    assert [row["content"] for row in rows] == ["from India", "naive"]
+    assert rows[0]["timestamp"].startswith("2026-01-01T04:30:00")
+    assert rows[1]["timestamp"].startswith("2026-01-01T05:00:00")
@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+import app.clients
+from bench.fakes import FakeClientRegistry
+from app import retention
+from app.conversation_stats import delete_messages
+from app.database import AsyncSessionLocal, async_engine, init_db
+from app.ingest import IngestQueue
+from app.models import ChatMessage, User
+from app.vector_store import get_user_vectors
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    init_db()
+    monkeypatch.setattr(app.clients, "registry", FakeClientRegistry(embed_latency=0))
+    q = IngestQueue(spool_dir=str(tmp_path / "spool"), flush_seconds=3600)
+    monkeypatch.setattr(retention, "ingest_queue", q)
+    return q
+
+
+async def _chat_turn(db, email):
+    user = User(email=email, hashed_password="x")
+    db.add(user)
+    await db.flush()
+    question = ChatMessage(user_id=user.id, role="user", content="I slept badly again")
+    answer = ChatMessage(user_id=user.id, role="assistant", content="That sounds exhausting")
+    db.add_all([question, answer])
+    await db.commit()
+    return user.id, question, answer
+
+
+def _enqueue(queue, user_id, question, answer):
+    queue.enqueue(
+        user_id=str(user_id),
+        user_message_id=question.id,
+        assistant_message_id=answer.id,
+        user_text=question.content,
+        answer=answer.content,
+    )
+
+
+def _spooled(queue):
+    with open(queue._spool_path, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_purge_drops_queued_turns_before_they_are_embedded(queue):
+    async def scenario():
+        await queue.start()
+        async with AsyncSessionLocal() as db:
+            user_id, question, answer = await _chat_turn(db, "purge-queued@example.com")
+            kept_id, kept_q, kept_a = await _chat_turn(db, "purge-kept@example.com")
+            _enqueue(queue, user_id, question, answer)
+            _enqueue(queue, kept_id, kept_q, kept_a)
+
+            await retention.purge_history(db, user_id)
+            assert f'"user_id": "{user_id}"' not in _spooled(queue)
+        await queue.stop()
+        await async_engine.dispose()
+        return user_id, kept_id
+
+    user_id, kept_id = asyncio.run(scenario())
+    assert get_user_vectors(str(user_id))["ids"] == []
+    assert len(get_user_vectors(str(kept_id))["ids"]) == 1
+    assert queue.stats()["discarded"] == 1
+
+
+def test_flush_skips_turns_whose_messages_are_gone(queue):
+    async def scenario():
+        await queue.start()
+        async with AsyncSessionLocal() as db:
+            user_id, question, answer = await _chat_turn(db, "purge-replayed@example.com")
+            _enqueue(queue, user_id, question, answer)
+            # deleted without going through this queue, e.g. by another worker
+            await delete_messages(db, user_id)
+            await db.commit()
+        await queue.stop()
+        await async_engine.dispose()
+        return user_id
+
+    user_id = asyncio.run(scenario())
+    assert get_user_vectors(str(user_id))["ids"] == []
+    stats = queue.stats()
+    assert (stats["skipped_deleted"], stats["flushed_turns"], stats["batches"], stats["depth"]) == (1, 0, 1, 0)
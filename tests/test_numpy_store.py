@@ -0,0 +1,25 @@
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from app.numpy_store import NumpyVectorStore
+
+
+def _store(path):
+    return NumpyVectorStore(str(path), DeterministicFakeEmbedding(size=4))
+
+
+def test_torn_tail_is_cut_even_when_another_handle_appended(tmp_path):
+    first, second = _store(tmp_path), _store(tmp_path)
+    first.upsert_vectors(["a"], ["a"], [[1, 0, 0, 0]])
+    second.upsert_vectors(["b"], ["b"], [[0, 1, 0, 0]])
+    # a writer crashed after its vector bytes but before the metadata line
+    with open(first._file("vectors"), "ab") as f:
+        f.write(np.asarray([[9, 9]], dtype=np.float32).tobytes())
+    with open(first._file("meta"), "ab") as f:
+        f.write(b'{"id": "torn"')
+
+    # first's append handle still points at the end of its own write
+    first.upsert_vectors(["c"], ["c"], [[0, 0, 1, 0]])
+
+    reopened = _store(tmp_path)
+    assert reopened._ids == ["a", "b", "c"]
+    assert np.array_equal(np.asarray(reopened._matrix), np.eye(4, dtype=np.float32)[:3])
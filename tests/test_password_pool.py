@@ -0,0 +1,23 @@
+import asyncio
+import pytest
+from app.password_pool import PasswordPool
+
+
+def _ok(value):
+    return value
+
+
+def _boom(value):
+    raise ValueError(value)
+
+
+def test_failures_are_not_counted_as_completed():
+    pool = PasswordPool(workers=1, max_queue=4)
+    try:
+        assert asyncio.run(pool._run(_ok, "x")) == "x"
+        with pytest.raises(ValueError):
+            asyncio.run(pool._run(_boom, "y"))
+        stats = pool.stats()
+        assert (stats["completed"], stats["failed"], stats["in_flight"]) == (1, 1, 0)
+    finally:
+        pool.shutdown()
@@ -0,0 +1,44 @@
+import app.clients
+from bench.fakes import FakeClientRegistry
+from app import rebuild_vectors
+from app.database import SessionLocal, init_db
+from app.models import ChatMessage, User
+from app.vector_store import get_user_vectors
+
+
+def _turn(db, user_id, text):
+    question = ChatMessage(user_id=user_id, role="user", content=text)
+    answer = ChatMessage(user_id=user_id, role="assistant", content=f"Tell me more about {text}")
+    db.add(question)
+    db.flush()
+    db.add(answer)
+    db.commit()
+    return answer.id
+
+
+def test_turns_saved_during_a_rebuild_are_replayed(monkeypatch):
+    init_db()
+    monkeypatch.setattr(app.clients, "registry", FakeClientRegistry(embed_latency=0))
+    with SessionLocal() as db:
+        user = User(email="rebuild-catch-up@example.com", hashed_password="x")
+        db.add(user)
+        db.commit()
+        user_id = user.id
+        first = _turn(db, user_id, "my sister")
+
+    read = rebuild_vectors.iter_turns
+    passes = []
+
+    def iter_turns(uid):
+        yield from read(uid)
+        if not passes:
+            # chatted after the main pass read the history, before the swap
+            with SessionLocal() as db:
+                passes.append(_turn(db, uid, "my new job"))
+
+    monkeypatch.setattr(rebuild_vectors, "iter_turns", iter_turns)
+    result = rebuild_vectors.rebuild_user(user_id)
+
+    ids = set(get_user_vectors(str(user_id))["ids"])
+    assert (result["turns"], result["caught_up"]) == (2, 1)
+    assert {f"turn-{first}-0", f"turn-{passes[0]}-0"} <= ids
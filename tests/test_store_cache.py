@@ -0,0 +1,99 @@
+import os
+import threading
+from app.store_cache import UserStoreCache
+
+
+class _Store:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+
+def _cache(**options):
+    closed = []
+
+    def on_evict(store):
+        store.closed = True
+        closed.append(store.name)
+
+    return UserStoreCache(on_evict=on_evict, **options), closed
+
+
+def test_budget_eviction_skips_checked_out_entries(tmp_path):
+    cache, closed = _cache(max_entries=1)
+    entry = cache.checkout("1", str(tmp_path / "1"), lambda: _Store("1"))
+    cache.get_store("2", str(tmp_path / "2"), lambda: _Store("2"))
+    cache.get_store("3", str(tmp_path / "3"), lambda: _Store("3"))
+    assert closed == ["2"]
+    assert not entry.store.closed
+    cache.checkin(entry)
+
+
+def test_invalidate_while_in_flight_defers_release(tmp_path):
+    cache, closed = _cache()
+    opened = threading.Event()
+    finish = threading.Event()
+    seen = {}
+
+    def request():
+        with cache.lease("1", str(tmp_path), lambda: _Store("old")) as store:
+            opened.set()
+            finish.wait(5)
+            seen["closed_during_request"] = store.closed
+
+    worker = threading.Thread(target=request)
+    worker.start()
+    assert opened.wait(5)
+
+    cache.invalidate("1")
+    assert closed == []
+    # a new request gets a fresh store while the old one is still in use
+    assert cache.get_store("1", str(tmp_path), lambda: _Store("new")).name == "new"
+
+    finish.set()
+    worker.join(5)
+    assert seen["closed_during_request"] is False
+    assert closed == ["old"]
+    assert cache.stats()["deferred_releases"] == 1
+
+
+def test_drop_keeps_a_held_user_lock(tmp_path):
+    cache, _ = _cache()
+    cache.get_store("1", str(tmp_path), lambda: _Store("1"))
+    lock = cache._user_lock("1")
+    with lock:
+        cache.invalidate("1")
+        assert cache._user_lock("1") is lock
+    cache.get_store("1", str(tmp_path), lambda: _Store("1"))
+    cache.invalidate("1")
+    assert "1" not in cache._user_locks
+
+
+def test_release_happens_once(tmp_path):
+    cache, closed = _cache()
+    entry = cache.checkout("1", str(tmp_path), lambda: _Store("1"))
+    cache.invalidate("1")
+    cache.checkin(entry)
+    cache.clear()
+    assert closed == ["1"]
+
+
+def test_store_changed_by_another_process_is_reopened(tmp_path):
+    from app.store_cache import bump_generation
+
+    cache, closed = _cache()
+    path = str(tmp_path / "store")
+    os.makedirs(path)
+    assert cache.get_store("1", path, lambda: _Store("before")).name == "before"
+    assert cache.get_store("1", path, lambda: _Store("unused")).name == "before"
+
+    bump_generation(path)
+    assert cache.get_store("1", path, lambda: _Store("after")).name == "after"
+    assert closed == ["before"]
+
+    # a rebuild swaps in a new directory under the same path
+    os.rename(path, path + ".old")
+    os.makedirs(path)
+    assert cache.get_store("1", path, lambda: _Store("rebuilt")).name == "rebuilt"
+    assert closed == ["before", "after"]
+    assert cache.stats()["stale_reopens"] == 2